@@ -24,10 +24,6 @@ if lib_path not in sys.path:
     sys.path.insert(0, lib_path)
 
 import logic_angles
-from assist_controller import AssistController
-from ui_measure import MeasureUI
-from ui_export import ExportUI
-from ui_auto import AutoUI
 
 
 class SagittalMeasureAssist(ScriptedLoadableModule):
@@ -53,6 +49,13 @@ class SagittalMeasureAssistWidget(ScriptedLoadableModuleWidget):
     def setup(self):
         ScriptedLoadableModuleWidget.setup(self)
 
+        # UI/controller modules are imported here (not at module discovery) so Slicer startup
+        # stays light; inference logic is imported even later, on first use.
+        from assist_controller import AssistController
+        from ui_measure import MeasureUI
+        from ui_export import ExportUI
+        from ui_auto import AutoUI
+
         self.logic = SagittalMeasureAssistLogic()
 
         # UI sections
@@ -65,6 +68,10 @@ class SagittalMeasureAssistWidget(ScriptedLoadableModuleWidget):
 
         self.layout.addStretch(1)
 
+    def cleanup(self):
+        if hasattr(self, "controller"):
+            self.controller.cleanup()
+
 
 class SagittalMeasureAssistLogic(ScriptedLoadableModuleLogic):
     """Geometry computations for sagittal parameters."""
@@ -72,6 +79,9 @@ class SagittalMeasureAssistLogic(ScriptedLoadableModuleLogic):
     def compute_angles_from_points(self, points):
         return logic_angles.compute_angles_from_points(points)
 
+    def compute_angle(self, name, points):
+        return logic_angles.compute_angle(name, points)
+
 
 class SagittalMeasureAssistTest(ScriptedLoadableModuleTest):
     """Basic tests for the logic class."""
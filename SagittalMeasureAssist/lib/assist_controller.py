@@ -1,12 +1,34 @@
 import logging
 import math
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor
 
+import numpy as np
 import qt
 import slicer
+import vtk
 
+from logic_angles import ANGLE_DEPENDENCIES, ANGLE_NAMES, angles_affected_by
 from logic_export import ExportLogic, REQUIRED_LABELS_ORDERED
-from logic_inference import OnnxInferenceLogic
+from worklist import load_worklist
+
+# 前回のモデル設定を保持するSlicer設定キー
+SETTINGS_MODEL_PATH = "SagittalMeasureAssist/ModelPath"
+SETTINGS_INPUT_HEIGHT = "SagittalMeasureAssist/InputHeight"
+SETTINGS_INPUT_WIDTH = "SagittalMeasureAssist/InputWidth"
+SETTINGS_WORKLIST_PATH = "SagittalMeasureAssist/WorklistPath"
+
+# 一括推論で作るノード
+SOURCE_VOLUME_ATTRIBUTE = "SagittalMeasureAssist.SourceVolumeID"
+SOURCE_FRAME_ATTRIBUTE = "SagittalMeasureAssist.SourceFrame"
+RESULTS_TABLE_NAME = "SagittalMeasureAssist_Results"
+
+# 公開先のONNXが差し替えられたか（finetune_daemon.py）を確認する間隔（ms）
+MODEL_WATCH_INTERVAL_MS = 5000
+
+# ライブ計測：ドラッグ中の連続イベントをこの間隔（ms）でまとめて再計算する
+LIVE_UPDATE_INTERVAL_MS = 50
 
 
 class AssistController:
@@ -21,21 +43,65 @@ class AssistController:
         self.auto_ui = auto_ui
         self.logic = logic
         self.counter = 1
-        self.infer = OnnxInferenceLogic()
+        self._infer = None
+        # ライブ計測の状態（監視中のMarkups、オブザーバ、次回再計算する移動済みランドマーク）
+        self._observedMarkup = None
+        self._observerTags = []
+        self._pendingLandmarks = set()
+        self._liveTimer = qt.QTimer()
+        self._liveTimer.setSingleShot(True)
+        self._liveTimer.setInterval(LIVE_UPDATE_INTERVAL_MS)
+        self._liveTimer.timeout.connect(self._onLiveUpdateTimeout)
+        # モデルファイルの差し替えを監視し、検出したらバックグラウンドで再ロードする
+        self._modelWatchTimer = qt.QTimer()
+        self._modelWatchTimer.setInterval(MODEL_WATCH_INTERVAL_MS)
+        self._modelWatchTimer.timeout.connect(self._checkModelUpdate)
+        self._modelWatchTimer.start()
+        self._modelReloading = False
+        # 一括推論（ワーカースレッド）の完了をイベントループを止めずに確認する
+        self._batchTimer = qt.QTimer()
+        self._batchTimer.setInterval(50)
+        self._batchTimer.timeout.connect(self._onBatchPoll)
+        self._batchJob = None
+        # Volumeが削除されたら前処理キャッシュから捨てる
+        self._sceneObserverTag = slicer.mrmlScene.AddObserver(slicer.mrmlScene.NodeRemovedEvent, self._onNodeRemoved)
+        # 読み込んだワークリストの項目（リスト表示と同じ順）
+        self._worklist = []
         self._connect_signals()
+        self._observeMarkup()
         self._update_counter_preview()
+        self._restore_model_settings()
+        # モジュール表示後に前回モデルのセッション生成とウォームアップを裏で開始
+        qt.QTimer.singleShot(0, self._start_warmup)
+
+    @property
+    def infer(self):
+        """推論ロジックは自動推論セクションを使う時点で初めてimportする。"""
+        if self._infer is None:
+            from logic_inference import OnnxInferenceLogic
+
+            self._infer = OnnxInferenceLogic()
+        return self._infer
 
     # --- Signal wiring ---
     def _connect_signals(self):
         self.measure_ui.createMarkupButton.connect("clicked()", self.onCreateMarkup)
         self.measure_ui.clearMarkupButton.connect("clicked()", self.onClearMarkups)
         self.measure_ui.updateButton.connect("clicked()", self.onUpdateMeasurements)
+        self.measure_ui.markupSelector.connect("currentNodeChanged(vtkMRMLNode*)", lambda *_: self._observeMarkup())
+        self.measure_ui.liveUpdateCheckBox.toggled.connect(lambda *_: self._observeMarkup())
+        self.measure_ui.flipXAxisCheckBox.toggled.connect(lambda *_: self._scheduleLiveUpdate(REQUIRED_LABELS_ORDERED))
 
         self.export_ui.exportButton.connect("clicked()", self.onExport)
         self.export_ui.browseButton.connect("clicked()", self.onBrowse)
         self.export_ui.prefixEdit.textChanged.connect(lambda *_: self._update_counter_preview())
         self.auto_ui.modelBrowseButton.connect("clicked()", self.onBrowseModel)
         self.auto_ui.runButton.connect("clicked()", self.onRunInference)
+        self.auto_ui.refineCheckBox.toggled.connect(lambda *_: self._observeMarkup())
+        self.auto_ui.runAllButton.connect("clicked()", self.onRunAllVolumes)
+        self.auto_ui.worklistBrowseButton.connect("clicked()", self.onBrowseWorklist)
+        self.auto_ui.worklistLoadButton.connect("clicked()", self.onLoadWorklist)
+        self.auto_ui.worklistView.itemDoubleClicked.connect(lambda item: self.onOpenWorklistItem(self.auto_ui.worklistView.row(item)))
 
     # --- Handlers ---
     def onCreateMarkup(self):
@@ -62,16 +128,7 @@ class AssistController:
             self.measure_ui.statusLabel.text = "エラー: マークアップ点が5個ではありません。指定の順番で5点を配置してください。"
             return
 
-        points = {}
-        coordsRAS = [0.0, 0.0, 0.0]
-        for idx, label in enumerate(REQUIRED_LABELS_ORDERED):
-            markupNode.GetNthFiducialPosition(idx, coordsRAS)
-            x = coordsRAS[0]
-            y = coordsRAS[1]
-            if self.measure_ui.flipXAxisCheckBox.isChecked():
-                x = -x
-            points[label] = (x, y)
-
+        points = self._collectAnglePoints(markupNode)
         try:
             angles = self.logic.compute_angles_from_points(points)
         except ValueError as exc:
@@ -81,6 +138,119 @@ class AssistController:
         self._updateResultsTable(angles)
         self.measure_ui.statusLabel.text = "計測を更新しました。"
 
+    def cleanup(self):
+        self._modelWatchTimer.stop()
+        self._batchTimer.stop()
+        self._batchJob = None
+        self._liveTimer.stop()
+        self._removeMarkupObservers()
+        slicer.mrmlScene.RemoveObserver(self._sceneObserverTag)
+
+    @vtk.calldata_type(vtk.VTK_OBJECT)
+    def _onNodeRemoved(self, caller, event, node):
+        if self._infer is not None and node is not None and node.IsA("vtkMRMLVolumeNode"):
+            self._infer.forget_volume(node.GetID())
+
+    # --- Live measurement ---
+    def _observeMarkup(self):
+        """
+        選択中のMarkupsを監視する。ライブ計測がオンなら点の移動/追加/削除を、
+        局所補正がオンならドラッグ終了を監視する（どちらもオフなら監視しない）。
+        """
+        self._removeMarkupObservers()
+        markupNode = self.measure_ui.markupSelector.currentNode()
+        live = self.measure_ui.liveUpdateCheckBox.isChecked()
+        refine = self.auto_ui.refineCheckBox.isChecked()
+        if markupNode is None or not (live or refine):
+            return
+        self._observedMarkup = markupNode
+        if live:
+            self._observerTags += [
+                markupNode.AddObserver(slicer.vtkMRMLMarkupsNode.PointModifiedEvent, self._onPointModified),
+                markupNode.AddObserver(slicer.vtkMRMLMarkupsNode.PointAddedEvent, self._onPointsChanged),
+                markupNode.AddObserver(slicer.vtkMRMLMarkupsNode.PointRemovedEvent, self._onPointsChanged),
+            ]
+        if refine:
+            self._observerTags.append(
+                markupNode.AddObserver(slicer.vtkMRMLMarkupsNode.PointEndInteractionEvent, self._onPointEndInteraction)
+            )
+        if live:
+            self._scheduleLiveUpdate(REQUIRED_LABELS_ORDERED)
+
+    def _removeMarkupObservers(self):
+        if self._observedMarkup is not None:
+            for tag in self._observerTags:
+                self._observedMarkup.RemoveObserver(tag)
+        self._observedMarkup = None
+        self._observerTags = []
+        self._pendingLandmarks.clear()
+
+    @vtk.calldata_type(vtk.VTK_INT)
+    def _onPointModified(self, caller, event, pointIndex):
+        if 0 <= pointIndex < len(REQUIRED_LABELS_ORDERED):
+            self._scheduleLiveUpdate([REQUIRED_LABELS_ORDERED[pointIndex]])
+
+    def _onPointsChanged(self, caller, event):
+        # 追加/削除では点の順番（=ラベル）がずれ得るため全角度を再計算
+        self._scheduleLiveUpdate(REQUIRED_LABELS_ORDERED)
+
+    def _scheduleLiveUpdate(self, landmarks):
+        """移動したランドマークを記録し、タイマーが止まっていれば起動する（ドラッグ中のイベントを間引く）。"""
+        if self._observedMarkup is None or not self.measure_ui.liveUpdateCheckBox.isChecked():
+            return
+        self._pendingLandmarks.update(landmarks)
+        if not self._liveTimer.isActive():
+            self._liveTimer.start()
+
+    def _onLiveUpdateTimeout(self):
+        markupNode = self._observedMarkup
+        moved = self._pendingLandmarks
+        self._pendingLandmarks = set()
+        if markupNode is None or not moved:
+            return
+        if markupNode.GetNumberOfControlPoints() != len(REQUIRED_LABELS_ORDERED):
+            self._updateResultsTable({name: float("nan") for name in ANGLE_NAMES})
+            return
+        # 移動した点に依存する角度だけ、必要な点だけを取得して再計算する
+        names = angles_affected_by(moved)
+        needed = {label for name in names for label in ANGLE_DEPENDENCIES[name]}
+        points = self._collectAnglePoints(markupNode, needed)
+        angles = {}
+        for name in names:
+            try:
+                angles[name] = self.logic.compute_angle(name, points)
+            except ValueError:
+                angles[name] = float("nan")
+        self._updateResultsTable(angles)
+
+    def _onPointEndInteraction(self, caller, event):
+        """ドラッグを終えた点だけを局所推論で補正する（移動後のイベントでライブ計測も更新される）。"""
+        displayNode = caller.GetDisplayNode()
+        index = displayNode.GetActiveControlPoint() if displayNode is not None else -1
+        if not 0 <= index < len(REQUIRED_LABELS_ORDERED) or caller.GetNumberOfControlPoints() != len(REQUIRED_LABELS_ORDERED):
+            return
+        if self._infer is None or self._infer.session is None:
+            self.auto_ui.statusLabel.setText("局所補正: 先に推論を実行してモデルを読み込んでください。")
+            return
+        # 一括推論/全フレーム推論で作ったMarkupsは対応するVolume・フレームを持つ
+        volumeNode = slicer.mrmlScene.GetNodeByID(caller.GetAttribute(SOURCE_VOLUME_ATTRIBUTE) or "")
+        if volumeNode is None:
+            volumeNode = self.measure_ui.volumeSelector.currentNode()
+        if volumeNode is None:
+            return
+        frame = int(caller.GetAttribute(SOURCE_FRAME_ATTRIBUTE) or 0)
+        start = time.perf_counter()
+        try:
+            _, peak = self._infer.refine_point(volumeNode, caller, index, frame)
+        except Exception as exc:
+            logging.exception("Local refinement failed")
+            self.auto_ui.statusLabel.setText(f"エラー: 局所補正に失敗しました ({exc})")
+            return
+        elapsed_ms = (time.perf_counter() - start) * 1000.0
+        self.auto_ui.statusLabel.setText(
+            f"局所補正: {REQUIRED_LABELS_ORDERED[index]} を移動しました（ピーク {peak:.2f}, {elapsed_ms:.0f} ms）。"
+        )
+
     def onBrowseModel(self):
         file_path = qt.QFileDialog.getOpenFileName(
             slicer.util.mainWindow(), "ONNXモデルを選択", "", "ONNX (*.onnx)"
@@ -107,19 +277,267 @@ class AssistController:
         target_h = int(self.auto_ui.heightSpin.value)
         target_w = int(self.auto_ui.widthSpin.value)
 
+        if self.auto_ui.allFramesCheckBox.isChecked():
+            self._runAllFrames(volumeNode, model_path, target_h, target_w)
+            return
+
         try:
-            # 再ロードは毎回（単純性優先）。必要ならパスが同じ場合はスキップも可。
-            self.infer.load_model(model_path, (target_h, target_w))
+            # 同じモデル・入力サイズならウォームアップ済みのセッションを再利用
+            self.infer.ensure_model(model_path, (target_h, target_w))
+            self.infer.set_tta(self.auto_ui.ttaCombo.currentData)
             coords_ij = self.infer.predict_and_place(volumeNode, markupNode)
         except Exception as exc:
             logging.exception("Inference failed")
             self.auto_ui.statusLabel.setText(f"エラー: 推論に失敗しました ({exc})")
             return
 
+        self._save_model_settings(model_path, target_h, target_w)
         self.auto_ui.statusLabel.setText("推論完了: Markupsに自動配置しました。")
         # 計測も更新しておく
         self.onUpdateMeasurements()
 
+    def _runAllFrames(self, volumeNode, model_path, target_h, target_w):
+        """Volumeの全フレームをまとめて推論し、フレームごとのMarkups（k=フレーム番号の面上）に配置する。"""
+        try:
+            self.infer.ensure_model(model_path, (target_h, target_w))
+            self.infer.set_tta(self.auto_ui.ttaCombo.currentData)
+            all_coords = self.infer.predict_frames(volumeNode)
+            rows = []
+            markupNodes = []
+            for k, coords_ij in enumerate(all_coords):
+                markupNode = self._markupNodeForVolume(volumeNode, frame=k)
+                self.infer.place_points(volumeNode, markupNode, coords_ij, k)
+                markupNodes.append(markupNode)
+                try:
+                    angles = self.logic.compute_angles_from_points(self._collectAnglePoints(markupNode))
+                except ValueError:
+                    angles = {}
+                rows.append((f"{volumeNode.GetName()} [f{k}]", angles, ""))
+            tableNode = self._updateBatchResultsTable(rows)
+        except Exception as exc:
+            logging.exception("Multi-frame inference failed")
+            self.auto_ui.statusLabel.setText(f"エラー: 全フレーム推論に失敗しました ({exc})")
+            return
+
+        self._save_model_settings(model_path, target_h, target_w)
+        self.measure_ui.markupSelector.setCurrentNode(markupNodes[0])
+        slicer.app.applicationLogic().GetSelectionNode().SetActiveTableID(tableNode.GetID())
+        slicer.app.applicationLogic().PropagateTableSelection()
+        self.auto_ui.statusLabel.setText(
+            f"全フレーム推論完了: {len(all_coords)}フレームをフレームごとのMarkupsに配置し、{RESULTS_TABLE_NAME} に角度を出力しました。"
+        )
+        self.onUpdateMeasurements()
+
+    def onRunAllVolumes(self):
+        # ラベルマップ（セグメンテーション）もScalarVolumeのサブクラスなので除く
+        volumeNodes = [
+            v for v in slicer.util.getNodesByClass("vtkMRMLScalarVolumeNode") if not v.IsA("vtkMRMLLabelMapVolumeNode")
+        ]
+        if not volumeNodes:
+            self.auto_ui.statusLabel.setText("エラー: シーンにVolumeがありません。")
+            return
+        model_path = self.auto_ui.modelPathEdit.text.strip()
+        if not model_path:
+            self.auto_ui.statusLabel.setText("エラー: ONNXモデルパスを指定してください。")
+            return
+        target_h = int(self.auto_ui.heightSpin.value)
+        target_w = int(self.auto_ui.widthSpin.value)
+        batch_size = int(self.auto_ui.batchSizeSpin.value)
+
+        self._setBatchRunning(True)
+        progress = {"done": 0, "total": 1}
+        try:
+            self.infer.ensure_model(model_path, (target_h, target_w))
+            self.infer.set_tta(self.auto_ui.ttaCombo.currentData)
+            # ノードの配列取得はメインスレッドで。処理中にVolumeが削除されても安全なようコピーする。
+            # 前処理キャッシュにあるVolumeは取り出し・コピー自体を省く。
+            # 1件の失敗で全体を止めず、失敗したVolumeは結果テーブルに理由を書く。
+            failures = {}
+            targets, images, cache_keys, cached = [], [], [], {}
+            for v in volumeNodes:
+                try:
+                    key = self.infer.volume_cache_key(v)
+                    hit = self.infer.lookup_preprocessed(key)
+                    image = np.array(self.infer.extract_slice(v)) if hit is None else None
+                except Exception as exc:
+                    logging.exception("Failed to read volume %s", v.GetName())
+                    failures[v.GetID()] = str(exc)
+                    continue
+                if hit is not None:
+                    cached[len(targets)] = hit
+                targets.append(v)
+                images.append(image)
+                cache_keys.append(key)
+            progress["total"] = max(1, len(targets))
+
+            def _on_progress(done, total):
+                progress["done"] = done
+
+            # 前処理と推論はワーカースレッドで行い、完了はタイマーで確認する（UIのイベントループは止めない）
+            errors = {}
+            runner = ThreadPoolExecutor(max_workers=1)
+            future = runner.submit(
+                self.infer.predict_arrays,
+                images,
+                batch_size=batch_size,
+                progress=_on_progress,
+                cache_keys=cache_keys,
+                errors=errors,
+                preprocessed=cached,
+            )
+            runner.shutdown(wait=False)
+        except Exception as exc:
+            logging.exception("Batch inference failed")
+            self.auto_ui.statusLabel.setText(f"エラー: 一括推論に失敗しました ({exc})")
+            self._setBatchRunning(False)
+            return
+
+        self._batchJob = {
+            "future": future,
+            "progress": progress,
+            "errors": errors,
+            "failures": failures,
+            # 処理中にVolumeが削除されることがあるので、完了時はIDからノードを引き直す
+            "volumes": [(v.GetID(), v.GetName()) for v in volumeNodes],
+            "target_ids": [v.GetID() for v in targets],
+            "settings": (model_path, target_h, target_w),
+        }
+        self._batchTimer.start()
+
+    def _setBatchRunning(self, running: bool):
+        self.auto_ui.runAllButton.enabled = not running
+        self.auto_ui.runButton.enabled = not running
+        self.auto_ui.progressBar.visible = running
+        if running:
+            self.auto_ui.progressBar.setValue(0)
+
+    def _onBatchPoll(self):
+        """一括推論の進捗を表示し、ワーカースレッドが終わったら結果を配置する。"""
+        job = self._batchJob
+        if job is None:
+            self._batchTimer.stop()
+            return
+        progress = job["progress"]
+        if not job["future"].done():
+            self.auto_ui.progressBar.setValue(int(100 * progress["done"] / progress["total"]))
+            self.auto_ui.statusLabel.setText(f"一括推論中... {progress['done']}/{progress['total']}")
+            return
+        self._batchTimer.stop()
+        self._batchJob = None
+        try:
+            tableNode, failures = self._finishBatch(job)
+        except Exception as exc:
+            logging.exception("Batch inference failed")
+            self.auto_ui.statusLabel.setText(f"エラー: 一括推論に失敗しました ({exc})")
+            return
+        finally:
+            self._setBatchRunning(False)
+
+        self._save_model_settings(*job["settings"])
+        slicer.app.applicationLogic().GetSelectionNode().SetActiveTableID(tableNode.GetID())
+        slicer.app.applicationLogic().PropagateTableSelection()
+        message = f"一括推論完了: {len(job['volumes'])}件のVolumeを処理し、{RESULTS_TABLE_NAME} に角度を出力しました。"
+        if failures:
+            message += f" {len(failures)}件は失敗しました（テーブルのエラー列を参照）。"
+        self.auto_ui.statusLabel.setText(message)
+
+    def _finishBatch(self, job):
+        """推論結果をMarkupsに配置して結果テーブルを作る。返り値: (テーブルノード, 失敗したVolumeのID→理由)。"""
+        all_coords = job["future"].result()
+        failures = job["failures"]
+        target_ids = job["target_ids"]
+        names = dict(job["volumes"])
+        for i, exc in job["errors"].items():
+            logging.error("Inference failed for %s: %s", names[target_ids[i]], exc)
+            failures[target_ids[i]] = str(exc)
+        coords_by_id = {node_id: c for node_id, c in zip(target_ids, all_coords) if c is not None}
+
+        rows = []
+        for node_id, name in job["volumes"]:
+            volumeNode = slicer.mrmlScene.GetNodeByID(node_id)
+            if volumeNode is None:
+                failures[node_id] = "推論中にVolumeが削除されました"
+            elif node_id in coords_by_id:
+                try:
+                    markupNode = self._markupNodeForVolume(volumeNode)
+                    self.infer.place_points(volumeNode, markupNode, coords_by_id[node_id])
+                except Exception as exc:
+                    logging.exception("Failed to place points on %s", name)
+                    failures[node_id] = str(exc)
+            if node_id in failures:
+                rows.append((name, {}, f"失敗: {failures[node_id]}"))
+                continue
+            try:
+                angles = self.logic.compute_angles_from_points(self._collectAnglePoints(markupNode))
+            except ValueError:
+                angles = {}
+            rows.append((name, angles, ""))
+        return self._updateBatchResultsTable(rows), failures
+
+    def onBrowseWorklist(self):
+        file_path = qt.QFileDialog.getOpenFileName(
+            slicer.util.mainWindow(), "ワークリストを選択", "", "Worklist (*.json)"
+        )
+        if file_path:
+            self.auto_ui.worklistPathEdit.setText(file_path)
+            self.onLoadWorklist()
+
+    def onLoadWorklist(self):
+        path = self.auto_ui.worklistPathEdit.text.strip()
+        if not path:
+            self.auto_ui.statusLabel.setText("エラー: ワークリストのパスを指定してください。")
+            return
+        try:
+            data = load_worklist(path)
+        except (OSError, ValueError, KeyError) as exc:
+            self.auto_ui.statusLabel.setText(f"エラー: ワークリストを読み込めません ({exc})")
+            return
+        self._worklist = data["cases"]
+        view = self.auto_ui.worklistView
+        view.clear()
+        for entry in self._worklist:
+            item = qt.QListWidgetItem(f"#{entry['rank']}  {entry['case_id']}  (不確実性 {entry['score']:.2f}, 要確認: {entry['worst_landmark']})")
+            item.setToolTip(
+                "\n".join(
+                    f"{name}: peak {s['peak']:.2f}, 第2ピーク比 {s['second_ratio']:.2f}, 広がり {s['spread_px']:.1f}px"
+                    for name, s in entry.get("landmarks", {}).items()
+                )
+            )
+            view.addItem(item)
+        view.visible = True
+        qt.QSettings().setValue(SETTINGS_WORKLIST_PATH, path)
+        self.auto_ui.statusLabel.setText(f"ワークリストを読み込みました: {len(self._worklist)}件（不確実な順）")
+
+    def onOpenWorklistItem(self, row):
+        """ワークリストの画像を読み込み、予測点を配置してケースIDを入力しておく（確認・修正してエクスポートする）。"""
+        if not 0 <= row < len(self._worklist):
+            return
+        entry = self._worklist[row]
+        try:
+            if entry.get("volume") and os.path.exists(entry["volume"]):
+                volumeNode = slicer.util.loadVolume(entry["volume"])
+            else:
+                array = np.load(entry["image"])
+                if array.ndim == 2:
+                    array = array[np.newaxis]
+                volumeNode = slicer.util.addVolumeFromArray(array, name=entry["case_id"])
+        except Exception as exc:
+            logging.exception("Failed to load worklist case")
+            self.auto_ui.statusLabel.setText(f"エラー: 画像を読み込めません ({exc})")
+            return
+        volumeNode.SetName(entry["case_id"])
+        slicer.util.setSliceViewerLayers(background=volumeNode, fit=True)
+        self.measure_ui.volumeSelector.setCurrentNode(volumeNode)
+        markupNode = self._markupNodeForVolume(volumeNode)
+        if entry.get("predicted_ij"):
+            self.infer.place_points(volumeNode, markupNode, entry["predicted_ij"])
+        self.measure_ui.markupSelector.setCurrentNode(markupNode)
+        self.export_ui.caseIdEdit.setText(entry["case_id"])
+        self.onUpdateMeasurements()
+        self.auto_ui.statusLabel.setText(
+            f"#{entry['rank']} {entry['case_id']} を読み込みました。{entry['worst_landmark']} を重点的に確認してください。"
+        )
+
     def onBrowse(self):
         directory = qt.QFileDialog.getExistingDirectory(
             slicer.util.mainWindow(), "出力先フォルダを選択"
@@ -175,6 +593,56 @@ class AssistController:
             self._update_counter_preview()
 
     # --- Helpers ---
+    def _restore_model_settings(self):
+        settings = qt.QSettings()
+        model_path = settings.value(SETTINGS_MODEL_PATH, "")
+        if model_path:
+            self.auto_ui.modelPathEdit.setText(model_path)
+        height = settings.value(SETTINGS_INPUT_HEIGHT, None)
+        width = settings.value(SETTINGS_INPUT_WIDTH, None)
+        if height:
+            self.auto_ui.heightSpin.setValue(int(height))
+        if width:
+            self.auto_ui.widthSpin.setValue(int(width))
+        worklist_path = settings.value(SETTINGS_WORKLIST_PATH, "")
+        if worklist_path:
+            self.auto_ui.worklistPathEdit.setText(worklist_path)
+
+    def _save_model_settings(self, model_path, target_h, target_w):
+        settings = qt.QSettings()
+        settings.setValue(SETTINGS_MODEL_PATH, model_path)
+        settings.setValue(SETTINGS_INPUT_HEIGHT, int(target_h))
+        settings.setValue(SETTINGS_INPUT_WIDTH, int(target_w))
+
+    def _start_warmup(self):
+        model_path = self.auto_ui.modelPathEdit.text.strip()
+        if not model_path or not os.path.exists(model_path):
+            return
+        target_hw = (int(self.auto_ui.heightSpin.value), int(self.auto_ui.widthSpin.value))
+        self.infer.start_warmup(model_path, target_hw)
+
+    def _checkModelUpdate(self):
+        """ロード済みモデルのファイルが更新されていれば、ユーザー操作なしで裏で再ロードする。"""
+        if self._infer is None:
+            return
+        if self._modelReloading:
+            # 再ロード（バックグラウンド）が終わったら結果を通知する
+            status = self.infer.reload_status()
+            if status is None:
+                return
+            self._modelReloading = False
+            if status["ok"]:
+                self.auto_ui.statusLabel.setText(f"新しいモデルを読み込みました: {status['version']}")
+            else:
+                self.auto_ui.statusLabel.setText(
+                    f"エラー: 更新されたモデルを読み込めませんでした ({status['error']})。現在のモデルを使い続けます。"
+                )
+            return
+        if self.infer.model_file_changed():
+            self._modelReloading = True
+            self.auto_ui.statusLabel.setText("モデルの更新を検出しました。バックグラウンドで再読み込みしています...")
+            self.infer.start_warmup(self.infer.model_path, self.infer.target_hw)
+
     def _ensureMarkupNodeExists(self):
         current = self.measure_ui.markupSelector.currentNode()
         if current and current.IsA("vtkMRMLMarkupsFiducialNode"):
@@ -186,20 +654,85 @@ class AssistController:
             displayNode.SetGlyphScale(1.5)
         return fiducialNode
 
+    def _markupNodeForVolume(self, volumeNode, frame=None):
+        """
+        Volume（frame 指定時はそのフレーム）に対応付けたMarkupsを探し、無ければ
+        `<Volume名>_landmarks`（フレームは `<Volume名>_f<番号>_landmarks`）として作る。
+        """
+        frameValue = None if frame is None else str(frame)
+        for node in slicer.util.getNodesByClass("vtkMRMLMarkupsFiducialNode"):
+            if node.GetAttribute(SOURCE_VOLUME_ATTRIBUTE) == volumeNode.GetID() and node.GetAttribute(SOURCE_FRAME_ATTRIBUTE) == frameValue:
+                return node
+        name = f"{volumeNode.GetName()}_landmarks" if frame is None else f"{volumeNode.GetName()}_f{frame:02d}_landmarks"
+        node = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLMarkupsFiducialNode", name)
+        node.SetAttribute(SOURCE_VOLUME_ATTRIBUTE, volumeNode.GetID())
+        if frameValue is not None:
+            node.SetAttribute(SOURCE_FRAME_ATTRIBUTE, frameValue)
+        return node
+
+    def _updateBatchResultsTable(self, rows):
+        """(Volume名, 角度dict, エラー文) の一覧でテーブルノードを作成/上書きする。"""
+        tableNode = slicer.mrmlScene.GetFirstNodeByName(RESULTS_TABLE_NAME)
+        if tableNode is None or not tableNode.IsA("vtkMRMLTableNode"):
+            tableNode = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLTableNode", RESULTS_TABLE_NAME)
+        table = tableNode.GetTable()
+        wasModifying = tableNode.StartModify()
+        tableNode.RemoveAllColumns()
+        nameColumn = vtk.vtkStringArray()
+        nameColumn.SetName("Volume")
+        valueColumns = []
+        for name in ANGLE_NAMES:
+            column = vtk.vtkDoubleArray()
+            column.SetName(f"{name} (deg)")
+            valueColumns.append(column)
+        errorColumn = vtk.vtkStringArray()
+        errorColumn.SetName("Error")
+        for volumeName, angles, error in rows:
+            nameColumn.InsertNextValue(volumeName)
+            for name, column in zip(ANGLE_NAMES, valueColumns):
+                column.InsertNextValue(angles.get(name, float("nan")))
+            errorColumn.InsertNextValue(error)
+        table.AddColumn(nameColumn)
+        for column in valueColumns:
+            table.AddColumn(column)
+        table.AddColumn(errorColumn)
+        tableNode.Modified()
+        tableNode.EndModify(wasModifying)
+        return tableNode
+
+    def _collectAnglePoints(self, markupNode, labels=None):
+        """角度計算用に点のRAS (x, y) を集める（既定は5点すべて。左右反転補正を反映）。"""
+        points = {}
+        coordsRAS = [0.0, 0.0, 0.0]
+        for idx, label in enumerate(REQUIRED_LABELS_ORDERED):
+            if labels is not None and label not in labels:
+                continue
+            markupNode.GetNthControlPointPosition(idx, coordsRAS)
+            x = coordsRAS[0]
+            y = coordsRAS[1]
+            if self.measure_ui.flipXAxisCheckBox.isChecked():
+                x = -x
+            points[label] = (x, y)
+        return points
+
     def _assignLandmarkLabels(self, markupNode):
         count = min(markupNode.GetNumberOfFiducials(), len(REQUIRED_LABELS_ORDERED))
         for i in range(count):
             markupNode.SetNthControlPointLabel(i, REQUIRED_LABELS_ORDERED[i])
 
     def _updateResultsTable(self, anglesDict):
-        params = ["PI", "PT", "SS", "LL"]
-        for i, name in enumerate(params):
-            value = anglesDict.get(name, float("nan"))
+        """anglesDict に含まれる角度の行だけを書き換える（表示が変わらない行は触らない）。"""
+        for i, name in enumerate(ANGLE_NAMES):
+            if name not in anglesDict:
+                continue
+            value = anglesDict[name]
             if math.isnan(value):
                 text = "--"
             else:
                 text = f"{value:.1f}°"
-            self.measure_ui.resultsTable.item(i, 1).setText(text)
+            item = self.measure_ui.resultsTable.item(i, 1)
+            if item.text() != text:
+                item.setText(text)
 
     def _format_counter_preview(self):
         prefix = self.export_ui.prefixEdit.text.strip() or "case"
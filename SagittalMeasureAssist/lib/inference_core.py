@@ -0,0 +1,625 @@
+"""
+推論の前処理/後処理（純numpy・slicer非依存）。
+Slicerのロジックから使うほか、Slicer外（テスト/ベンチマーク）からもimportできるよう分離している。
+"""
+
+import math
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, Hashable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+# SmallUNet は3回の2xプーリングを持つため、入力H/Wは8の倍数である必要がある
+SIZE_DIVISOR = 8
+
+
+def _percentile_clip_norm(img: np.ndarray, p_low=1.0, p_high=99.0) -> np.ndarray:
+    lo, hi = np.percentile(img, [p_low, p_high])
+    eps = 1e-6
+    img = np.clip(img, lo, hi)
+    img = (img - lo) / (hi - lo + eps)
+    return img.astype(np.float32)
+
+
+def _linear_axis(src_n: int, pos: np.ndarray):
+    """1D線形補間のインデックスと重み（pos は入力画素位置）。"""
+    pos = np.clip(pos, 0, src_n - 1)
+    i0 = np.floor(pos).astype(np.int64)
+    i1 = np.minimum(i0 + 1, src_n - 1)
+    frac = (pos - i0).astype(np.float32)
+    return i0, i1, frac
+
+
+def _resize_bilinear(img: np.ndarray, new_h: int, new_w: int) -> np.ndarray:
+    """
+    Minimal bilinear resize (corner-aligned, same sampling as per-row np.interp) with
+    vectorized gathers, so it stays fast on large films and can run in worker threads.
+    img: (H,W)
+    """
+    h, w = img.shape
+    x0, x1, fx = _linear_axis(w, np.linspace(0, w - 1, new_w))
+    y0, y1, fy = _linear_axis(h, np.linspace(0, h - 1, new_h))
+    img = img.astype(np.float32, copy=False)
+    # interpolate along x on the two source rows needed for each output row, then along y
+    rows0 = img[y0]
+    rows1 = img[y1]
+    top = rows0[:, x0] + (rows0[:, x1] - rows0[:, x0]) * fx
+    bottom = rows1[:, x0] + (rows1[:, x1] - rows1[:, x0]) * fx
+    return top + (bottom - top) * fy[:, None]
+
+
+def _pad_resize(img: np.ndarray, target_hw: Tuple[int, int], pad_value: float = 0.0):
+    """縦横比を維持してリサイズし、余白を pad_value（既定0）で埋める。返り値: 画像, scale, pad_x, pad_y。"""
+    h, w = img.shape
+    th, tw = target_hw
+    scale = min(th / h, tw / w)
+    new_h = int(round(h * scale))
+    new_w = int(round(w * scale))
+    resized = _resize_bilinear(img, new_h, new_w)
+
+    pad_y = (th - new_h) // 2
+    pad_x = (tw - new_w) // 2
+    padded = np.pad(resized, ((pad_y, th - new_h - pad_y), (pad_x, tw - new_w - pad_x)), mode="constant", constant_values=pad_value)
+    return padded.astype(np.float32, copy=False), scale, pad_x, pad_y
+
+
+def preprocess_slice(img: np.ndarray, target_hw: Tuple[int, int]):
+    """
+    通常モデル用の前処理（パーセンタイル正規化 → パディングリサイズ）。返り値: 画像, scale, pad_x, pad_y。
+    InferenceContext.preprocess_into はこれと同じ結果をバッファに直接書く。
+    """
+    return _pad_resize(_percentile_clip_norm(img), target_hw)
+
+
+def choose_input_shape(
+    image_hw: Tuple[int, int],
+    target_hw: Tuple[int, int],
+    candidates: Optional[Sequence[Tuple[int, int]]] = None,
+    dynamic_hw: bool = False,
+) -> Tuple[int, int]:
+    """
+    モデル入力サイズを選ぶ。
+    - candidates（モデルのメタデータ input_shapes）があれば縦横比が最も近いもの
+    - 動的H/Wモデルなら target_hw に収まる範囲で画像の縦横比に合わせ、8の倍数に切り上げた形
+    - それ以外は target_hw（正方形パディング）
+    """
+    h, w = image_hw
+    if candidates:
+        aspect = math.log(h / w)
+        return tuple(min(candidates, key=lambda c: abs(math.log(c[0] / c[1]) - aspect)))
+    if not dynamic_hw:
+        return tuple(target_hw)
+    th, tw = target_hw
+    scale = min(th / h, tw / w)
+
+    def _round_up(v, limit):
+        # 上限（UIの指定値）も8の倍数に切り下げる。500などのままだとUNetのスキップ接続で形が合わない
+        limit = max(SIZE_DIVISOR, limit // SIZE_DIVISOR * SIZE_DIVISOR)
+        return min(limit, int(math.ceil(v / SIZE_DIVISOR)) * SIZE_DIVISOR)
+
+    return _round_up(h * scale, th), _round_up(w * scale, tw)
+
+
+def decode_heatmaps(heatmaps: np.ndarray) -> np.ndarray:
+    """ヒートマップ (N,L,H,W) の最大位置をまとめて求める。返り値: (N,L,2) の (x, y)。"""
+    n, l, h, w = heatmaps.shape
+    idx = np.argmax(heatmaps.reshape(n, l, h * w), axis=-1)
+    ys, xs = np.divmod(idx, w)
+    return np.stack([xs, ys], axis=-1).astype(np.float32)
+
+
+# --- Test-time augmentation ---
+
+# 左右反転時のチャネル対応。5点とも正中（矢状面）上のランドマークなので入れ替えは不要だが、
+# 左右ペアのランドマークを追加する場合はここで対応チャネルを指定する。
+FLIP_PERMUTATION = [0, 1, 2, 3, 4]
+
+# (左右反転, 拡大率) の組。拡大率は画像中心まわり。
+TTA_PRESETS = {
+    "none": [(False, 1.0)],
+    "flip": [(False, 1.0), (True, 1.0)],
+    "flip_scale": [(False, 1.0), (True, 1.0), (False, 0.9), (False, 1.1)],
+}
+
+
+def _zoom_center(arr: np.ndarray, scale: float, fill=0.0) -> np.ndarray:
+    """
+    画像中心まわりに scale 倍する（範囲外は fill。arr[..., H, W] に放送できるスカラーか配列）。arr: (..., H, W)。
+    出力画素 p は入力の c + (p - c) / scale を双線形補間でサンプルする。
+    """
+    if scale == 1.0:
+        return arr
+    h, w = arr.shape[-2:]
+    ys = (np.arange(h) - (h - 1) / 2.0) / scale + (h - 1) / 2.0
+    xs = (np.arange(w) - (w - 1) / 2.0) / scale + (w - 1) / 2.0
+
+    def _axis(pos, n):
+        p0 = np.floor(pos).astype(np.int64)
+        frac = (pos - p0).astype(np.float32)
+        w0 = np.where((p0 >= 0) & (p0 < n), 1.0 - frac, 0.0).astype(np.float32)
+        w1 = np.where((p0 + 1 >= 0) & (p0 + 1 < n), frac, 0.0).astype(np.float32)
+        return np.clip(p0, 0, n - 1), np.clip(p0 + 1, 0, n - 1), w0, w1
+
+    y0, y1, wy0, wy1 = _axis(ys, h)
+    x0, x1, wx0, wx1 = _axis(xs, w)
+    rows0 = arr[..., y0, :]
+    rows1 = arr[..., y1, :]
+    top = rows0[..., x0] * wx0 + rows0[..., x1] * wx1
+    bottom = rows1[..., x0] * wx0 + rows1[..., x1] * wx1
+    out = top * wy0[:, None] + bottom * wy1[:, None]
+    if np.any(fill != 0):
+        # 範囲外の重み（補間の重みが足りない分）を fill で埋める
+        out = out + np.asarray(fill, dtype=np.float32) * (1.0 - (wy0 + wy1)[:, None] * (wx0 + wx1)[None, :])
+    return out.astype(np.float32)
+
+
+def build_tta_batch(images: np.ndarray, variants: Sequence[Tuple[bool, float]], fill=None) -> np.ndarray:
+    """
+    前処理済み画像 (N,1,H,W) から全バリアントを画像ごとに並べた (N*V,1,H,W) を作る。
+    1回の session.run で動的バッチ軸にまとめて流すため。
+    fill（画像ごとの (N,)）: 縮小で生じる範囲外の値。正規化前の入力（エンドツーエンドモデル）では
+    raw_pad_resize と同じく各画像の最小値にして、グラフ内の min/max スケーリングを変えないようにする。
+    """
+    fill = 0.0 if fill is None else np.asarray(fill, dtype=np.float32).reshape((-1,) + (1,) * (images.ndim - 1))
+    out = []
+    for flip, scale in variants:
+        v = _zoom_center(images, scale, fill)
+        if flip:
+            v = v[..., ::-1]
+        out.append(v)
+    n = images.shape[0]
+    stacked = np.stack(out, axis=1)  # (N,V,1,H,W)
+    return np.ascontiguousarray(stacked.reshape((n * len(variants),) + images.shape[1:]), dtype=np.float32)
+
+
+def invert_tta_heatmaps(heatmaps: np.ndarray, variants: Sequence[Tuple[bool, float]]) -> np.ndarray:
+    """(N*V,L,H,W) の各バリアントを元画像の座標系に戻す。返り値: (N,V,L,H,W)。"""
+    v_count = len(variants)
+    hm = heatmaps.reshape((-1, v_count) + heatmaps.shape[1:])
+    out = np.empty_like(hm)
+    for vi, (flip, scale) in enumerate(variants):
+        h = hm[:, vi]
+        if flip:
+            h = h[:, FLIP_PERMUTATION, :, ::-1]
+        out[:, vi] = _zoom_center(h, 1.0 / scale)
+    return out
+
+
+def fuse_tta_heatmaps(heatmaps: np.ndarray, variants: Sequence[Tuple[bool, float]]) -> np.ndarray:
+    """逆変換した全バリアントを平均して (N,L,H,W) にする。"""
+    return invert_tta_heatmaps(heatmaps, variants).mean(axis=1)
+
+
+def invert_tta_coords(coords: np.ndarray, variants: Sequence[Tuple[bool, float]], input_hw: Tuple[int, int]) -> np.ndarray:
+    """
+    エンドツーエンドモデルの座標 (N*V,L,2) を各バリアントから元の入力座標系に戻す。返り値: (N,V,L,2)。
+    _zoom_center と同じ画像中心まわりの拡大率を逆にかけ、左右反転は x を折り返す。
+    """
+    h, w = input_hw
+    v_count = len(variants)
+    c = coords.reshape((-1, v_count) + coords.shape[1:]).astype(np.float32)
+    out = np.empty_like(c)
+    center = np.array([(w - 1) / 2.0, (h - 1) / 2.0], dtype=np.float32)
+    for vi, (flip, scale) in enumerate(variants):
+        cv = c[:, vi]
+        if flip:
+            cv = cv[:, FLIP_PERMUTATION].copy()
+            cv[..., 0] = (w - 1) - cv[..., 0]
+        out[:, vi] = (cv - center) / scale + center
+    return out
+
+
+def to_original_coords(coords: np.ndarray, scale: float, pad_x: float, pad_y: float) -> List[Tuple[float, float]]:
+    """モデル入力座標 (L,2) をpaddingとスケールを戻して元画像のIJ座標にする。"""
+    return [(float((x - pad_x) / scale), float((y - pad_y) / scale)) for x, y in coords]
+
+
+# --- ドラッグした点の局所再推論 ---
+
+
+def refine_crop(
+    img: np.ndarray,
+    center_xy: Tuple[float, float],
+    scale: float,
+    crop_hw: Tuple[int, int],
+    window: Optional[Tuple[float, float]] = None,
+    fill: float = 0.0,
+):
+    """
+    元画像 img (H,W) から center_xy（元画像のIJ）まわりの窓を全体推論と同じ縮尺 scale で切り出し、
+    crop_hw の入力にする（モデルから見た構造の大きさが全体推論と同じになる）。
+    window=(lo, hi) を渡すと全体画像と同じ範囲でクリップ・正規化する（範囲外は0）。無ければ範囲外は fill。
+    返り値: crop (h,w) float32, (x0, y0)。crop の画素 (u, v) は元画像の (x0 + u / scale, y0 + v / scale)。
+    """
+    h, w = img.shape
+    ch, cw = crop_hw
+    x0 = float(center_xy[0]) - (cw - 1) / 2.0 / scale
+    y0 = float(center_xy[1]) - (ch - 1) / 2.0 / scale
+    xs = x0 + np.arange(cw) / scale
+    ys = y0 + np.arange(ch) / scale
+    inside = (ys[:, None] >= 0) & (ys[:, None] <= h - 1) & (xs[None, :] >= 0) & (xs[None, :] <= w - 1)
+    xi0, xi1, fx = _linear_axis(w, xs)
+    yi0, yi1, fy = _linear_axis(h, ys)
+    rows0 = img[yi0].astype(np.float32, copy=False)
+    rows1 = img[yi1].astype(np.float32, copy=False)
+    if window is not None:
+        lo, hi = window
+        rows0 = np.clip(rows0, lo, hi)
+        rows1 = np.clip(rows1, lo, hi)
+    top = rows0[:, xi0] + (rows0[:, xi1] - rows0[:, xi0]) * fx
+    bottom = rows1[:, xi0] + (rows1[:, xi1] - rows1[:, xi0]) * fx
+    crop = top + (bottom - top) * fy[:, None]
+    if window is not None:
+        crop = (crop - lo) / (hi - lo + 1e-6)
+        fill = 0.0
+    crop = np.where(inside, crop, fill).astype(np.float32)
+    return crop, (x0, y0)
+
+
+# --- ヒートマップからの不確実性（能動学習用） ---
+
+
+def heatmap_uncertainty(heatmaps: np.ndarray, radius: Optional[float] = None) -> Dict[str, np.ndarray]:
+    """
+    ヒートマップ (N,L,H,W) から安価な不確実性指標をまとめて計算する。返り値は各 (N,L):
+      peak: 最大値（学習時の正解ヒートマップはピーク1.0なので、低いほど自信がない）
+      second_ratio: 最大位置から radius 画素より離れた位置の最大値 / peak（別の候補位置がどれだけ強いか）
+      spread: 正の応答を重みとした位置の標準偏差（画素）。広がるほど位置が曖昧
+    radius 未指定時は短辺の2.5%（最小9画素＝学習時sigma 3画素の3倍、主ピークの裾を拾わないため）。
+    """
+    n, l, h, w = heatmaps.shape
+    if radius is None:
+        radius = max(9.0, 0.025 * min(h, w))
+    flat = heatmaps.reshape(n, l, h * w)
+    idx = np.argmax(flat, axis=-1)
+    peak = np.take_along_axis(flat, idx[..., None], axis=-1)[..., 0]
+    py, px = np.divmod(idx, w)
+
+    ys = np.arange(h, dtype=np.float32)
+    xs = np.arange(w, dtype=np.float32)
+    far = ((ys[None, None, :, None] - py[..., None, None]) ** 2 + (xs[None, None, None, :] - px[..., None, None]) ** 2) > radius**2
+    second = np.max(np.where(far, heatmaps, -np.inf), axis=(2, 3))
+    # 正の応答が無いチャネルは最も不確実（second_ratio=1, spread=対角長）として扱う
+    second_ratio = np.where(peak > 0, np.clip(second, 0.0, None) / np.maximum(peak, 1e-6), 1.0)
+
+    weights = np.clip(heatmaps, 0.0, None)
+    raw_total = weights.sum(axis=(2, 3))
+    total = np.maximum(raw_total, 1e-12)
+    wy = weights.sum(axis=3)  # (N,L,H)
+    wx = weights.sum(axis=2)  # (N,L,W)
+    mean_y = wy @ ys / total
+    mean_x = wx @ xs / total
+    var = (wy @ (ys**2) / total - mean_y**2) + (wx @ (xs**2) / total - mean_x**2)
+    spread = np.sqrt(np.clip(var, 0.0, None))
+    spread = np.where(raw_total > 0, spread, math.hypot(h, w))
+    return {"peak": peak.astype(np.float32), "second_ratio": second_ratio.astype(np.float32), "spread": spread.astype(np.float32)}
+
+
+def uncertainty_scores(stats: Dict[str, np.ndarray], input_hw: Tuple[int, int]) -> np.ndarray:
+    """
+    heatmap_uncertainty の指標をランドマークごとの不確実性 (N,L) にまとめる（大きいほど不確実）:
+    (1 - peak) + second_ratio + spread / (短辺の10%)、各項は [0,1] に切り詰める。
+    """
+    spread_ref = 0.1 * min(input_hw)
+    return (
+        (1.0 - np.clip(stats["peak"], 0.0, 1.0))
+        + np.clip(stats["second_ratio"], 0.0, 1.0)
+        + np.clip(stats["spread"] / spread_ref, 0.0, 1.0)
+    )
+
+# --- 再利用バッファ（IOBinding）での推論 ---
+
+
+def _percentile_inplace(buf: np.ndarray, q_low: float, q_high: float) -> Tuple[float, float]:
+    """
+    np.percentile(linear) と同じ値を、buf を破壊的に partition して求める（コピーを作らない）。
+    buf: 1次元 float32（呼び出し側のスクラッチ）。
+    """
+    n = buf.size
+    out = []
+    kth = []
+    for q in (q_low, q_high):
+        pos = (n - 1) * q / 100.0
+        i0 = int(math.floor(pos))
+        i1 = min(i0 + 1, n - 1)
+        kth.extend([i0, i1])
+        out.append((i0, i1, pos - i0))
+    buf.partition(sorted(set(kth)))
+    return tuple(float(buf[i0]) + (float(buf[i1]) - float(buf[i0])) * frac for i0, i1, frac in out)
+
+
+class _ResizePlan:
+    """(元サイズ → リサイズ後サイズ) ごとの双線形補間インデックス/重みとスクラッチ。"""
+
+    def __init__(self, src_hw: Tuple[int, int], new_hw: Tuple[int, int]):
+        h, w = src_hw
+        new_h, new_w = new_hw
+        x0, x1, fx = _linear_axis(w, np.linspace(0, w - 1, new_w))
+        y0, y1, fy = _linear_axis(h, np.linspace(0, h - 1, new_h))
+        self.idx = [
+            (y0[:, None] * w + x0[None, :]).ravel(),
+            (y0[:, None] * w + x1[None, :]).ravel(),
+            (y1[:, None] * w + x0[None, :]).ravel(),
+            (y1[:, None] * w + x1[None, :]).ravel(),
+        ]
+        self.fx = np.broadcast_to(fx[None, :], (new_h, new_w)).ravel().copy()
+        self.fy = np.broadcast_to(fy[:, None], (new_h, new_w)).ravel().copy()
+        self.corners = [np.empty(new_h * new_w, dtype=np.float32) for _ in range(4)]
+        self.scratch = np.empty(h * w, dtype=np.float32)
+
+
+class InferenceContext:
+    """
+    ONNX Runtime の IOBinding で入出力バッファを (N,H,W) ごとに確保して使い回す推論コンテキスト。
+    前処理は束縛済みの入力バッファへ直接書き込み、出力も束縛済みバッファから直接デコードするため、
+    定常状態では画像サイズに比例する新規確保が発生しない。
+    返すヒートマップはバッファのビューなので、次の呼び出し前に使い終えること。
+    """
+
+    # 保持する (N,H,W) ごとのバッファ数と元画像サイズごとのリサイズ計画数（計画は元画像大の作業領域を持つ）。
+    # サイズが混在する一括推論・全フレーム推論・局所再推論で増え続けないよう、古いものから捨てる
+    MAX_BUFFER_SETS = 8
+    MAX_RESIZE_PLANS = 4
+
+    def __init__(self, session, input_name: str, output_name: str, p_low: float = 1.0, p_high: float = 99.0):
+        self.session = session
+        self.input_name = input_name
+        self.output_name = output_name
+        self.p_low = p_low
+        self.p_high = p_high
+        out_shape = session.get_outputs()[0].shape
+        self.num_channels = out_shape[1] if isinstance(out_shape[1], int) else None
+        self._buffers = OrderedDict()
+        self._plans = OrderedDict()
+
+    def _buffers_for(self, n: int, h: int, w: int):
+        key = (n, h, w)
+        buffers = self._buffers.get(key)
+        if buffers is None:
+            buffers = self._buffers[key] = self._allocate(n, h, w)
+            while len(self._buffers) > self.MAX_BUFFER_SETS:
+                self._release(self._buffers.popitem(last=False)[0])
+        else:
+            self._buffers.move_to_end(key)
+        return buffers
+
+    def _probe_channels(self, h: int, w: int):
+        if self.num_channels is None:
+            # 出力チャネル数がモデルから分からない場合は1回通常実行して確かめる
+            probe = np.zeros((1, 1, h, w), dtype=np.float32)
+            self.num_channels = self.session.run([self.output_name], {self.input_name: probe})[0].shape[1]
+
+    def _allocate(self, n: int, h: int, w: int):
+        self._probe_channels(h, w)
+        inp = np.zeros((n, 1, h, w), dtype=np.float32)
+        out = np.empty((n, self.num_channels, h, w), dtype=np.float32)
+        binding = self.session.io_binding()
+        binding.bind_input(self.input_name, "cpu", 0, np.float32, list(inp.shape), inp.ctypes.data)
+        binding.bind_output(self.output_name, "cpu", 0, np.float32, list(out.shape), out.ctypes.data)
+        return inp, out, binding
+
+    def _release(self, key):
+        """_buffers から key が捨てられたときに呼ばれる（派生クラスの付随バッファ用）。"""
+
+    def _plan_for(self, src_hw, new_hw) -> _ResizePlan:
+        key = (tuple(src_hw), tuple(new_hw))
+        plan = self._plans.get(key)
+        if plan is None:
+            plan = self._plans[key] = _ResizePlan(src_hw, new_hw)
+            while len(self._plans) > self.MAX_RESIZE_PLANS:
+                self._plans.popitem(last=False)
+        else:
+            self._plans.move_to_end(key)
+        return plan
+
+    def clear(self):
+        """確保済みのバッファとリサイズ計画をすべて捨てる（モデルの切り替え時）。"""
+        for key in list(self._buffers):
+            self._release(key)
+        self._buffers.clear()
+        self._plans.clear()
+
+    def _gather_corners(self, img: np.ndarray, dst: np.ndarray):
+        """img を plan.scratch にコピーし、双線形補間の4近傍を plan.corners に集める。"""
+        h, w = img.shape
+        th, tw = dst.shape
+        scale = min(th / h, tw / w)
+        new_h = int(round(h * scale))
+        new_w = int(round(w * scale))
+        pad_y = (th - new_h) // 2
+        pad_x = (tw - new_w) // 2
+        plan = self._plan_for((h, w), (new_h, new_w))
+        np.copyto(plan.scratch.reshape(h, w), img, casting="unsafe")
+        for idx, corner in zip(plan.idx, plan.corners):
+            np.take(plan.scratch, idx, out=corner)
+        return plan, scale, pad_x, pad_y, new_h, new_w
+
+    @staticmethod
+    def _blend_corners(plan: _ResizePlan) -> np.ndarray:
+        """4近傍を補間して結果を plan.corners[3] に書く（その他の corners は壊す）。"""
+        c00, c01, c10, c11 = plan.corners
+        # top = c00 + (c01 - c00) * fx, bottom = c10 + (c11 - c10) * fx, out = top + (bottom - top) * fy
+        np.subtract(c01, c00, out=c01)
+        np.multiply(c01, plan.fx, out=c01)
+        np.add(c01, c00, out=c01)
+        np.subtract(c11, c10, out=c11)
+        np.multiply(c11, plan.fx, out=c11)
+        np.add(c11, c10, out=c11)
+        np.subtract(c11, c01, out=c11)
+        np.multiply(c11, plan.fy, out=c11)
+        np.add(c11, c01, out=c11)
+        return c11
+
+    def preprocess_into(self, img: np.ndarray, dst: np.ndarray):
+        """
+        preprocess_slice と同じ結果を dst (H,W) に直接書く。返り値: scale, pad_x, pad_y。
+        双線形補間は値に対してアフィンなので、4近傍をクリップしてから補間し最後に正規化しても同値。
+        """
+        plan, scale, pad_x, pad_y, new_h, new_w = self._gather_corners(img, dst)
+        lo, hi = _percentile_inplace(plan.scratch, self.p_low, self.p_high)
+        for corner in plan.corners:
+            np.clip(corner, lo, hi, out=corner)
+        c11 = self._blend_corners(plan)
+
+        dst.fill(0.0)
+        region = dst[pad_y : pad_y + new_h, pad_x : pad_x + new_w]
+        np.subtract(c11.reshape(new_h, new_w), lo, out=region)
+        np.multiply(region, 1.0 / (hi - lo + 1e-6), out=region)
+        return scale, pad_x, pad_y
+
+    def preprocess(self, images: Sequence[np.ndarray], input_hw: Tuple[int, int]):
+        """元画像 (H,W) のリストを束縛済み入力バッファへ前処理する。返り値: 入力バッファ (N,1,H,W), [(scale, pad_x, pad_y), ...]"""
+        inp, _, _ = self._buffers_for(len(images), *input_hw)
+        params = [self.preprocess_into(img, inp[i, 0]) for i, img in enumerate(images)]
+        return inp, params
+
+    def load_inputs(self, inputs: Sequence[np.ndarray], input_hw: Tuple[int, int]):
+        """前処理済みの入力 (H,W) を束縛済み入力バッファへコピーする（PreprocessCache のヒット時）。"""
+        inp, _, _ = self._buffers_for(len(inputs), *input_hw)
+        for i, x in enumerate(inputs):
+            np.copyto(inp[i, 0], x)
+        return inp
+
+    def run_bound(self, n: int, input_hw: Tuple[int, int]) -> np.ndarray:
+        """束縛済み入力バッファの内容で推論する。返り値: ヒートマップ (N,L,H,W)（バッファのビュー）"""
+        _, out, binding = self._buffers_for(n, *input_hw)
+        self.session.run_with_iobinding(binding)
+        return out
+
+    def warmup(self, n: int, h: int, w: int):
+        """(n,h,w) のバッファを確保してゼロ入力で1回実行する。"""
+        inp, _, binding = self._buffers_for(n, h, w)
+        inp.fill(0.0)
+        self.session.run_with_iobinding(binding)
+
+    def run(self, images: Sequence[np.ndarray], input_hw: Tuple[int, int]):
+        """
+        元画像 (H,W) のリストを前処理して1回の推論にかける。
+        返り値: ヒートマップ (N,L,H,W)（バッファのビュー）, [(scale, pad_x, pad_y), ...]
+        """
+        _, params = self.preprocess(images, input_hw)
+        return self.run_bound(len(images), input_hw), params
+
+
+# エンドツーエンドモデル（train/export_onnx.py --end-to-end）の出力名
+END_TO_END_OUTPUTS = ("coords", "scores")
+
+
+def is_end_to_end(session) -> bool:
+    """座標を直接出力するエンドツーエンドモデルか（正規化とデコードがグラフ内にある）。"""
+    names = {o.name for o in session.get_outputs()}
+    return all(name in names for name in END_TO_END_OUTPUTS)
+
+
+def heatmap_output_name(session) -> str:
+    """ヒートマップ出力の名前。エンドツーエンドモデルは --debug-heatmaps 付きでエクスポートした場合のみ持つ。"""
+    names = [o.name for o in session.get_outputs()]
+    if "heatmaps" in names:
+        return "heatmaps"
+    if is_end_to_end(session):
+        raise ValueError("このエンドツーエンドモデルはヒートマップを出力しません（--debug-heatmaps 付きで再エクスポートしてください）。")
+    return names[0]
+
+
+def raw_pad_resize(img: np.ndarray, target_hw: Tuple[int, int]):
+    """
+    エンドツーエンドモデル用の前処理（正規化なしのパディングリサイズ）。
+    余白は画像の最小値で埋める（グラフ内の最小/最大スケーリングで0になり、通常モデルのゼロ余白と揃う）。
+    """
+    return _pad_resize(img.astype(np.float32, copy=False), target_hw, pad_value=float(np.min(img)))
+
+
+class EndToEndContext(InferenceContext):
+    """
+    エンドツーエンドモデル用の InferenceContext。入力は正規化せずにリサイズ・パディングだけ行い、
+    出力は座標 (N,L,2)（モデル入力の画素座標）とピーク値 (N,L) だけを束縛する（ヒートマップを取り出さない）。
+    run_bound は座標バッファのビューを返し、ピーク値は scores_for で取れる。
+    """
+
+    def __init__(self, session, input_name: str):
+        super().__init__(session, input_name, END_TO_END_OUTPUTS[0])
+        self._scores = {}
+
+    def _allocate(self, n: int, h: int, w: int):
+        self._probe_channels(h, w)
+        inp = np.zeros((n, 1, h, w), dtype=np.float32)
+        coords = np.empty((n, self.num_channels, 2), dtype=np.float32)
+        scores = np.empty((n, self.num_channels), dtype=np.float32)
+        binding = self.session.io_binding()
+        binding.bind_input(self.input_name, "cpu", 0, np.float32, list(inp.shape), inp.ctypes.data)
+        binding.bind_output(END_TO_END_OUTPUTS[0], "cpu", 0, np.float32, list(coords.shape), coords.ctypes.data)
+        binding.bind_output(END_TO_END_OUTPUTS[1], "cpu", 0, np.float32, list(scores.shape), scores.ctypes.data)
+        self._scores[(n, h, w)] = scores
+        return inp, coords, binding
+
+    def _release(self, key):
+        self._scores.pop(key, None)
+
+    def scores_for(self, n: int, input_hw: Tuple[int, int]) -> np.ndarray:
+        """直前の run_bound のピーク値 (N,L)（バッファのビュー）。"""
+        return self._scores[(n, *input_hw)]
+
+    def preprocess_into(self, img: np.ndarray, dst: np.ndarray):
+        """raw_pad_resize と同じ結果を dst (H,W) に直接書く。返り値: scale, pad_x, pad_y。"""
+        plan, scale, pad_x, pad_y, new_h, new_w = self._gather_corners(img, dst)
+        resized = self._blend_corners(plan)
+        dst.fill(float(plan.scratch.min()))
+        np.copyto(dst[pad_y : pad_y + new_h, pad_x : pad_x + new_w], resized.reshape(new_h, new_w))
+        return scale, pad_x, pad_y
+
+
+class PreprocessCache:
+    """
+    前処理済み入力（パディングリサイズ後の (H,W) float32 と scale, pad_x, pad_y）の LRU キャッシュ。
+    合計バイト数が max_bytes を超えると古いものから捨てる。ワーカースレッドからも使えるよう排他する。
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def nbytes(self) -> int:
+        return self._bytes
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key: Hashable, value: Tuple[np.ndarray, float, float, float]):
+        nbytes = value[0].nbytes
+        with self._lock:
+            if key in self._entries:
+                self._bytes -= self._entries.pop(key)[0].nbytes
+            if nbytes > self.max_bytes:
+                return
+            self._entries[key] = value
+            self._bytes += nbytes
+            while self._bytes > self.max_bytes:
+                _, old = self._entries.popitem(last=False)
+                self._bytes -= old[0].nbytes
+
+    def evict(self, predicate: Callable[[Hashable], bool]) -> int:
+        """predicate(key) が真のエントリを捨てる（ノード削除時や画像更新時）。返り値: 捨てた件数。"""
+        with self._lock:
+            keys = [k for k in self._entries if predicate(k)]
+            for k in keys:
+                self._bytes -= self._entries.pop(k)[0].nbytes
+            return len(keys)
+
+    def clear(self):
+        self.evict(lambda _: True)
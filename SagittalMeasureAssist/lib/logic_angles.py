@@ -94,6 +94,7 @@ def lumbosacral_lordosis_deg(v_L1, v_S1):
 
 
 REQUIRED_KEYS = ["FH", "S1_ant", "S1_post", "L1_ant", "L1_post"]
+ANGLE_NAMES = ["PI", "PT", "SS", "LL"]
 
 
 def compute_angles_from_points(points):
@@ -109,20 +110,49 @@ def compute_angles_from_points(points):
     if missing:
         raise ValueError(f"Missing points: {', '.join(missing)}")
 
-    FH = points["FH"]
+    return {name: compute_angle(name, points) for name in ANGLE_NAMES}
+
+
+# Landmarks each angle depends on; a moved landmark only invalidates these angles.
+ANGLE_DEPENDENCIES = {
+    "PI": ("FH", "S1_ant", "S1_post"),
+    "PT": ("FH", "S1_ant", "S1_post"),
+    "SS": ("S1_ant", "S1_post"),
+    "LL": ("L1_ant", "L1_post", "S1_ant", "S1_post"),
+}
+
+
+def angles_affected_by(landmarks):
+    """Names of the angles (in ANGLE_NAMES order) that depend on any of `landmarks`."""
+    moved = set(landmarks)
+    return [name for name in ANGLE_NAMES if moved.intersection(ANGLE_DEPENDENCIES[name])]
+
+
+def _s1_vector(points):
+    return vector_from_points(points["S1_ant"], points["S1_post"])
+
+
+def _pelvis_vector(points):
     S1_ant = points["S1_ant"]
     S1_post = points["S1_post"]
-    L1_ant = points["L1_ant"]
-    L1_post = points["L1_post"]
-
-    v_S1 = vector_from_points(S1_ant, S1_post)
-    v_L1 = vector_from_points(L1_ant, L1_post)
     S1_mid = ((S1_ant[0] + S1_post[0]) / 2.0, (S1_ant[1] + S1_post[1]) / 2.0)
-    v_pelvis = vector_from_points(FH, S1_mid)
+    return vector_from_points(points["FH"], S1_mid)
+
 
-    SS = signed_slope_angle_deg(v_S1)
-    PT = signed_vertical_angle_deg(v_pelvis)
-    LL = lumbosacral_lordosis_deg(v_L1, v_S1)
-    PI_modified = pelvic_incidence_deg(v_pelvis, v_S1)
+_ANGLE_FUNCS = {
+    "PI": lambda p: pelvic_incidence_deg(_pelvis_vector(p), _s1_vector(p)),
+    "PT": lambda p: signed_vertical_angle_deg(_pelvis_vector(p)),
+    "SS": lambda p: signed_slope_angle_deg(_s1_vector(p)),
+    "LL": lambda p: lumbosacral_lordosis_deg(vector_from_points(p["L1_ant"], p["L1_post"]), _s1_vector(p)),
+}
 
-    return {"PI": PI_modified, "PT": PT, "SS": SS, "LL": LL}
+
+def compute_angle(name, points):
+    """
+    Compute a single angle ("PI", "PT", "SS" or "LL") using only the landmarks it depends on.
+    Same values as compute_angles_from_points; raises ValueError on missing points.
+    """
+    missing = [k for k in ANGLE_DEPENDENCIES[name] if k not in points]
+    if missing:
+        raise ValueError(f"Missing points: {', '.join(missing)}")
+    return _ANGLE_FUNCS[name](points)
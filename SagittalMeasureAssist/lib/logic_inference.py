@@ -3,57 +3,42 @@ ONNX推論ロジック：Volumeから2D画像を取り出し、パディング
 ヒートマップ最大値を元画像座標に戻してMarkupsに配置する。
 """
 
+import json
+import logging
 import os
-from typing import List, Tuple
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
 
 import numpy as np
 import slicer
 import vtk
 
-from logic_angles import REQUIRED_KEYS
-
-
-def _percentile_clip_norm(img: np.ndarray, p_low=1.0, p_high=99.0) -> np.ndarray:
-    lo, hi = np.percentile(img, [p_low, p_high])
-    eps = 1e-6
-    img = np.clip(img, lo, hi)
-    img = (img - lo) / (hi - lo + eps)
-    return img.astype(np.float32)
-
-
-def _resize_bilinear(img: np.ndarray, new_h: int, new_w: int) -> np.ndarray:
-    """
-    Minimal bilinear resize using separable 1D interpolation (no external deps).
-    img: (H,W)
-    """
-    h, w = img.shape
-    x_old = np.arange(w)
-    x_new = np.linspace(0, w - 1, new_w)
-    # interpolate along x for each row
-    tmp = np.zeros((h, new_w), dtype=np.float32)
-    for i in range(h):
-        tmp[i] = np.interp(x_new, x_old, img[i])
-    y_old = np.arange(h)
-    y_new = np.linspace(0, h - 1, new_h)
-    out = np.zeros((new_h, new_w), dtype=np.float32)
-    for j in range(new_w):
-        out[:, j] = np.interp(y_new, y_old, tmp[:, j])
-    return out
-
-
-def _pad_resize(img: np.ndarray, target_hw: Tuple[int, int]):
-    """縦横比を維持してリサイズし、余白ゼロパディング。返り値: 画像, scale, pad_x, pad_y。"""
-    h, w = img.shape
-    th, tw = target_hw
-    scale = min(th / h, tw / w)
-    new_h = int(round(h * scale))
-    new_w = int(round(w * scale))
-    resized = _resize_bilinear(img, new_h, new_w)
-
-    pad_y = (th - new_h) // 2
-    pad_x = (tw - new_w) // 2
-    padded = np.pad(resized, ((pad_y, th - new_h - pad_y), (pad_x, tw - new_w - pad_x)), mode="constant")
-    return padded.astype(np.float32), scale, pad_x, pad_y
+from inference_core import (
+    TTA_PRESETS,
+    EndToEndContext,
+    InferenceContext,
+    PreprocessCache,
+    build_tta_batch,
+    choose_input_shape,
+    decode_heatmaps,
+    fuse_tta_heatmaps,
+    invert_tta_coords,
+    is_end_to_end,
+    preprocess_slice,
+    raw_pad_resize,
+    refine_crop,
+    to_original_coords,
+)
+from logic_export import REQUIRED_LABELS_ORDERED
+from ort_profile import create_session
+
+
+# 前処理済み入力キャッシュの上限（バイト）。512x512 入力は1件1MBなので、数百件の画像を保持できる
+PREPROCESS_CACHE_MAX_BYTES = 256 * 1024 * 1024
+
+# ドラッグした点の局所再推論の入力サイズ（動的H/Wモデルのみ。固定形状モデルはその形状で切り出す）
+REFINE_INPUT_HW = (128, 128)
 
 
 class OnnxInferenceLogic:
@@ -62,49 +47,243 @@ class OnnxInferenceLogic:
         self.input_name = None
         self.output_name = None
         self.model_path = None
+        self.model_mtime = None
         self.target_hw = (512, 512)
+        # 動的H/Wモデルでは画像の縦横比に近い入力形状を使う（パディング分の計算を減らす）
+        self.dynamic_hw = False
+        self.input_shapes = None
+        # テスト時拡張のバリアント（TTA_PRESETS のいずれか）
+        self.tta_variants = TTA_PRESETS["none"]
+        # セッション生成/ウォームアップはバックグラウンドスレッドからも呼ばれるため排他する
+        self._lock = threading.RLock()
+        self._warmup_thread = None
+        # 直近のバックグラウンド読み込みの結果（reload_status）と、読み込みに失敗したファイルの (パス, 更新時刻)
+        self._warmup_result = None
+        self._failed_model = None
+        # IOBindingの入出力バッファを使い回す（単画像・TTAなしの推論用）
+        self.context = None
+        self.session_options = None
+        self.model_version = None
+        # 正規化と座標デコードをグラフ内で行うモデル（export_onnx.py --end-to-end）か
+        self.end_to_end = False
+        # パッチ学習したモデル（train.py --patch-size）の縮尺（モデル画素/元画像画素）。局所補正はこの縮尺で切り出す
+        self.patch_scale = None
+        # 同じVolumeの再推論（モデルやTTAの切り替え後など）で arrayFromVolume・正規化・リサイズを繰り返さない。
+        # キー: (ノードID, 画像データのMTime, フレーム, 画像(H,W), 入力(H,W), エンドツーエンドか)
+        self.preprocess_cache = PreprocessCache(PREPROCESS_CACHE_MAX_BYTES)
+        # 局所再推論用の元画像の強度範囲。キー: (ノードID, MTime, フレーム, エンドツーエンドか)
+        self._refine_windows = {}
 
     def load_model(self, model_path: str, target_hw: Tuple[int, int]):
         try:
-            import onnxruntime as ort
+            import onnxruntime  # noqa: F401
         except ImportError as exc:
             raise ImportError("onnxruntime がインストールされていません。`uv sync --extra ml` を実行してください。") from exc
 
         if not os.path.exists(model_path):
             raise FileNotFoundError(f"モデルが見つかりません: {model_path}")
-        self.target_hw = target_hw
-        self.session = ort.InferenceSession(model_path, providers=["CPUExecutionProvider"])
-        self.input_name = self.session.get_inputs()[0].name
-        self.output_name = self.session.get_outputs()[0].name
-        self.model_path = model_path
+        # 更新時刻はセッション生成前に取る（生成中に差し替えられても次回の監視で再ロードされる）
+        mtime = os.path.getmtime(model_path)
+        # セッション生成は重いのでロック外で行い、完成してから差し替える（推論中の旧セッションは止めない）
+        # train/autotune_ort.py で保存したSessionOptionsプロファイルがあれば使う
+        session, session_options = create_session(model_path)
+        input_name = session.get_inputs()[0].name
+        end_to_end = is_end_to_end(session)
+        if end_to_end:
+            # 座標とピーク値だけを取り出す（ヒートマップはORTの外にコピーしない）
+            context = EndToEndContext(session, input_name)
+            output_name = context.output_name
+        else:
+            output_name = session.get_outputs()[0].name
+            context = InferenceContext(session, input_name, output_name)
+        input_shape = session.get_inputs()[0].shape
+        meta = session.get_modelmeta().custom_metadata_map
+        if session_options is not None:
+            logging.info("ONNX Runtime profile: %s", session_options)
+        with self._lock:
+            if self.context is not None:
+                # 旧モデル用のバッファ・リサイズ計画を手放す
+                self.context.clear()
+            self.target_hw = tuple(target_hw)
+            self.session = session
+            self.session_options = session_options
+            self.input_name = input_name
+            self.output_name = output_name
+            self.context = context
+            self.end_to_end = end_to_end
+            self.dynamic_hw = not all(isinstance(d, int) for d in input_shape[2:4])
+            self.input_shapes = [tuple(s) for s in json.loads(meta["input_shapes"])] if "input_shapes" in meta else None
+            # finetune_daemon.py が公開したモデルはバージョンを持つ
+            self.model_version = meta.get("model_version")
+            self.patch_scale = float(meta["patch_scale"]) if "patch_scale" in meta else None
+            self.model_path = model_path
+            self.model_mtime = mtime
+
+    def is_loaded(self, model_path: str, target_hw: Tuple[int, int]) -> bool:
+        """同じモデル（更新時刻も一致）・入力サイズでロード済みか。"""
+        if self.session is None or self.model_path != model_path:
+            return False
+        if tuple(self.target_hw) != tuple(target_hw):
+            return False
+        return os.path.exists(model_path) and os.path.getmtime(model_path) == self.model_mtime
+
+    def model_file_changed(self) -> bool:
+        """
+        ロード済みモデルのファイルが差し替えられたか（ファイルが一時的に無い間は変更なし扱い）。
+        読み込みに失敗したのと同じファイル（更新時刻が同じ）は、再び差し替えられるまで変更なし扱い。
+        """
+        path = self.model_path
+        if self.session is None or path is None or not os.path.exists(path):
+            return False
+        mtime = os.path.getmtime(path)
+        return mtime != self.model_mtime and (path, mtime) != self._failed_model
+
+    def ensure_model(self, model_path: str, target_hw: Tuple[int, int]):
+        """ロード済みセッションを再利用し、必要な場合のみロードする。ウォームアップ中なら完了を待つ。"""
+        self.wait_for_warmup()
+        with self._lock:
+            if not self.is_loaded(model_path, target_hw):
+                self.load_model(model_path, target_hw)
+
+    def warmup(self):
+        """既定の入力形状でバッファを確保して1回推論し、ORTの初回アロケーションを済ませておく。"""
+        with self._lock:
+            if self.session is None:
+                return
+            self.context.warmup(1, *self.target_hw)
+
+    def start_warmup(self, model_path: str, target_hw: Tuple[int, int]):
+        """バックグラウンドスレッドでセッション生成とウォームアップを行う。結果は reload_status で確認する。"""
+        if self._warmup_thread is not None and self._warmup_thread.is_alive():
+            return
+
+        def _run():
+            mtime = os.path.getmtime(model_path) if os.path.exists(model_path) else None
+            try:
+                # load_model はセッション生成中にロックを持たないため、差し替え中も旧モデルで推論できる
+                if not self.is_loaded(model_path, target_hw):
+                    self.load_model(model_path, target_hw)
+                self.warmup()
+            except Exception as exc:
+                logging.exception("ONNX model warm-up failed")
+                # 同じファイルを監視のたびに読み直さない（失敗したファイルの更新時刻を覚えておく）
+                self._failed_model = (model_path, mtime)
+                self._warmup_result = {"ok": False, "version": None, "error": str(exc)}
+            else:
+                self._warmup_result = {
+                    "ok": True,
+                    "version": self.model_version or os.path.basename(model_path),
+                    "error": None,
+                }
+
+        self._warmup_result = None
+        self._warmup_thread = threading.Thread(target=_run, name="SagittalMeasureAssistWarmup", daemon=True)
+        self._warmup_thread.start()
+
+    def reload_status(self) -> Optional[Dict]:
+        """
+        start_warmup で始めた読み込みの結果。実行中（または未実行）なら None、
+        終了後は {"ok": 成否, "version": 読み込んだモデルのバージョン, "error": 失敗理由}。
+        """
+        thread = self._warmup_thread
+        if thread is None or thread.is_alive():
+            return None
+        return self._warmup_result
+
+    def wait_for_warmup(self):
+        thread = self._warmup_thread
+        if thread is not None and thread.is_alive():
+            thread.join()
 
-    def _extract_slice(self, volumeNode):
+    def _extract_frames(self, volumeNode):
         arr = slicer.util.arrayFromVolume(volumeNode)
-        if arr.ndim == 3:
-            img2d = arr[0]
-        else:
+        if arr.ndim != 3:
             raise ValueError(f"期待するshape (D,H,W) ですが取得: {arr.shape}")
-        return img2d
+        return arr
+
+    def extract_slice(self, volumeNode, frame: int = 0):
+        """Volumeのフレーム frame の2D配列（Volumeの配列のビュー。メインスレッドから呼ぶ）。"""
+        return self._extract_frames(volumeNode)[frame]
+
+    def volume_cache_key(self, volumeNode, frame: int = 0):
+        """前処理キャッシュのキー（入力サイズを除く）。画像が更新されるとMTimeが変わり別キーになる。"""
+        imageData = volumeNode.GetImageData()
+        dims = imageData.GetDimensions()
+        return (volumeNode.GetID(), imageData.GetMTime(), int(frame), (dims[1], dims[0]))
+
+    def forget_volume(self, node_id: str):
+        """削除されたVolumeの前処理結果をキャッシュから捨てる。"""
+        self.preprocess_cache.evict(lambda key: key[0] == node_id)
+        self._refine_windows = {k: v for k, v in self._refine_windows.items() if k[0] != node_id}
+
+    def _store_preprocessed(self, key, inp2d: np.ndarray, params):
+        # 同じVolume・フレームの古いMTimeの結果はもう使われないので先に捨てる
+        self.preprocess_cache.evict(lambda k: k[0] == key[0] and k[2] == key[2] and k[1] != key[1])
+        self.preprocess_cache.put(key, (inp2d, *params))
+
+    def _full_cache_key(self, key):
+        # エンドツーエンドモデルは正規化前の入力を使うため、モデルを切り替えても取り違えないよう区別する
+        return key + (self.input_shape_for(key[3]), self.end_to_end)
+
+    def lookup_preprocessed(self, key):
+        """
+        key（volume_cache_key）の前処理結果がキャッシュにあれば _preprocess と同じ形で返す（なければ None）。
+        ノードから画像を取り出す・コピーする前に呼び、ヒットしたものは取り出しを省く。
+        """
+        cached = self.preprocess_cache.get(self._full_cache_key(key))
+        if cached is None:
+            return None
+        return (cached[0][np.newaxis, np.newaxis], *cached[1:])
+
+    def _preprocess_cached(self, img2d: np.ndarray, key=None):
+        """_preprocess と同じ結果を返す。key（volume_cache_key）があればキャッシュを使う。"""
+        if key is None:
+            return self._preprocess(img2d)
+        cached = self.lookup_preprocessed(key)
+        if cached is not None:
+            return cached
+        inp, scale, pad_x, pad_y = self._preprocess(img2d)
+        self._store_preprocessed(self._full_cache_key(key), inp[0, 0], (scale, pad_x, pad_y))
+        return inp, scale, pad_x, pad_y
+
+    def input_shape_for(self, image_hw) -> Tuple[int, int]:
+        return choose_input_shape(image_hw, self.target_hw, self.input_shapes, self.dynamic_hw)
 
     def _preprocess(self, img2d: np.ndarray):
-        img_norm = _percentile_clip_norm(img2d)
-        img_pad, scale, pad_x, pad_y = _pad_resize(img_norm, self.target_hw)
-        # ONNXには (1,1,H,W)
-        input_tensor = img_pad[np.newaxis, np.newaxis, :, :].astype(np.float32)
+        input_hw = self.input_shape_for(img2d.shape)
+        if self.end_to_end:
+            # 正規化はグラフ内で行う
+            img_pad, scale, pad_x, pad_y = raw_pad_resize(img2d, input_hw)
+        else:
+            img_pad, scale, pad_x, pad_y = preprocess_slice(img2d, input_hw)
+        # ONNXには (1,1,H,W)（img_pad は float32 なのでビューで渡す）
+        input_tensor = img_pad[np.newaxis, np.newaxis, :, :]
         return input_tensor, scale, pad_x, pad_y
 
-    def _postprocess(self, heatmaps: np.ndarray, scale: float, pad_x: float, pad_y: float) -> List[Tuple[float, float]]:
-        # heatmaps: (1, L, H, W)
-        hm = heatmaps[0]
-        coords = []
-        for c in hm:
-            idx = np.argmax(c)
-            y, x = np.unravel_index(idx, c.shape)
-            # 逆変換（paddingとスケールを戻す）
-            x_orig = (x - pad_x) / scale
-            y_orig = (y - pad_y) / scale
-            coords.append((x_orig, y_orig))
-        return coords
+    def set_tta(self, preset: str):
+        if preset not in TTA_PRESETS:
+            raise ValueError(f"未知のTTA設定です: {preset}")
+        self.tta_variants = TTA_PRESETS[preset]
+
+    def _run_coords(self, inp: np.ndarray) -> np.ndarray:
+        """
+        (N,1,H,W) を推論してモデル入力座標 (N,L,2) を返す。
+        TTA有効時は全バリアントを動的バッチ軸に積んで1回の session.run で流し、
+        ヒートマップ（エンドツーエンドモデルでは座標）を逆変換して平均する。
+        """
+        variants = self.tta_variants
+        if len(variants) == 1 and variants[0] == (False, 1.0):
+            batch = inp
+        else:
+            # 正規化前の入力は範囲外を各画像の最小値で埋める（raw_pad_resize のパディングと同じ規則）
+            fill = inp.reshape(inp.shape[0], -1).min(axis=1) if self.end_to_end else None
+            batch = build_tta_batch(inp, variants, fill)
+        with self._lock:
+            outputs = self.session.run([self.output_name], {self.input_name: batch})
+        out = outputs[0]
+        if self.end_to_end:
+            return out if batch is inp else invert_tta_coords(out, variants, inp.shape[2:]).mean(axis=1)
+        return decode_heatmaps(out if batch is inp else fuse_tta_heatmaps(out, variants))
 
     def _ijk_to_ras(self, volumeNode, i, j, k=0.0):
         mat = vtk.vtkMatrix4x4()
@@ -113,23 +292,190 @@ class OnnxInferenceLogic:
         ras_h = mat.MultiplyPoint(ijk_h)
         return ras_h[:3]
 
-    def _coords_ij_to_ras(self, volumeNode, coords_ij):
+    def _coords_ij_to_ras(self, volumeNode, coords_ij, k: float = 0.0):
         coords_ras = []
         for (i, j) in coords_ij:
-            coords_ras.append(self._ijk_to_ras(volumeNode, i, j, 0.0))
+            coords_ras.append(self._ijk_to_ras(volumeNode, i, j, k))
         return coords_ras
 
+    def place_points(self, volumeNode, markupNode, coords_ij, k: float = 0.0):
+        """フレーム k 上のIJ座標をRASに変換してMarkupsの点を置き換え、ランドマーク名を付ける。"""
+        markupNode.RemoveAllControlPoints()
+        for idx, ras in enumerate(self._coords_ij_to_ras(volumeNode, coords_ij, k)):
+            markupNode.AddControlPoint(ras[0], ras[1], ras[2])
+            markupNode.SetNthControlPointLabel(idx, REQUIRED_LABELS_ORDERED[idx])
+
     def predict_and_place(self, volumeNode, markupNode):
         if self.session is None:
             raise RuntimeError("モデルがロードされていません。")
-        img2d = self._extract_slice(volumeNode)
-        inp, scale, pad_x, pad_y = self._preprocess(img2d)
-        outputs = self.session.run([self.output_name], {self.input_name: inp})
-        coords_ij = self._postprocess(outputs[0], scale, pad_x, pad_y)
-        # 書き込み
-        markupNode.RemoveAllControlPoints()
-        for idx, (x, y) in enumerate(coords_ij):
-            ras = self._ijk_to_ras(volumeNode, x, y, 0.0)
-            markupNode.AddControlPoint(ras[0], ras[1], ras[2])
-            markupNode.SetNthControlPointLabel(idx, REQUIRED_KEYS[idx])
+        key = self.volume_cache_key(volumeNode)
+        if self.tta_variants == TTA_PRESETS["none"]:
+            # 束縛済みバッファに直接前処理し、出力バッファから直接デコードする（定常状態で大きな確保なし）。
+            # 前処理済みならキャッシュから入力バッファへコピーするだけ
+            full_key = self._full_cache_key(key)
+            input_hw = full_key[4]
+            cached = self.preprocess_cache.get(full_key)
+            with self._lock:
+                if cached is None:
+                    inp, params = self.context.preprocess([self.extract_slice(volumeNode)], input_hw)
+                    self._store_preprocessed(full_key, inp[0, 0].copy(), params[0])
+                else:
+                    self.context.load_inputs([cached[0]], input_hw)
+                    params = [cached[1:]]
+                out = self.context.run_bound(1, input_hw)
+                # エンドツーエンドモデルは座標を直接出力する。通常モデルはヒートマップの最大位置を取る
+                coords = out[0] if self.end_to_end else decode_heatmaps(out)[0]
+                coords_ij = to_original_coords(coords, *params[0])
+        else:
+            cached = self.lookup_preprocessed(key)
+            if cached is None:
+                cached = self._preprocess_cached(self.extract_slice(volumeNode), key)
+            inp, scale, pad_x, pad_y = cached
+            coords_ij = to_original_coords(self._run_coords(inp)[0], scale, pad_x, pad_y)
+        self.place_points(volumeNode, markupNode, coords_ij)
         return coords_ij
+
+    def _refine_window(self, key, img2d: np.ndarray):
+        """
+        局所再推論で使う元画像全体の強度範囲（全体推論と同じ正規化にするため）。
+        通常モデルは (p1, p99)、エンドツーエンドモデルは余白を埋める最小値のみ使う。
+        """
+        wkey = key[:3] + (self.end_to_end,)
+        if wkey not in self._refine_windows:
+            # 古いMTimeの範囲は不要になる
+            self._refine_windows = {k: v for k, v in self._refine_windows.items() if k[0] != key[0] or k[2] != key[2]}
+            if self.end_to_end:
+                self._refine_windows[wkey] = (float(np.min(img2d)), float(np.max(img2d)))
+            else:
+                self._refine_windows[wkey] = tuple(float(v) for v in np.percentile(img2d, [1.0, 99.0]))
+        return self._refine_windows[wkey]
+
+    def refine_point(self, volumeNode, markupNode, index: int, frame: int = 0):
+        """
+        Markupsの index 番目の点のまわりだけを切り出して再推論し、その点だけを局所ピークへ移動する。
+        切り出しは全体推論と同じ縮尺（モデルから見た構造の大きさが同じ。パッチ学習したモデルはその縮尺）で、動的H/Wモデルでは
+        REFINE_INPUT_HW の小さな入力になるため数十msで終わる。返り値: 新しいIJ座標とピーク値。
+        """
+        if self.session is None:
+            raise RuntimeError("モデルがロードされていません。")
+        img2d = self.extract_slice(volumeNode, frame)
+        key = self.volume_cache_key(volumeNode, frame)
+
+        ras = [0.0, 0.0, 0.0]
+        markupNode.GetNthControlPointPosition(index, ras)
+        mat = vtk.vtkMatrix4x4()
+        volumeNode.GetRASToIJKMatrix(mat)
+        i, j, _, _ = mat.MultiplyPoint([ras[0], ras[1], ras[2], 1.0])
+
+        if self.patch_scale is not None:
+            scale = self.patch_scale
+        else:
+            full_hw = self.input_shape_for(img2d.shape)
+            scale = min(full_hw[0] / img2d.shape[0], full_hw[1] / img2d.shape[1])
+        crop_hw = REFINE_INPUT_HW if self.dynamic_hw else tuple(self.target_hw)
+        lo, hi = self._refine_window(key, img2d)
+        if self.end_to_end:
+            # 正規化はグラフ内（切り出し範囲の最小/最大）。範囲外は画像の最小値で埋める
+            crop, (x0, y0) = refine_crop(img2d, (i, j), scale, crop_hw, fill=lo)
+        else:
+            crop, (x0, y0) = refine_crop(img2d, (i, j), scale, crop_hw, window=(lo, hi))
+
+        with self._lock:
+            if self.end_to_end:
+                coords, scores = self.session.run(["coords", "scores"], {self.input_name: crop[np.newaxis, np.newaxis]})
+                u, v = coords[0, index]
+                peak = float(scores[0, index])
+            else:
+                heatmaps = self.session.run([self.output_name], {self.input_name: crop[np.newaxis, np.newaxis]})[0]
+                u, v = decode_heatmaps(heatmaps[:, index : index + 1])[0, 0]
+                peak = float(heatmaps[0, index].max())
+        new_ij = (x0 + float(u) / scale, y0 + float(v) / scale)
+        ras = self._ijk_to_ras(volumeNode, new_ij[0], new_ij[1], frame)
+        markupNode.SetNthControlPointPosition(index, ras[0], ras[1], ras[2])
+        return new_ij, peak
+
+    def predict_frames(self, volumeNode) -> List[List[Tuple[float, float]]]:
+        """
+        (D,H,W) Volumeの全フレームを推論する（前後屈シリーズやマルチフレーム画像用）。
+        前処理はスレッド並列、推論は全フレームをまとめた1回の session.run。返り値: フレームごとのIJ座標。
+        """
+        depth = volumeNode.GetImageData().GetDimensions()[2]
+        keys = [self.volume_cache_key(volumeNode, k) for k in range(depth)]
+        # キャッシュ済みのフレームは取り出さない（全フレームヒットならVolumeの配列にも触れない）
+        hits = {}
+        for k, key in enumerate(keys):
+            cached = self.lookup_preprocessed(key)
+            if cached is not None:
+                hits[k] = cached
+        frames = self._extract_frames(volumeNode) if len(hits) < depth else None
+        images = [None if k in hits else frames[k] for k in range(depth)]
+        return self.predict_arrays(images, batch_size=max(1, depth), cache_keys=keys, preprocessed=hits)
+
+    def predict_arrays(
+        self,
+        images: Sequence[np.ndarray],
+        batch_size: int = 8,
+        num_threads: Optional[int] = None,
+        progress: Optional[Callable[[int, int], None]] = None,
+        cache_keys: Optional[Sequence] = None,
+        errors: Optional[Dict[int, Exception]] = None,
+        preprocessed: Optional[Dict[int, tuple]] = None,
+    ) -> List[List[Tuple[float, float]]]:
+        """
+        複数の2D画像をまとめて推論する（Slicerのノードには触れないのでワーカースレッドから呼べる）。
+        前処理はスレッドで並列に行い、キャッシュ済みの1セッションに batch_size 枚ずつ流す。
+        progress(完了枚数, 全枚数) はバッチごとに呼ばれる。
+        cache_keys（画像ごとの volume_cache_key、メインスレッドで取得）を渡すと前処理キャッシュを使う。
+        errors（dict）を渡すと、失敗した画像は例外を送出せず errors[画像番号] に記録し、結果を None にする。
+        preprocessed（画像番号 -> lookup_preprocessed の結果）の画像はそのまま使う（images の該当要素は None でよい）。
+        """
+        if self.session is None:
+            raise RuntimeError("モデルがロードされていません。")
+        total = len(images)
+        keys = cache_keys if cache_keys is not None else [None] * total
+
+        preprocessed = preprocessed or {}
+
+        def _prep(i):
+            if i in preprocessed:
+                return preprocessed[i]
+            try:
+                return self._preprocess_cached(images[i], keys[i])
+            except Exception as exc:
+                if errors is None:
+                    raise
+                return exc
+
+        with ThreadPoolExecutor(max_workers=num_threads) as pool:
+            prepped = list(pool.map(_prep, range(total)))
+
+        results = [None] * total
+        # 入力形状（縦横比で選ばれる）ごとにまとめてバッチ化する
+        groups = {}
+        done = 0
+        for i, item in enumerate(prepped):
+            if isinstance(item, Exception):
+                errors[i] = item
+                done += 1
+                continue
+            groups.setdefault(item[0].shape, []).append(i)
+
+        for indices in groups.values():
+            for start in range(0, len(indices), batch_size):
+                chunk = indices[start : start + batch_size]
+                try:
+                    inp = np.concatenate([prepped[i][0] for i in chunk], axis=0)
+                    coords = self._run_coords(inp)
+                except Exception as exc:
+                    if errors is None:
+                        raise
+                    errors.update((i, exc) for i in chunk)
+                    coords = None
+                if coords is not None:
+                    for i, c in zip(chunk, coords):
+                        _, scale, pad_x, pad_y = prepped[i]
+                        results[i] = to_original_coords(c, scale, pad_x, pad_y)
+                done += len(chunk)
+                if progress is not None:
+                    progress(done, total)
+        return results
@@ -0,0 +1,188 @@
+"""
+ONNX Runtime の SessionOptions プロファイル（スレッド数・実行モード・グラフ最適化・メモリアリーナ）。
+マシンごとに最適値が異なるため、train/autotune_ort.py で実機ベンチマークした結果を設定ファイルに保存し、
+Slicerの推論ロジックや train/ の推論スクリプトがセッション生成時に自動で読み込む。
+slicer非依存（onnxruntime は使う時点でimport）。
+"""
+
+import hashlib
+import json
+import logging
+import os
+import platform
+import statistics
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+# 既定の保存先（環境変数で上書き可）
+PROFILE_ENV = "SAGITTAL_ORT_PROFILE"
+DEFAULT_PROFILE_PATH = os.path.join(os.path.expanduser("~"), ".sagittal_measure_assist", "ort_profile.json")
+
+# プロファイルのキーとSessionOptionsの既定値（ORTの既定に合わせる）
+DEFAULT_OPTIONS = {
+    "intra_op_num_threads": 0,
+    "inter_op_num_threads": 0,
+    "execution_mode": "sequential",
+    "graph_optimization_level": "all",
+    "enable_cpu_mem_arena": True,
+    "enable_mem_pattern": True,
+}
+
+
+def profile_path(path: Optional[str] = None) -> str:
+    return path or os.environ.get(PROFILE_ENV) or DEFAULT_PROFILE_PATH
+
+
+def _host_id() -> str:
+    return f"{platform.node()}|{platform.machine()}|{os.cpu_count()}"
+
+
+def model_key(model_path: str) -> str:
+    """
+    モデルファイルの識別子（絶対パス・サイズ・更新時刻のSHA1先頭12文字）。内容を読まないので
+    大きなモデルの差し替えでも安い。ファイルが置き換わると別キーになり、調整し直すまで既定値を使う。
+    """
+    st = os.stat(model_path)
+    ident = f"{os.path.realpath(model_path)}|{st.st_size}|{st.st_mtime_ns}"
+    return hashlib.sha1(ident.encode()).hexdigest()[:12]
+
+
+def _read(path: str) -> Dict:
+    try:
+        with open(path, "r", encoding="utf-8") as fp:
+            data = json.load(fp)
+    except (OSError, ValueError):
+        return {}
+    # 別マシンで作られた設定（ホームディレクトリ共有など）は使わない
+    return data if data.get("host") == _host_id() else {}
+
+
+def load_profile(model_path: Optional[str] = None, path: Optional[str] = None) -> Optional[Dict]:
+    """
+    このモデルファイル用に保存したプロファイル（無ければ None）。別のモデルの設定は流用しない。
+    model_path が None なら最後に調整したプロファイル。
+    """
+    data = _read(profile_path(path))
+    if model_path is None:
+        return data.get("default")
+    if not os.path.exists(model_path):
+        return None
+    return data.get("models", {}).get(model_key(model_path))
+
+
+def save_profile(profile: Dict, model_path: Optional[str] = None, path: Optional[str] = None) -> str:
+    """プロファイルを保存する（モデル別＋既定として）。一時ファイル経由で置き換える。"""
+    path = profile_path(path)
+    data = _read(path)
+    data["host"] = _host_id()
+    data["default"] = profile
+    if model_path is not None:
+        data.setdefault("models", {})[model_key(model_path)] = profile
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as fp:
+        json.dump(data, fp, indent=2)
+    os.replace(tmp, path)
+    return path
+
+
+def make_session_options(options: Optional[Dict] = None):
+    import onnxruntime as ort
+
+    opts = {**DEFAULT_OPTIONS, **(options or {})}
+    so = ort.SessionOptions()
+    so.intra_op_num_threads = int(opts["intra_op_num_threads"])
+    so.inter_op_num_threads = int(opts["inter_op_num_threads"])
+    so.execution_mode = {
+        "sequential": ort.ExecutionMode.ORT_SEQUENTIAL,
+        "parallel": ort.ExecutionMode.ORT_PARALLEL,
+    }[opts["execution_mode"]]
+    so.graph_optimization_level = {
+        "disable": ort.GraphOptimizationLevel.ORT_DISABLE_ALL,
+        "basic": ort.GraphOptimizationLevel.ORT_ENABLE_BASIC,
+        "extended": ort.GraphOptimizationLevel.ORT_ENABLE_EXTENDED,
+        "all": ort.GraphOptimizationLevel.ORT_ENABLE_ALL,
+    }[opts["graph_optimization_level"]]
+    so.enable_cpu_mem_arena = bool(opts["enable_cpu_mem_arena"])
+    so.enable_mem_pattern = bool(opts["enable_mem_pattern"])
+    return so
+
+
+def create_session(model_path: str, options: Optional[Dict] = None, path: Optional[str] = None):
+    """
+    CPU用の InferenceSession を作る。options 未指定ならこのモデル用に保存したプロファイル（無ければORT既定）を使う。
+    返り値: (session, 使った options（プロファイルが無ければ None）)
+    """
+    import onnxruntime as ort
+
+    if options is None:
+        profile = load_profile(model_path, path)
+        options = profile.get("options") if profile else None
+        if options is None:
+            logging.info("No tuned ORT profile for %s; using ONNX Runtime defaults (see train/autotune_ort.py)", model_path)
+    so = make_session_options(options)
+    return ort.InferenceSession(model_path, sess_options=so, providers=["CPUExecutionProvider"]), options
+
+
+def _thread_candidates(cpu_count: int) -> List[int]:
+    values = {1, 2, 4, cpu_count // 2, cpu_count}
+    return sorted(v for v in values if 1 <= v <= cpu_count)
+
+
+def benchmark_options(model_path: str, options: Dict, input_shape: Sequence[int], iters: int = 10) -> float:
+    """options でセッションを作り、ウォームアップ後の推論レイテンシ中央値（ms）を返す。"""
+    session, _ = create_session(model_path, options)
+    feed = {session.get_inputs()[0].name: np.random.default_rng(0).random(input_shape, dtype=np.float32)}
+    session.run(None, feed)
+    times = []
+    for _ in range(iters):
+        start = time.perf_counter()
+        session.run(None, feed)
+        times.append((time.perf_counter() - start) * 1000.0)
+    return statistics.median(times)
+
+
+def autotune(
+    model_path: str,
+    input_hw: Tuple[int, int],
+    batch_size: int = 1,
+    iters: int = 10,
+    cpu_count: Optional[int] = None,
+    log=print,
+) -> Dict:
+    """
+    段階的に SessionOptions を探索する（全組合せは多すぎるため）:
+    1) intra-op スレッド数 → 2) 実行モード（parallel では inter-op スレッド数も）→ 3) グラフ最適化 → 4) メモリアリーナ。
+    各段階で最速の値を固定して次へ進む。返り値: {"options", "latency_ms", "input_shape", "baseline_ms"}。
+    """
+    cpu_count = cpu_count or os.cpu_count() or 1
+    shape = (batch_size, 1, int(input_hw[0]), int(input_hw[1]))
+    results = {}
+
+    def _try(options):
+        key = json.dumps(options, sort_keys=True)
+        if key not in results:
+            results[key] = benchmark_options(model_path, options, shape, iters)
+            log(f"  {results[key]:8.2f} ms  {key}")
+        return results[key]
+
+    baseline = _try(dict(DEFAULT_OPTIONS))
+    best = dict(DEFAULT_OPTIONS)
+    stages = [
+        [{"intra_op_num_threads": n} for n in _thread_candidates(cpu_count)],
+        [{"execution_mode": "sequential", "inter_op_num_threads": 0}]
+        + [{"execution_mode": "parallel", "inter_op_num_threads": n} for n in (1, 2) if n <= cpu_count],
+        [{"graph_optimization_level": level} for level in ("extended", "all")],
+        [{"enable_cpu_mem_arena": arena, "enable_mem_pattern": arena} for arena in (True, False)],
+    ]
+    for stage in stages:
+        best = min(({**best, **change} for change in stage), key=_try)
+    return {
+        "options": best,
+        "latency_ms": _try(best),
+        "baseline_ms": baseline,
+        "input_shape": list(shape),
+        "tuned_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
@@ -22,9 +22,11 @@ class AutoUI:
         sizeLayout = qt.QHBoxLayout()
         self.heightSpin = qt.QSpinBox()
         self.heightSpin.setRange(64, 2048)
+        self.heightSpin.setSingleStep(8)
         self.heightSpin.setValue(512)
         self.widthSpin = qt.QSpinBox()
         self.widthSpin.setRange(64, 2048)
+        self.widthSpin.setSingleStep(8)
         self.widthSpin.setValue(512)
         sizeLayout.addWidget(qt.QLabel("H:"))
         sizeLayout.addWidget(self.heightSpin)
@@ -32,9 +34,62 @@ class AutoUI:
         sizeLayout.addWidget(self.widthSpin)
         form.addRow("入力サイズ:", sizeLayout)
 
+        # テスト時拡張（TTA）: 全バリアントを1回のバッチ推論で流して平均する
+        self.ttaCombo = qt.QComboBox()
+        self.ttaCombo.addItem("なし", "none")
+        self.ttaCombo.addItem("原画像 + 左右反転", "flip")
+        self.ttaCombo.addItem("原画像 + 左右反転 + 拡大縮小(±10%)", "flip_scale")
+        self.ttaCombo.toolTip = "左右反転は反転拡張(--augment)で学習したモデル向けです。"
+        form.addRow("TTA:", self.ttaCombo)
+
         self.runButton = qt.QPushButton("推論してMarkupsに配置")
         form.addRow(self.runButton)
 
+        # ドラッグを終えた点のまわりだけを切り出して再推論し、その点だけを局所ピークへ吸着させる
+        self.refineCheckBox = qt.QCheckBox("ドラッグした点を局所推論で補正")
+        self.refineCheckBox.checked = False
+        self.refineCheckBox.toolTip = "点を動かすと周囲の小さな窓だけを推論し、その点だけを最も確からしい位置へ移動します（他の点は変わりません）。"
+        form.addRow(self.refineCheckBox)
+
+        # (D,H,W) の全フレームを1回のバッチ推論で処理し、フレームごとのMarkupsに配置する
+        self.allFramesCheckBox = qt.QCheckBox("全フレームを推論（前後屈シリーズ・マルチフレーム）")
+        self.allFramesCheckBox.checked = False
+        self.allFramesCheckBox.toolTip = "フレームごとに `<Volume名>_f<番号>_landmarks` を作成/更新し、角度を結果テーブルにまとめます。"
+        form.addRow(self.allFramesCheckBox)
+
+        batchLayout = qt.QHBoxLayout()
+        self.batchSizeSpin = qt.QSpinBox()
+        self.batchSizeSpin.setRange(1, 64)
+        self.batchSizeSpin.setValue(8)
+        self.batchSizeSpin.toolTip = "1回の推論でまとめて流す枚数。"
+        self.runAllButton = qt.QPushButton("シーン内の全Volumeを一括推論")
+        self.runAllButton.toolTip = "全スカラーVolumeを推論し、Volumeごとのmarkupsと角度一覧テーブルを作成/更新します。"
+        batchLayout.addWidget(qt.QLabel("バッチ:"))
+        batchLayout.addWidget(self.batchSizeSpin)
+        batchLayout.addWidget(self.runAllButton, 1)
+        form.addRow("一括処理:", batchLayout)
+
+        self.progressBar = qt.QProgressBar()
+        self.progressBar.setRange(0, 100)
+        self.progressBar.visible = False
+        form.addRow(self.progressBar)
+
+        # 能動学習ワークリスト（train/rank_uncertainty.py の出力）。不確実な順に並ぶ
+        self.worklistPathEdit = qt.QLineEdit()
+        self.worklistPathEdit.placeholderText = "worklist.json"
+        self.worklistBrowseButton = qt.QPushButton("参照...")
+        self.worklistLoadButton = qt.QPushButton("読み込み")
+        worklistLayout = qt.QHBoxLayout()
+        worklistLayout.addWidget(self.worklistPathEdit, 1)
+        worklistLayout.addWidget(self.worklistBrowseButton)
+        worklistLayout.addWidget(self.worklistLoadButton)
+        form.addRow("ワークリスト:", worklistLayout)
+
+        self.worklistView = qt.QListWidget()
+        self.worklistView.toolTip = "ダブルクリックで画像を読み込み、予測点をMarkupsに配置します（ケースIDも入力されます）。"
+        self.worklistView.visible = False
+        form.addRow(self.worklistView)
+
         self.statusLabel = qt.QLabel("")
         self.statusLabel.wordWrap = True
         form.addRow(self.statusLabel)
@@ -68,6 +68,11 @@ class MeasureUI:
         self.updateButton.enabled = True
         form.addRow(self.updateButton)
 
+        self.liveUpdateCheckBox = qt.QCheckBox("点の移動に合わせて計測を自動更新")
+        self.liveUpdateCheckBox.toolTip = "Markupsの点をドラッグすると、その点に関係する角度だけを即時に再計算します。"
+        self.liveUpdateCheckBox.checked = True
+        form.addRow("ライブ計測:", self.liveUpdateCheckBox)
+
         self.resultsTable = qt.QTableWidget()
         self.resultsTable.setRowCount(4)
         self.resultsTable.setColumnCount(2)
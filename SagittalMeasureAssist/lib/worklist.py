@@ -0,0 +1,50 @@
+"""
+能動学習用ワークリスト（未ラベル画像を不確実性の高い順に並べたJSON）の読み書き。
+train/rank_uncertainty.py が書き出し、Slicerモジュールが読み込んで上から順にアノテーションする。
+slicer非依存。
+"""
+
+import json
+import os
+from typing import Dict, List, Optional
+
+WORKLIST_VERSION = 1
+
+
+def rank_entries(entries: List[Dict]) -> List[Dict]:
+    """score（大きいほど不確実）の降順に並べ、1始まりの rank を振る。同点はケースID順。"""
+    ordered = sorted(entries, key=lambda e: (-e["score"], e["case_id"]))
+    for rank, entry in enumerate(ordered, start=1):
+        entry["rank"] = rank
+    return ordered
+
+
+def write_worklist(path: str, entries: List[Dict], model_path: Optional[str] = None, extra: Optional[Dict] = None) -> str:
+    """ランク付けしてJSONに書く。一時ファイル経由で置き換えるため、読み込み中のSlicerが壊れたファイルを見ない。"""
+    data = {
+        "version": WORKLIST_VERSION,
+        "model": model_path,
+        **(extra or {}),
+        "cases": rank_entries(list(entries)),
+    }
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as fp:
+        json.dump(data, fp, ensure_ascii=False, indent=2)
+    os.replace(tmp, path)
+    return path
+
+
+def load_worklist(path: str) -> Dict:
+    """ワークリストを読み、画像パスをワークリストのあるフォルダ基準の絶対パスにして返す。"""
+    with open(path, "r", encoding="utf-8") as fp:
+        data = json.load(fp)
+    if data.get("version") != WORKLIST_VERSION:
+        raise ValueError(f"未対応のワークリスト形式です (version={data.get('version')}): {path}")
+    base = os.path.dirname(os.path.abspath(path))
+    for entry in data["cases"]:
+        for key in ("image", "volume"):
+            if entry.get(key):
+                entry[key] = os.path.normpath(os.path.join(base, entry[key]))
+    data["cases"].sort(key=lambda e: e["rank"])
+    return data
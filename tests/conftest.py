@@ -0,0 +1,6 @@
+import os
+import sys
+
+# train/ scripts import their siblings by bare name (`from dataset import ...`); appended so
+# `train` still resolves to the package, not train/train.py
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "train"))
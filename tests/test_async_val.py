@@ -0,0 +1,48 @@
+import json
+
+import numpy as np
+import torch
+
+from train.async_val import AsyncValidator, snapshot_state
+from train.dataset import HeatmapDataset, LANDMARK_ORDER
+from train.engine import validate
+from train.loader_tune import make_loader
+from train.model import SmallUNet
+
+
+def _write_cases(d, n=3):
+    rng = np.random.default_rng(0)
+    for i in range(n):
+        np.save(d / f"case{i:03d}_image.npy", rng.integers(0, 1000, size=(40, 32)).astype(np.uint16))
+        lm = {name: {"i": float(rng.uniform(0, 31)), "j": float(rng.uniform(0, 39)), "k": 0.0} for name in LANDMARK_ORDER}
+        with open(d / f"case{i:03d}_landmarks.json", "w", encoding="utf-8") as fp:
+            json.dump({"landmarks_ijk": lm, "metadata": {"spacing": [0.5, 0.5, 1.0]}}, fp)
+
+
+def test_background_validation_matches_sync_and_releases_in_epoch_order(tmp_path):
+    _write_cases(tmp_path)
+    dataset = HeatmapDataset(str(tmp_path), resize=(32, 32), sigma=2.0)
+    loader = make_loader(dataset, 2, False, 0, "cpu")
+    kwargs = dict(num_landmarks=len(LANDMARK_ORDER), base_width=4)
+    snapshots, expected = [], []
+    for seed in range(3):
+        torch.manual_seed(seed)
+        model = SmallUNet(**kwargs)
+        snapshots.append(snapshot_state(model))
+        expected.append(validate(model, loader, "cpu", sigma=2.0, progress=False))
+
+    with AsyncValidator(dataset, kwargs, 2, 2.0, num_workers=2) as validator:
+        for epoch, state in enumerate(snapshots, start=1):
+            validator.submit(epoch, state)
+        results = validator.drain()
+        assert validator.in_flight == 0
+        assert [r["epoch"] for r in results] == [1, 2, 3]
+        np.testing.assert_allclose([r["val_loss"] for r in results], expected, rtol=1e-5)
+
+        # a later epoch finishing first is held back until the earlier one is in
+        validator._pending.extend([4, 5])
+        validator._results.put({"epoch": 5, "val_loss": 0.1, "val_metrics": None, "seconds": 0.0})
+        assert validator._receive(timeout=5.0)
+        assert validator.ready() == [] and validator.in_flight == 2
+        validator._results.put({"epoch": 4, "val_loss": 0.2, "val_metrics": None, "seconds": 0.0})
+        assert [r["epoch"] for r in validator.drain()] == [4, 5]
@@ -0,0 +1,35 @@
+import torch
+
+from train.augment import BatchAugment, render_heatmaps
+from train.dataset import _make_heatmaps
+
+
+def test_render_heatmaps_matches_dataset():
+    coords = [(10.0, 20.0), (30.5, 5.0)]
+    expected = _make_heatmaps(coords, (40, 48), sigma=2.0)
+    out = render_heatmaps(torch.tensor([coords]), (40, 48), sigma=2.0)
+    assert out.shape == (1, 2, 40, 48)
+    assert torch.allclose(out[0], expected, atol=1e-5)
+
+
+def test_flip_only_mirrors_coords():
+    aug = BatchAugment(rotate_deg=0, scale=0, translate=0, flip_prob=1.0, gamma=0, contrast=0, noise_std=0)
+    coords = torch.tensor([[[5.0, 7.0], [20.0, 3.0]]])
+    img = render_heatmaps(coords, (16, 32), sigma=1.5)[:, :1]
+    out_img, out_coords = aug(img, coords)
+    assert torch.allclose(out_coords[0, :, 0], 31.0 - coords[0, :, 0], atol=1e-4)
+    assert torch.allclose(out_coords[0, :, 1], coords[0, :, 1], atol=1e-4)
+    assert torch.allclose(out_img, img.flip(-1), atol=1e-4)
+
+
+def test_affine_keeps_image_and_coords_consistent():
+    aug = BatchAugment(rotate_deg=20, scale=0.2, translate=0.1, flip_prob=0.5, gamma=0, contrast=0, noise_std=0, seed=0)
+    h, w = 64, 48
+    coords = torch.tensor([[[20.0, 30.0]], [[30.0, 25.0]], [[24.0, 40.0]]])
+    img = render_heatmaps(coords, (h, w), sigma=3.0)
+    out_img, out_coords = aug(img, coords)
+    for b in range(coords.shape[0]):
+        idx = torch.argmax(out_img[b, 0])
+        y, x = divmod(idx.item(), w)
+        assert abs(x - out_coords[b, 0, 0].item()) <= 1.0
+        assert abs(y - out_coords[b, 0, 1].item()) <= 1.0
@@ -1,8 +1,12 @@
 import json
+import os
+
 import numpy as np
 import torch
 
-from train.dataset import HeatmapDataset, LANDMARK_ORDER
+from train.dataset import HeatmapDataset, LANDMARK_ORDER, PatchHeatmapDataset, _make_heatmaps, bucket_sampler_for
+from train.engine import resolution_schedule
+from train.loader_tune import make_loader
 
 
 def _write_sample(tmp_path):
@@ -50,3 +54,118 @@ def test_padding_preserves_aspect_and_coords(tmp_path):
     x0 = x0[0].item()
     assert abs(x0 - expected_first[0].item()) <= 1
     assert abs(y0 - expected_first[1].item()) <= 1
+
+
+def test_cache_roundtrip_matches_uncached(tmp_path):
+    _write_sample(tmp_path)
+    cache_dir = tmp_path / "cache"
+    plain = HeatmapDataset(data_dir=str(tmp_path), resize=(64, 64), sigma=2.0)[0]
+    cached_ds = HeatmapDataset(data_dir=str(tmp_path), resize=(64, 64), sigma=2.0, cache_dir=str(cache_dir))
+    first = cached_ds[0]  # populates the cache
+    assert (cache_dir / cached_ds.cache_key / "case001.npz").exists()
+    second = cached_ds[0]  # served from the cache
+    for sample in (first, second):
+        assert torch.allclose(sample["image"], plain["image"])
+        assert torch.allclose(sample["coords"], plain["coords"])
+        assert torch.allclose(sample["heatmap"], plain["heatmap"])
+    # a different resize uses a separate cache entry
+    assert HeatmapDataset(data_dir=str(tmp_path), resize=(32, 32), cache_dir=str(cache_dir)).cache_key != cached_ds.cache_key
+
+
+def test_cache_keeps_export_folders_with_the_same_case_ids_apart(tmp_path):
+    cache_dir = tmp_path / "cache"
+    first, second = tmp_path / "a", tmp_path / "b"
+    for d in (first, second):
+        d.mkdir()
+        _write_sample(d)
+    np.save(second / "case001_image.npy", np.random.default_rng(0).uniform(size=(100, 50)).astype(np.float32))
+    a = HeatmapDataset(str(first), resize=(64, 64), cache_dir=str(cache_dir))[0]
+    b = HeatmapDataset(str(second), resize=(64, 64), cache_dir=str(cache_dir))[0]
+    assert not torch.allclose(a["image"], b["image"])
+    assert torch.allclose(b["image"], HeatmapDataset(str(second), resize=(64, 64))[0]["image"])
+
+
+def test_aspect_buckets_group_batches(tmp_path):
+    _write_sample(tmp_path)  # 100x50 (tall)
+    img = np.zeros((50, 100), dtype=np.float32)  # wide
+    np.save(tmp_path / "case002_image.npy", img)
+    with open(tmp_path / "case001_landmarks.json", "r", encoding="utf-8") as fp:
+        meta = json.load(fp)
+    with open(tmp_path / "case002_landmarks.json", "w", encoding="utf-8") as fp:
+        json.dump(meta, fp)
+
+    ds = HeatmapDataset(data_dir=str(tmp_path), buckets=[(64, 32), (32, 64)], sigma=2.0)
+    assert ds.bucket_ids == [0, 1]
+    assert ds[0]["image"].shape == (1, 64, 32)
+    assert ds[1]["heatmap"].shape == (len(LANDMARK_ORDER), 32, 64)
+
+    sampler = bucket_sampler_for(ds, batch_size=4, shuffle=True)
+    batches = list(sampler)
+    assert sorted(batches) == [[0], [1]]
+
+
+def test_multi_frame_volume_uses_the_labelled_frame(tmp_path):
+    _write_sample(tmp_path)
+    frames = np.zeros((3, 100, 50), dtype=np.float32)
+    frames[2, 50:80, 20:40] = 1.0  # only the labelled frame has content
+    np.save(tmp_path / "case001_image.npy", frames)
+    with open(tmp_path / "case001_landmarks.json", "r", encoding="utf-8") as fp:
+        meta = json.load(fp)
+    for p in meta["landmarks_ijk"].values():
+        p["k"] = 2.0
+    with open(tmp_path / "case001_landmarks.json", "w", encoding="utf-8") as fp:
+        json.dump(meta, fp)
+
+    img = HeatmapDataset(data_dir=str(tmp_path), resize=(100, 50), sigma=2.0)[0]["image"]
+    assert img[0, 60, 30] > 0.5 and img[0, 10, 10] < 0.5
+
+
+def test_patch_dataset_crops_around_landmarks_with_visibility(tmp_path):
+    rng = np.random.default_rng(0)
+    np.save(tmp_path / "case001_image.npy", rng.random((600, 400)).astype(np.float32))
+    points = [(100, 100), (120, 110), (300, 500), (320, 520), (390, 590)]
+    lm = {name: {"i": float(x), "j": float(y), "k": 0.0} for name, (x, y) in zip(LANDMARK_ORDER, points)}
+    with open(tmp_path / "case001_landmarks.json", "w", encoding="utf-8") as fp:
+        json.dump({"landmarks_ijk": lm, "metadata": {"spacing": [0.2, 0.2]}}, fp)
+    base = HeatmapDataset(data_dir=str(tmp_path))
+
+    # deterministic (validation) crops: one per landmark, centred on it, at half resolution
+    ds = PatchHeatmapDataset(base, patch_size=(64, 64), scale=0.5, sigma=2.0, random_crops=False)
+    assert len(ds) == len(LANDMARK_ORDER)
+    sample = ds[0]
+    assert sample["image"].shape == (1, 64, 64)
+    assert sample["visible"].tolist() == [1.0, 1.0, 0.0, 0.0, 0.0]
+    assert torch.allclose(sample["coords"][0], torch.tensor([32.0, 32.0]))
+    # heatmaps only for the landmarks inside the crop
+    assert sample["heatmap"][2:].abs().max() == 0.0
+    assert sample["heatmap"][1].max() > 0.9
+    # scale/pad map crop pixels back to the original film like the full-image samples
+    back = (sample["coords"] - sample["pad"]) / sample["scale"]
+    assert torch.allclose(back, torch.tensor(points, dtype=torch.float32), atol=1e-3)
+
+    # the FH crop reaches past the film corner: the outside is zero padding
+    corner = ds[4]
+    assert corner["visible"][4] == 1.0
+    assert corner["image"][0, -1, -1] == 0.0
+
+    random_ds = PatchHeatmapDataset(base, patch_size=(64, 64), patches_per_case=8, background_prob=0.0, jitter=0.5)
+    torch.manual_seed(0)
+    assert len(random_ds) == 8
+    assert all(random_ds[i]["visible"].sum() >= 1 for i in range(len(random_ds)))
+
+
+def test_set_resolution_reaches_persistent_workers_and_caches_per_size(tmp_path):
+    _write_sample(tmp_path)
+    cache = tmp_path / "cache"
+    ds = HeatmapDataset(str(tmp_path), resize=(64, 64), sigma=2.0, cache_dir=str(cache))
+    loader = make_loader(ds, 1, False, 1, "cpu")
+    stages = resolution_schedule(["32:1", "48:1"], (64, 64), 2.0, epochs=3)
+    assert stages == [((32, 32), 1.0), ((48, 48), 1.5), ((64, 64), 2.0)]
+
+    for hw, sigma in stages:
+        ds.set_resolution(hw, sigma)
+        batch = next(iter(loader))  # same worker process every time (persistent_workers)
+        assert tuple(batch["image"].shape[-2:]) == hw
+        expected = _make_heatmaps(batch["coords"][0].tolist(), hw, sigma)
+        assert torch.allclose(batch["heatmap"][0], expected, atol=1e-6)
+    assert len(os.listdir(cache)) == 3
@@ -0,0 +1,60 @@
+import numpy as np
+import pytest
+import torch
+
+import SagittalMeasureAssist.lib.inference_core as core
+from train.export_onnx import export_model
+from train.model import SmallUNet
+
+
+def test_end_to_end_export_decodes_in_graph(tmp_path):
+    ort = pytest.importorskip("onnxruntime")
+    torch.manual_seed(0)
+    model = SmallUNet(num_landmarks=5, base_width=4).eval()
+    rng = np.random.default_rng(0)
+    images = [rng.integers(0, 4000, size=(90, 70)).astype(np.uint16), rng.integers(0, 4000, size=(60, 100)).astype(np.uint16)]
+
+    path = export_model(model, tmp_path / "e2e.onnx", 64, 48, end_to_end="argmax", debug_heatmaps=True)
+    sess = ort.InferenceSession(str(path), providers=["CPUExecutionProvider"])
+    assert core.is_end_to_end(sess)
+    assert sess.get_modelmeta().custom_metadata_map["decode"] == "argmax"
+
+    ctx = core.EndToEndContext(sess, "image")
+    coords, params = ctx.run(images, (64, 48))
+    assert coords.shape == (2, 5, 2)
+    for img, (scale, pad_x, pad_y), c in zip(images, params, coords):
+        raw, *expected_params = core.raw_pad_resize(img, (64, 48))
+        assert [scale, pad_x, pad_y] == expected_params
+        _, scores, heatmaps = sess.run(None, {"image": raw[None, None]})
+        # same peaks as decoding the (min/max scaled) heatmaps in Python
+        np.testing.assert_array_equal(c, core.decode_heatmaps(heatmaps)[0])
+        np.testing.assert_allclose(scores[0], heatmaps[0].reshape(5, -1).max(axis=1), rtol=1e-6)
+        with torch.no_grad():
+            scaled = (raw - raw.min()) / (raw.max() - raw.min() + 1e-6)
+            reference = model(torch.from_numpy(scaled[None, None])).numpy()
+        np.testing.assert_allclose(heatmaps, reference, atol=1e-4)
+
+    soft = export_model(model, tmp_path / "soft.onnx", 64, 48, dynamic_hw=True, end_to_end="soft", refine_radius=3)
+    sess = ort.InferenceSession(str(soft), providers=["CPUExecutionProvider"])
+    assert [o.name for o in sess.get_outputs()] == ["coords", "scores"]
+    raw = core.raw_pad_resize(images[0], (64, 48))[0][None, None]
+    refined = sess.run(["coords"], {"image": raw})[0]
+    assert np.all(np.abs(refined - coords[0]) <= 3.0)
+    with pytest.raises(ValueError):
+        core.heatmap_output_name(sess)
+
+
+def test_invert_tta_coords_roundtrip():
+    variants = core.TTA_PRESETS["flip_scale"]
+    h, w = 48, 40
+    point = np.array([12.0, 30.0], dtype=np.float32)
+    center = np.array([(w - 1) / 2.0, (h - 1) / 2.0], dtype=np.float32)
+    per_variant = []
+    for flip, scale in variants:
+        p = (point - center) * scale + center
+        if flip:
+            p = np.array([(w - 1) - p[0], p[1]], dtype=np.float32)
+        per_variant.append(np.repeat(p[None], 5, axis=0))
+    inverted = core.invert_tta_coords(np.stack(per_variant), variants, (h, w))
+    assert inverted.shape == (1, len(variants), 5, 2)
+    np.testing.assert_allclose(inverted, np.broadcast_to(point, inverted.shape), atol=1e-4)
@@ -0,0 +1,53 @@
+import json
+
+import numpy as np
+import pytest
+import torch
+
+from train.dataset import LANDMARK_ORDER
+from train.finetune_daemon import is_val_case, parse_args, run_round
+from train.model import SmallUNet
+
+
+def _write_case(d, case_id, rng):
+    np.save(d / f"{case_id}_image.npy", rng.integers(0, 1000, size=(1, 40, 32)).astype(np.uint16))
+    lm = {name: {"i": float(rng.uniform(0, 31)), "j": float(rng.uniform(0, 39)), "k": 0.0} for name in LANDMARK_ORDER}
+    with open(d / f"{case_id}_landmarks.json", "w", encoding="utf-8") as fp:
+        json.dump({"landmarks_ijk": lm, "metadata": {"spacing": [0.5, 0.5, 1.0]}}, fp)
+
+
+def test_val_split_is_stable_per_case():
+    ids = [f"case{i:04d}" for i in range(2000)]
+    split = [is_val_case(c, 0.1) for c in ids]
+    assert split == [is_val_case(c, 0.1) for c in ids]
+    assert 0.05 < sum(split) / len(ids) < 0.15
+
+
+def test_round_finetunes_new_cases_and_publishes_onnx(tmp_path):
+    pytest.importorskip("onnxscript")
+    ort = pytest.importorskip("onnxruntime")
+    data = tmp_path / "exported"
+    data.mkdir()
+    rng = np.random.default_rng(0)
+    for i in range(4):
+        _write_case(data, f"case{i:03d}", rng)
+    base = tmp_path / "base.pt"
+    model = SmallUNet(num_landmarks=5, base_width=4)
+    torch.save({"model_state": model.state_dict(), "config": {"resize": [32, 32], "sigma": 2.0, "base_width": 4}}, base)
+
+    out = tmp_path / "published" / "model.onnx"
+    args = parse_args([
+        "--data-dir", str(data), "--work-dir", str(tmp_path / "work"), "--base-checkpoint", str(base),
+        "--output-onnx", str(out), "--settle-seconds", "0", "--min-new-cases", "2", "--val-fraction", "0",
+        "--epochs", "1", "--device", "cpu",
+    ])
+    (tmp_path / "work").mkdir()
+    state = {"round": 0, "seen": ["case000", "case001"], "rejected": [], "history": []}
+    summary = run_round(args, state, log=lambda *_: None)
+
+    assert summary["published"] and summary["new_cases"] == 2 and summary["replay_cases"] == 2
+    assert state["seen"] == ["case000", "case001", "case002", "case003"]
+    sess = ort.InferenceSession(str(out), providers=["CPUExecutionProvider"])
+    assert sess.get_modelmeta().custom_metadata_map["model_version"] == summary["model_version"]
+    # nothing new: no second round
+    assert run_round(args, state, log=lambda *_: None) is None
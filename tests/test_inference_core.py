@@ -0,0 +1,169 @@
+import numpy as np
+import pytest
+
+import SagittalMeasureAssist.lib.inference_core as core
+
+
+def _gaussian(h, w, x, y, sigma=2.0):
+    yy, xx = np.mgrid[0:h, 0:w]
+    return np.exp(-((xx - x) ** 2 + (yy - y) ** 2) / (2 * sigma * sigma)).astype(np.float32)
+
+
+def test_decode_heatmaps_vectorized():
+    hm = np.stack([_gaussian(32, 40, 5, 7), _gaussian(32, 40, 30, 20)])[None]
+    coords = core.decode_heatmaps(hm)
+    assert coords.shape == (1, 2, 2)
+    assert coords[0].tolist() == [[5.0, 7.0], [30.0, 20.0]]
+
+
+def test_tta_batch_and_inverse_roundtrip():
+    variants = core.TTA_PRESETS["flip_scale"]
+    img = _gaussian(48, 40, 12, 30, sigma=3.0)[None, None]  # (1,1,H,W)
+    batch = core.build_tta_batch(img, variants)
+    assert batch.shape == (len(variants), 1, 48, 40)
+    # flipped variant mirrors x
+    assert np.allclose(batch[1, 0], img[0, 0, :, ::-1])
+
+    # Treat each augmented image as a perfect 5-channel heatmap prediction
+    heatmaps = np.repeat(batch, 5, axis=1)
+    fused = core.fuse_tta_heatmaps(heatmaps, variants)
+    assert fused.shape == (1, 5, 48, 40)
+    coords = core.decode_heatmaps(fused)[0]
+    assert np.allclose(coords, [[12.0, 30.0]] * 5, atol=1.0)
+
+
+def test_tta_batch_fills_with_per_image_value():
+    variants = [(False, 1.0), (False, 0.8)]
+    rng = np.random.default_rng(0)
+    # signed, unnormalised inputs (end-to-end models): zoomed-out borders must take each image's minimum
+    imgs = rng.uniform(-1000.0, 3000.0, size=(2, 1, 40, 32)).astype(np.float32)
+    imgs[1] += 500.0
+    mins = imgs.reshape(2, -1).min(axis=1)
+    batch = core.build_tta_batch(imgs, variants, fill=mins).reshape(2, 2, 1, 40, 32)
+    zoomed = batch[:, 1, 0]
+    np.testing.assert_allclose(zoomed[:, 0, 0], mins, rtol=1e-6)
+    assert np.all(zoomed.reshape(2, -1).min(axis=1) >= mins - 1e-3)
+    # interior pixels are unaffected by the fill value
+    plain = core.build_tta_batch(imgs, variants).reshape(2, 2, 1, 40, 32)[:, 1, 0]
+    np.testing.assert_allclose(zoomed[:, 10:30, 8:24], plain[:, 10:30, 8:24], rtol=1e-5)
+
+
+def test_to_original_coords_inverts_padding():
+    coords = np.array([[128.0, 0.0], [256.0, 512.0]])
+    out = core.to_original_coords(coords, scale=5.12, pad_x=128, pad_y=0)
+    assert np.allclose(out, [(0.0, 0.0), (25.0, 100.0)])
+
+
+def test_resize_bilinear_matches_separable_interp():
+    rng = np.random.default_rng(0)
+    img = rng.random((37, 23)).astype(np.float32)
+    out = core._resize_bilinear(img, 50, 11)
+    # reference: per-row then per-column np.interp
+    tmp = np.stack([np.interp(np.linspace(0, 22, 11), np.arange(23), r) for r in img])
+    ref = np.stack([np.interp(np.linspace(0, 36, 50), np.arange(37), c) for c in tmp.T], axis=1)
+    assert out.shape == (50, 11)
+    assert np.allclose(out, ref, atol=1e-5)
+
+
+def test_choose_input_shape():
+    # static model: always the configured size
+    assert core.choose_input_shape((3000, 2000), (512, 512)) == (512, 512)
+    # dynamic H/W: keep aspect inside the box, rounded up to a multiple of 8
+    assert core.choose_input_shape((3000, 2000), (512, 512), dynamic_hw=True) == (512, 344)
+    assert core.choose_input_shape((2000, 3000), (512, 512), dynamic_hw=True) == (344, 512)
+    # a target that is not a multiple of 8 (typed into the UI) is rounded down, never passed through
+    assert core.choose_input_shape((3000, 2000), (500, 500), dynamic_hw=True) == (496, 336)
+    # exported buckets win over the computed shape
+    buckets = [(512, 320), (512, 384), (512, 512)]
+    assert core.choose_input_shape((3000, 1900), (512, 512), buckets, dynamic_hw=True) == (512, 320)
+    assert core.choose_input_shape((3000, 2300), (512, 512), buckets, dynamic_hw=True) == (512, 384)
+
+
+def _concat_model(num_channels=5):
+    onnx = pytest.importorskip("onnx")
+    pytest.importorskip("onnxruntime")
+    from onnx import TensorProto, helper
+
+    node = helper.make_node("Concat", ["image"] * num_channels, ["heatmaps"], axis=1)
+    graph = helper.make_graph(
+        [node],
+        "concat",
+        [helper.make_tensor_value_info("image", TensorProto.FLOAT, ["N", 1, "H", "W"])],
+        [helper.make_tensor_value_info("heatmaps", TensorProto.FLOAT, ["N", num_channels, "H", "W"])],
+    )
+    model = helper.make_model(graph, opset_imports=[helper.make_opsetid("", 17)])
+    model.ir_version = 8
+    return model.SerializeToString()
+
+
+def test_inference_context_matches_plain_preprocess_and_reuses_buffers():
+    import onnxruntime as ort
+
+    sess = ort.InferenceSession(_concat_model(), providers=["CPUExecutionProvider"])
+    ctx = core.InferenceContext(sess, "image", "heatmaps")
+    rng = np.random.default_rng(0)
+    images = [rng.integers(0, 4000, size=(90, 70)).astype(np.uint16), rng.integers(0, 4000, size=(60, 100)).astype(np.uint16)]
+
+    heatmaps, params = ctx.run(images, (64, 48))
+    for img, hm, (scale, pad_x, pad_y) in zip(images, heatmaps, params):
+        expected, e_scale, e_pad_x, e_pad_y = core.preprocess_slice(img, (64, 48))
+        assert (scale, pad_x, pad_y) == (e_scale, e_pad_x, e_pad_y)
+        np.testing.assert_allclose(hm, np.repeat(expected[None], 5, axis=0), atol=1e-5)
+
+    again, _ = ctx.run(images, (64, 48))
+    assert again is heatmaps  # same bound output buffer on steady-state calls
+
+    # many distinct film sizes / input shapes keep only the most recent plans and buffers
+    for k in range(10):
+        ctx.run([rng.integers(0, 4000, size=(50 + k, 40)).astype(np.uint16)], (32, 32 + 8 * k))
+    assert len(ctx._plans) == ctx.MAX_RESIZE_PLANS
+    assert len(ctx._buffers) == ctx.MAX_BUFFER_SETS
+    ctx.clear()
+    assert not ctx._plans and not ctx._buffers
+
+
+def test_heatmap_uncertainty_orders_sharp_vs_ambiguous():
+    sharp = _gaussian(64, 64, 20, 30)
+    double = np.maximum(_gaussian(64, 64, 20, 30), 0.9 * _gaussian(64, 64, 50, 10))
+    flat = 0.2 * _gaussian(64, 64, 32, 32, sigma=12.0)
+    hm = np.stack([np.stack([sharp, double, flat])]).astype(np.float32)  # (1,3,H,W)
+
+    stats = core.heatmap_uncertainty(hm)
+    np.testing.assert_allclose(stats["peak"][0], [1.0, 1.0, 0.2], atol=1e-5)
+    assert stats["second_ratio"][0, 0] < 0.01 and stats["second_ratio"][0, 1] > 0.85
+    assert stats["spread"][0, 0] < stats["spread"][0, 2]
+    scores = core.uncertainty_scores(stats, (64, 64))[0]
+    assert scores[0] < scores[1] and scores[0] < scores[2]
+
+
+def test_preprocess_cache_is_lru_bounded_and_evicts_by_key():
+    entry = lambda: (np.zeros((16, 16), dtype=np.float32), 1.0, 0, 0)  # 1 KiB each
+    cache = core.PreprocessCache(max_bytes=3 * 1024)
+    for key in [("vol1", 1, 0), ("vol2", 1, 0), ("vol3", 1, 0)]:
+        cache.put(key, entry())
+    assert cache.get(("vol1", 1, 0)) is not None  # vol1 becomes most recent
+    cache.put(("vol4", 1, 0), entry())
+    assert cache.get(("vol2", 1, 0)) is None and len(cache) == 3 and cache.nbytes == 3 * 1024
+
+    assert cache.evict(lambda k: k[0] == "vol1") == 1
+    assert cache.get(("vol1", 1, 0)) is None and cache.nbytes == 2 * 1024
+    cache.put(("big", 1, 0), (np.zeros((64, 64), dtype=np.float32), 1.0, 0, 0))  # larger than the cap: not kept
+    assert cache.get(("big", 1, 0)) is None and len(cache) == 2
+
+
+def test_refine_crop_keeps_full_inference_scale_and_maps_back():
+    img = np.full((400, 300), 100.0, dtype=np.float32)
+    img += 1000.0 * _gaussian(400, 300, 210, 280, sigma=6.0)
+    scale = 0.25  # e.g. 1200 px film into a 300 px model input
+    crop, (x0, y0) = core.refine_crop(img, (190.0, 300.0), scale, (32, 32), window=(100.0, 1100.0))
+    assert crop.shape == (32, 32)
+    assert crop.min() >= 0.0 and crop.max() <= 1.0
+    v, u = np.unravel_index(np.argmax(crop), crop.shape)
+    assert abs(x0 + u / scale - 210) <= 1 / scale and abs(y0 + v / scale - 280) <= 1 / scale
+
+    # the window near the border reaches outside the image: padded like the zero padding of full inference
+    crop, (x0, y0) = core.refine_crop(img, (2.0, 2.0), scale, (16, 16), window=(100.0, 1100.0))
+    assert x0 < 0 and y0 < 0
+    assert crop[0, 0] == 0.0
+    raw, _ = core.refine_crop(img, (2.0, 2.0), scale, (16, 16), fill=-5.0)
+    assert raw[0, 0] == -5.0 and raw[-1, -1] == pytest.approx(100.0)
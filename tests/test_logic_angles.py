@@ -63,3 +63,23 @@ def test_compute_angles_from_points():
 def test_compute_angles_missing():
     with pytest.raises(ValueError):
         angles.compute_angles_from_points({"FH": (0, 0)})
+
+
+def test_compute_angle_matches_full_computation():
+    points = {
+        "FH": (0.3, 2.4),
+        "S1_ant": (0.0, 0.0),
+        "S1_post": (1.2, 0.7),
+        "L1_ant": (-0.4, -3.0),
+        "L1_post": (0.8, -3.1),
+    }
+    full = angles.compute_angles_from_points(points)
+    for name in angles.ANGLE_NAMES:
+        assert math.isclose(angles.compute_angle(name, points), full[name], abs_tol=1e-9)
+
+
+def test_angles_affected_by_landmark():
+    assert angles.angles_affected_by(["FH"]) == ["PI", "PT"]
+    assert angles.angles_affected_by(["L1_post"]) == ["LL"]
+    assert angles.angles_affected_by(["S1_ant"]) == ["PI", "PT", "SS", "LL"]
+    assert angles.angles_affected_by([]) == []
@@ -0,0 +1,58 @@
+import json
+
+import numpy as np
+
+from train.dataset import HeatmapDataset, LANDMARK_ORDER
+from train.manifest import build_manifest, read_npy_header
+
+
+def _write_case(d, case_id, shape, coords, **meta):
+    np.save(d / f"{case_id}_image.npy", np.zeros(shape, dtype=np.uint16))
+    lm = {name: {"i": float(x), "j": float(y), "k": 0.0} for name, (x, y) in zip(LANDMARK_ORDER, coords)}
+    with open(d / f"{case_id}_landmarks.json", "w", encoding="utf-8") as fp:
+        json.dump({"landmarks_ijk": lm, "image_shape": list(shape), "metadata": {"spacing": [0.5, 0.5, 1.0]}, **meta}, fp)
+
+
+def test_manifest_rejects_bad_cases_and_feeds_dataset(tmp_path):
+    good = [(10, 10), (30, 12), (12, 50), (32, 52), (20, 70)]
+    _write_case(tmp_path, "good", (1, 80, 40), good)
+    _write_case(tmp_path, "out_of_bounds", (1, 80, 40), good[:4] + [(45, 70)])
+    _write_case(tmp_path, "four_d", (1, 1, 80, 40), good)
+    _write_case(tmp_path, "bad_flip", (1, 80, 40), good, flip_x_axis="yes")
+    _write_case(tmp_path, "missing_lm", (1, 80, 40), good[:4])
+    np.save(tmp_path / "orphan_image.npy", np.zeros((8, 8), dtype=np.uint16))
+
+    assert read_npy_header(str(tmp_path / "four_d_image.npy"))[0] == (1, 1, 80, 40)
+    manifest = build_manifest(str(tmp_path), num_threads=4)
+    assert [c["case_id"] for c in manifest["cases"]] == ["good"]
+    assert manifest["cases"][0]["shape"] == [80, 40]
+    assert sorted(r["case_id"] for r in manifest["rejected"]) == ["bad_flip", "four_d", "missing_lm", "orphan", "out_of_bounds"]
+
+    path = tmp_path / "manifest.json"
+    path.write_text(json.dumps(manifest))
+    ds = HeatmapDataset(str(tmp_path), resize=(32, 32), manifest=str(path))
+    assert ds.case_ids() == ["good"]
+    assert ds[0]["image"].shape == (1, 32, 32)
+
+
+def test_manifest_detects_flip_flag_inconsistent_with_angles(tmp_path):
+    import SagittalMeasureAssist.lib.logic_angles as logic_angles
+
+    coords = [(10, 10), (30, 14), (12, 50), (32, 58), (20, 70)]
+    ijk_to_ras = [[-0.5, 0.0, 0.0], [0.0, -0.5, 0.0], [0.0, 0.0, 1.0]]
+    origin = [3.0, 4.0, 0.0]
+    # angles as ExportLogic computes them: RAS (x, y) with x flipped
+    ras = {n: (-(-0.5 * x + origin[0]), -0.5 * y + origin[1]) for n, (x, y) in zip(LANDMARK_ORDER, coords)}
+    angles = logic_angles.compute_angles_from_points(ras)
+    md = {"spacing": [0.5, 0.5, 1.0], "ijk_to_ras": ijk_to_ras, "origin_ras": origin}
+    _write_case(tmp_path, "consistent", (1, 80, 40), coords, flip_x_axis=True, angles_deg=angles)
+    _write_case(tmp_path, "flag_flipped", (1, 80, 40), coords, flip_x_axis=False, angles_deg=angles)
+    for case_id in ("consistent", "flag_flipped"):
+        path = tmp_path / f"{case_id}_landmarks.json"
+        meta = json.loads(path.read_text())
+        meta["metadata"] = md
+        path.write_text(json.dumps(meta))
+
+    manifest = build_manifest(str(tmp_path))
+    assert [c["case_id"] for c in manifest["cases"]] == ["consistent"]
+    assert [r["case_id"] for r in manifest["rejected"]] == ["flag_flipped"]
@@ -0,0 +1,59 @@
+import math
+
+import numpy as np
+import pytest
+import torch
+
+import SagittalMeasureAssist.lib.logic_angles as logic_angles
+from train.dataset import LANDMARK_ORDER
+from train.metrics import ANGLE_NAMES, MetricAccumulator, compute_angles, decode_heatmaps, format_summary
+
+
+def test_compute_angles_matches_logic_angles():
+    rng = np.random.default_rng(0)
+    coords = rng.uniform(0, 100, size=(20, len(LANDMARK_ORDER), 2))
+    out = compute_angles(torch.from_numpy(coords))
+    for n in range(coords.shape[0]):
+        expected = logic_angles.compute_angles_from_points(dict(zip(LANDMARK_ORDER, map(tuple, coords[n]))))
+        for i, name in enumerate(ANGLE_NAMES):
+            assert math.isclose(out[n, i].item(), expected[name], abs_tol=1e-6)
+
+
+def test_compute_angles_degenerate_is_nan():
+    coords = torch.zeros(1, len(LANDMARK_ORDER), 2)
+    assert torch.isnan(compute_angles(coords)).all()
+
+
+def test_accumulator_reports_mm_errors():
+    h, w = 32, 32
+    gt = torch.tensor([[[4.0, 4.0], [10.0, 4.0], [8.0, 20.0], [16.0, 22.0], [12.0, 28.0]]])
+    pred_px = gt.clone()
+    pred_px[0, 0] += torch.tensor([3.0, 4.0])  # 5 px off in model space
+    heatmaps = torch.zeros(1, len(LANDMARK_ORDER), h, w)
+    for l, (x, y) in enumerate(pred_px[0].long().tolist()):
+        heatmaps[0, l, y, x] = 1.0
+    assert torch.equal(decode_heatmaps(heatmaps), pred_px)
+
+    batch = {
+        "coords": gt,
+        "scale": torch.tensor([0.5]),  # model space = original * 0.5
+        "pad": torch.tensor([[0.0, 0.0]]),
+        "spacing": torch.tensor([[0.2, 0.2]]),
+        "case_id": ["case001"],
+    }
+    acc = MetricAccumulator()
+    acc.update(heatmaps, batch)
+    summary = acc.summary()
+    # 5 px in model space -> 10 px original -> 2 mm
+    assert summary["landmarks_mm"]["L1_ant"]["mean"] == pytest.approx(2.0)
+    assert summary["landmarks_mm"]["FH"]["mean"] == pytest.approx(0.0)
+    assert summary["angles_deg"]["LL"]["mean"] > 0
+    assert summary["angles_deg"]["PT"]["mean"] == pytest.approx(0.0)
+
+    # patch-mode validation: radial errors only, angles skipped
+    acc = MetricAccumulator(angles=False)
+    acc.update(heatmaps, batch)
+    summary = acc.summary()
+    assert "angles_deg" not in summary
+    assert summary["landmarks_mm"]["L1_ant"]["mean"] == pytest.approx(2.0)
+    assert "angle metrics skipped" in format_summary(summary)
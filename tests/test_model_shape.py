@@ -8,3 +8,43 @@ def test_small_unet_output_shape():
     x = torch.randn(2, 1, 128, 96)
     y = model(x)
     assert y.shape == (2, 5, 128, 96)
+
+
+def test_reduced_width_roundtrips_through_checkpoint():
+    student = SmallUNet(num_landmarks=5, base_width=8)
+    ckpt = {"model_state": student.state_dict(), "config": {"base_width": 8}}
+    restored = SmallUNet.from_checkpoint(ckpt)
+    assert restored.head.in_channels == 8
+    assert sum(p.numel() for p in restored.parameters()) < sum(p.numel() for p in SmallUNet(5).parameters()) / 10
+
+
+def test_activation_checkpointing_matches_gradients_and_bn_stats():
+    torch.manual_seed(0)
+    plain = SmallUNet(num_landmarks=5, base_width=4)
+    x = torch.randn(2, 1, 32, 32)
+    for level in (1, 2):
+        ckpt = SmallUNet(num_landmarks=5, base_width=4, checkpoint_level=level)
+        ckpt.load_state_dict(plain.state_dict())
+        ref = SmallUNet(num_landmarks=5, base_width=4)
+        ref.load_state_dict(plain.state_dict())
+        ref(x).square().mean().backward()
+        ckpt(x).square().mean().backward()
+        for p, q in zip(ref.parameters(), ckpt.parameters()):
+            assert torch.allclose(p.grad, q.grad, atol=1e-6)
+        # recomputation in backward must not update BatchNorm running stats twice
+        for a, b in zip(ref.buffers(), ckpt.buffers()):
+            assert torch.equal(a, b)
+
+
+def test_memory_plan_trades_checkpointing_and_micro_batches_for_budget():
+    from train.loader_tune import plan_memory
+
+    model = SmallUNet(num_landmarks=5, base_width=8)
+    sample = {"image": torch.zeros(1, 128, 128), "heatmap": torch.zeros(5, 128, 128)}
+    roomy = plan_memory(model, sample, batch_size=8, memory_budget_mb=4096)
+    assert roomy == {**roomy, "checkpoint_level": 0, "micro_batch": 8, "accum_steps": 1}
+    tight = plan_memory(model, sample, batch_size=8, memory_budget_mb=roomy["est_mem_mb"] / 3)
+    assert tight["checkpoint_level"] > 0 or tight["micro_batch"] < 8
+    assert tight["micro_batch"] * tight["accum_steps"] >= 8
+    assert tight["est_mem_mb"] <= roomy["est_mem_mb"] / 3
+    assert model.checkpoint_level == 0
@@ -0,0 +1,44 @@
+import json
+
+import pytest
+
+import SagittalMeasureAssist.lib.ort_profile as ort_profile
+
+
+def test_profile_roundtrip_per_model_and_default(tmp_path):
+    model_a = tmp_path / "a.onnx"
+    model_b = tmp_path / "b.onnx"
+    model_a.write_bytes(b"model-a")
+    model_b.write_bytes(b"model-b")
+    path = str(tmp_path / "profile.json")
+
+    ort_profile.save_profile({"options": {"intra_op_num_threads": 2}}, str(model_a), path)
+    ort_profile.save_profile({"options": {"intra_op_num_threads": 4}}, str(model_b), path)
+
+    assert ort_profile.load_profile(str(model_a), path)["options"]["intra_op_num_threads"] == 2
+    assert ort_profile.load_profile(str(model_b), path)["options"]["intra_op_num_threads"] == 4
+    # an untuned model gets no profile (ORT defaults), not another model's settings
+    other = tmp_path / "c.onnx"
+    other.write_bytes(b"model-c")
+    assert ort_profile.load_profile(str(other), path) is None
+    # replacing the file (new size/mtime) drops its old profile until it is tuned again
+    model_a.write_bytes(b"model-a, retrained")
+    assert ort_profile.load_profile(str(model_a), path) is None
+    assert ort_profile.load_profile(None, path)["options"]["intra_op_num_threads"] == 4
+
+
+def test_profile_from_another_host_is_ignored(tmp_path):
+    path = tmp_path / "profile.json"
+    path.write_text(json.dumps({"host": "elsewhere", "default": {"options": {}}}))
+    assert ort_profile.load_profile(None, str(path)) is None
+
+
+def test_make_session_options_applies_profile():
+    ort = pytest.importorskip("onnxruntime")
+    so = ort_profile.make_session_options(
+        {"intra_op_num_threads": 3, "execution_mode": "parallel", "graph_optimization_level": "basic", "enable_cpu_mem_arena": False}
+    )
+    assert so.intra_op_num_threads == 3
+    assert so.execution_mode == ort.ExecutionMode.ORT_PARALLEL
+    assert so.graph_optimization_level == ort.GraphOptimizationLevel.ORT_ENABLE_BASIC
+    assert not so.enable_cpu_mem_arena
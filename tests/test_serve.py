@@ -0,0 +1,85 @@
+import asyncio
+import gzip
+import io
+import json
+import threading
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+
+from train.serve import InferenceService, read_nrrd
+
+
+def _concat_session(num_channels=5):
+    ort = pytest.importorskip("onnxruntime")
+    from onnx import TensorProto, helper
+
+    node = helper.make_node("Concat", ["image"] * num_channels, ["heatmaps"], axis=1)
+    graph = helper.make_graph(
+        [node],
+        "concat",
+        [helper.make_tensor_value_info("image", TensorProto.FLOAT, ["N", 1, "H", "W"])],
+        [helper.make_tensor_value_info("heatmaps", TensorProto.FLOAT, ["N", num_channels, "H", "W"])],
+    )
+    model = helper.make_model(graph, opset_imports=[helper.make_opsetid("", 17)])
+    model.ir_version = 8
+    return ort.InferenceSession(model.SerializeToString(), providers=["CPUExecutionProvider"])
+
+
+def _image(x, y):
+    # bright 10x10 block: after percentile clipping its top-left pixel is the first maximum
+    img = np.zeros((1, 64, 48), dtype=np.uint16)
+    img[0, y : y + 10, x : x + 10] = 1000
+    return img
+
+
+def _nrrd(img):
+    header = (
+        "NRRD0004\ntype: unsigned short\ndimension: 3\nspace: left-posterior-superior\n"
+        f"sizes: {img.shape[2]} {img.shape[1]} {img.shape[0]}\n"
+        "space directions: (0.5,0,0) (0,0.5,0) (0,0,1)\nendian: little\nencoding: gzip\n"
+        "space origin: (10,20,0)\n\n"
+    )
+    return header.encode() + gzip.compress(img.astype("<u2").tobytes())
+
+
+def _post(port, body, query=""):
+    req = urllib.request.Request(f"http://127.0.0.1:{port}/predict{query}", data=body, headers={"Content-Type": "application/octet-stream"})
+    with urllib.request.urlopen(req, timeout=10) as resp:
+        return json.loads(resp.read())
+
+
+def test_service_batches_concurrent_requests_and_reports_metrics():
+    service = InferenceService(_concat_session(), target_hw=(64, 48), max_batch_size=4, max_wait_ms=300)
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    try:
+        port = asyncio.run_coroutine_threadsafe(service.start("127.0.0.1", 0), loop).result(10)
+
+        positions = [(3, 5), (20, 30), (30, 50), (8, 40)]
+        bodies = []
+        for x, y in positions:
+            buf = io.BytesIO()
+            np.save(buf, _image(x, y))
+            bodies.append(buf.getvalue())
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            results = list(pool.map(lambda b: _post(port, b, "?spacing=0.2,0.2"), bodies))
+        for (x, y), result in zip(positions, results):
+            assert result["landmarks_ij"]["FH"] == [x, y]
+
+        arr, geometry = read_nrrd(_nrrd(_image(12, 7)))
+        assert arr.shape == (1, 64, 48) and geometry["ijk_to_ras"][0][0] == -0.5 and geometry["origin_ras"] == [-10.0, -20.0, 0.0]
+        assert _post(port, _nrrd(_image(12, 7)))["landmarks_ij"]["L1_ant"] == [12, 7]
+
+        with urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics", timeout=10) as resp:
+            metrics = json.loads(resp.read())
+        assert metrics["requests_total"] == 5 and metrics["errors_total"] == 0
+        assert metrics["batches_total"] < 5 and metrics["mean_batch_size"] > 1
+        assert metrics["latency_ms"]["p50"] is not None
+    finally:
+        asyncio.run_coroutine_threadsafe(service.stop(), loop).result(10)
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join(10)
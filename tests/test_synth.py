@@ -0,0 +1,16 @@
+import numpy as np
+
+from train.manifest import build_manifest
+from train.synth import main, render_case
+
+
+def test_synthetic_cases_are_deterministic_and_pass_the_manifest_checks(tmp_path):
+    main(["--output-dir", str(tmp_path), "--num-cases", "6", "--max-side", "256", "--workers", "2", "--seed", "3"])
+
+    manifest = build_manifest(str(tmp_path))
+    assert len(manifest["cases"]) == 6 and not manifest["rejected"]
+    assert len({tuple(c["shape"]) for c in manifest["cases"]}) > 1
+
+    image, _ = render_case(4, 3, max_side=256)
+    np.testing.assert_array_equal(np.load(tmp_path / "synth000004_image.npy"), image)
+    assert not np.array_equal(render_case(4, 4, max_side=256)[0], image)
@@ -0,0 +1,15 @@
+from SagittalMeasureAssist.lib.worklist import load_worklist, write_worklist
+
+
+def test_worklist_ranks_by_score_and_resolves_paths(tmp_path):
+    entries = [
+        {"case_id": "b", "image": "imgs/b.npy", "score": 0.4},
+        {"case_id": "a", "image": "imgs/a.npy", "score": 1.2, "volume": "imgs/a_volume.nrrd"},
+        {"case_id": "c", "image": "imgs/c.npy", "score": 0.4},
+    ]
+    path = write_worklist(str(tmp_path / "out" / "worklist.json"), entries, model_path="m.onnx")
+
+    data = load_worklist(path)
+    assert [e["case_id"] for e in data["cases"]] == ["a", "b", "c"]
+    assert [e["rank"] for e in data["cases"]] == [1, 2, 3]
+    assert data["cases"][0]["volume"] == str(tmp_path / "out" / "imgs" / "a_volume.nrrd")
@@ -0,0 +1,147 @@
+"""
+Background validation for train.py --async-val: after each epoch the weights are snapshotted to
+CPU and handed to separate worker processes that run the validation pass, so the training loop
+goes straight on to the next epoch. Results come back in whatever order the workers finish and
+are released strictly in epoch order, so best.pt selection sees the same sequence as the
+synchronous loop.
+"""
+
+import queue
+import time
+import traceback
+from typing import Dict, List, Optional
+
+import torch
+import torch.multiprocessing as mp
+
+from dataset import bucket_sampler_for
+from engine import validate
+from loader_tune import make_loader
+from metrics import MetricAccumulator
+from model import SmallUNet
+
+
+def snapshot_state(model) -> Dict[str, torch.Tensor]:
+    """CPU copy of the weights, detached from the model that keeps training."""
+    return {k: v.detach().to("cpu", copy=True) for k, v in model.state_dict().items()}
+
+
+def _worker(jobs, results, val_set, model_kwargs, batch_size, sigma, eval_metrics, angle_metrics, device, threads):
+    torch.set_num_threads(threads)
+    device = torch.device(device)
+    model = SmallUNet(**model_kwargs).to(device)
+    # in-process loading: the worker is daemonic, and validation is small next to training
+    loader = make_loader(val_set, batch_size, False, 0, device, batch_sampler=bucket_sampler_for(val_set, batch_size, False))
+    while True:
+        job = jobs.get()
+        if job is None:
+            return
+        epoch, state = job
+        try:
+            start = time.perf_counter()
+            model.load_state_dict(state)
+            metrics = MetricAccumulator(angles=angle_metrics) if eval_metrics else None
+            val_loss = validate(model, loader, device, sigma=sigma, metrics=metrics, progress=False)
+            results.put({
+                "epoch": epoch,
+                "val_loss": val_loss,
+                "val_metrics": metrics.summary() if metrics is not None else None,
+                "seconds": time.perf_counter() - start,
+            })
+        except Exception:
+            results.put({"epoch": epoch, "error": traceback.format_exc()})
+
+
+class AsyncValidator:
+    """
+    Worker pool for epoch validation. submit() queues a weight snapshot and returns at once;
+    ready() hands back finished results in submission order, holding a later epoch that finished
+    first until every earlier one is in. Use as a context manager so the workers are stopped
+    even if training fails.
+    """
+
+    def __init__(
+        self,
+        val_set,
+        model_kwargs: Dict,
+        batch_size: int,
+        sigma: float,
+        eval_metrics: bool = False,
+        angle_metrics: bool = True,
+        device: str = "cpu",
+        num_workers: int = 1,
+        threads: int = 1,
+    ):
+        ctx = mp.get_context("spawn")
+        self._jobs = ctx.Queue()
+        self._results = ctx.Queue()
+        self._pending: List[int] = []
+        self._done: Dict[int, Dict] = {}
+        self._procs = [
+            ctx.Process(
+                target=_worker,
+                args=(self._jobs, self._results, val_set, model_kwargs, batch_size, sigma, eval_metrics, angle_metrics, str(device), threads),
+                daemon=True,
+            )
+            for _ in range(max(1, num_workers))
+        ]
+        for proc in self._procs:
+            proc.start()
+
+    @property
+    def in_flight(self) -> int:
+        """Submitted epochs whose results have not been released by ready() yet."""
+        return len(self._pending)
+
+    def submit(self, epoch: int, state: Dict[str, torch.Tensor]):
+        """Queue a snapshot (see snapshot_state) for validation."""
+        self._pending.append(epoch)
+        self._jobs.put((epoch, state))
+
+    def _receive(self, timeout: Optional[float]) -> bool:
+        try:
+            result = self._results.get(timeout=timeout) if timeout else self._results.get_nowait()
+        except queue.Empty:
+            dead = [p for p in self._procs if not p.is_alive()]
+            if dead:
+                raise RuntimeError(f"validation worker exited unexpectedly (exit code {dead[0].exitcode})")
+            return False
+        if "error" in result:
+            raise RuntimeError(f"validation of epoch {result['epoch']} failed:\n{result['error']}")
+        self._done[result["epoch"]] = result
+        return True
+
+    def ready(self, wait: bool = False) -> List[Dict]:
+        """
+        Results that can be released now, in epoch order. With wait=True blocks until at least
+        one is available (if anything is in flight).
+        """
+        while self._receive(None):
+            pass
+        while wait and self._pending and self._pending[0] not in self._done:
+            self._receive(timeout=1.0)
+        released = []
+        while self._pending and self._pending[0] in self._done:
+            released.append(self._done.pop(self._pending.pop(0)))
+        return released
+
+    def drain(self) -> List[Dict]:
+        """Wait for everything in flight; returns the remaining results in epoch order."""
+        released = []
+        while self._pending:
+            released.extend(self.ready(wait=True))
+        return released
+
+    def close(self):
+        for _ in self._procs:
+            self._jobs.put(None)
+        for proc in self._procs:
+            proc.join(timeout=10)
+            if proc.is_alive():
+                proc.terminate()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
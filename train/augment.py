@@ -0,0 +1,153 @@
+"""
+Batched on-device augmentation for heatmap training.
+Runs after collation on the training device so the DataLoader stays cheap:
+random affine (rotation/scale/translation/flip) via affine_grid/grid_sample,
+gamma/contrast/noise, and the same transform applied to the landmark coords
+before heatmaps are rendered.
+"""
+
+import math
+import time
+from typing import Optional, Tuple
+
+import torch
+import torch.nn.functional as F
+
+
+def render_heatmaps(coords: torch.Tensor, size: Tuple[int, int], sigma: float) -> torch.Tensor:
+    """
+    Batched Gaussian heatmaps on coords.device.
+    coords: (B, L, 2) pixel (x, y) in the target image; returns (B, L, H, W).
+    """
+    h, w = size
+    ys = torch.arange(h, device=coords.device, dtype=coords.dtype).view(1, 1, h, 1)
+    xs = torch.arange(w, device=coords.device, dtype=coords.dtype).view(1, 1, 1, w)
+    x = coords[..., 0].unsqueeze(-1).unsqueeze(-1)
+    y = coords[..., 1].unsqueeze(-1).unsqueeze(-1)
+    sigma2 = 2 * sigma * sigma
+    # exp(-(dx^2+dy^2)/s) = exp(-dx^2/s) * exp(-dy^2/s): keeps the intermediates at (B,L,1,W)+(B,L,H,1)
+    return torch.exp(-((xs - x) ** 2) / sigma2) * torch.exp(-((ys - y) ** 2) / sigma2)
+
+
+def _pixel_to_norm(h: int, w: int, device, dtype) -> torch.Tensor:
+    """3x3 matrix mapping pixel-centre coords to grid_sample coords (align_corners=False)."""
+    return torch.tensor(
+        [[2.0 / w, 0.0, 1.0 / w - 1.0], [0.0, 2.0 / h, 1.0 / h - 1.0], [0.0, 0.0, 1.0]],
+        device=device,
+        dtype=dtype,
+    )
+
+
+class BatchAugment:
+    """
+    Random landmark-consistent augmentation for a collated batch.
+    image: (B, 1, H, W) normalized to [0, 1]; coords: (B, L, 2) pixel (x, y) in the same frame.
+    Set a range to 0 (or flip_prob to 0) to disable that component.
+    """
+
+    def __init__(
+        self,
+        rotate_deg: float = 10.0,
+        scale: float = 0.1,
+        translate: float = 0.05,
+        flip_prob: float = 0.5,
+        gamma: float = 0.3,
+        contrast: float = 0.2,
+        noise_std: float = 0.02,
+        seed: Optional[int] = None,
+    ):
+        self.rotate_deg = rotate_deg
+        self.scale = scale
+        self.translate = translate
+        self.flip_prob = flip_prob
+        self.gamma = gamma
+        self.contrast = contrast
+        self.noise_std = noise_std
+        self.seed = seed
+        self._generators = {}
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.total_time = 0.0
+        self.num_batches = 0
+
+    @property
+    def ms_per_batch(self) -> float:
+        return 1000.0 * self.total_time / max(1, self.num_batches)
+
+    def _generator(self, device) -> Optional[torch.Generator]:
+        if self.seed is None:
+            return None
+        key = str(device)
+        if key not in self._generators:
+            self._generators[key] = torch.Generator(device=device).manual_seed(self.seed)
+        return self._generators[key]
+
+    def _uniform(self, n, low, high, device, gen):
+        return torch.rand(n, device=device, generator=gen) * (high - low) + low
+
+    def sample_matrices(self, b: int, h: int, w: int, device, dtype=torch.float32) -> torch.Tensor:
+        """Forward pixel-space affine (B, 3, 3): input pixel -> output pixel, about the image centre."""
+        gen = self._generator(device)
+        angle = self._uniform(b, -self.rotate_deg, self.rotate_deg, device, gen) * (math.pi / 180.0)
+        scale = self._uniform(b, 1.0 - self.scale, 1.0 + self.scale, device, gen)
+        tx = self._uniform(b, -self.translate, self.translate, device, gen) * w
+        ty = self._uniform(b, -self.translate, self.translate, device, gen) * h
+        flip = torch.rand(b, device=device, generator=gen) < self.flip_prob
+        sx = torch.where(flip, -scale, scale)
+
+        cx = (w - 1) / 2.0
+        cy = (h - 1) / 2.0
+        cos = torch.cos(angle)
+        sin = torch.sin(angle)
+        mat = torch.zeros(b, 3, 3, device=device, dtype=dtype)
+        # R(angle) @ diag(sx, scale): flip is a mirror of x before rotation
+        mat[:, 0, 0] = cos * sx
+        mat[:, 0, 1] = -sin * scale
+        mat[:, 1, 0] = sin * sx
+        mat[:, 1, 1] = cos * scale
+        mat[:, 0, 2] = cx + tx - (mat[:, 0, 0] * cx + mat[:, 0, 1] * cy)
+        mat[:, 1, 2] = cy + ty - (mat[:, 1, 0] * cx + mat[:, 1, 1] * cy)
+        mat[:, 2, 2] = 1.0
+        return mat
+
+    def apply_affine(self, image: torch.Tensor, coords: torch.Tensor, mat: torch.Tensor):
+        """Warp image with the forward pixel matrix `mat` and map coords the same way."""
+        b, _, h, w = image.shape
+        norm = _pixel_to_norm(h, w, image.device, mat.dtype)
+        # grid_sample needs output->input in normalized coords: N @ M^-1 @ N^-1
+        theta = norm @ torch.linalg.inv(mat) @ torch.linalg.inv(norm)
+        grid = F.affine_grid(theta[:, :2, :].to(image.dtype), list(image.shape), align_corners=False)
+        image = F.grid_sample(image, grid, mode="bilinear", padding_mode="zeros", align_corners=False)
+
+        ones = torch.ones_like(coords[..., :1])
+        coords_h = torch.cat([coords, ones], dim=-1)  # (B,L,3)
+        coords = (coords_h @ mat.transpose(1, 2).to(coords.dtype))[..., :2]
+        return image, coords
+
+    def apply_intensity(self, image: torch.Tensor) -> torch.Tensor:
+        b = image.shape[0]
+        gen = self._generator(image.device)
+        shape = (b, 1, 1, 1)
+        if self.gamma > 0:
+            log_g = self._uniform(b, -self.gamma, self.gamma, image.device, gen).view(shape)
+            image = image.clamp(min=0.0) ** torch.exp(log_g)
+        if self.contrast > 0:
+            c = self._uniform(b, 1.0 - self.contrast, 1.0 + self.contrast, image.device, gen).view(shape)
+            mean = image.mean(dim=(1, 2, 3), keepdim=True)
+            image = (image - mean) * c + mean
+        if self.noise_std > 0:
+            image = image + torch.randn(image.shape, device=image.device, generator=gen) * self.noise_std
+        return image.clamp(0.0, 1.0)
+
+    def __call__(self, image: torch.Tensor, coords: torch.Tensor):
+        start = time.perf_counter()
+        b, _, h, w = image.shape
+        mat = self.sample_matrices(b, h, w, image.device)
+        image, coords = self.apply_affine(image, coords, mat)
+        image = self.apply_intensity(image)
+        if image.is_cuda:
+            torch.cuda.synchronize(image.device)
+        self.total_time += time.perf_counter() - start
+        self.num_batches += 1
+        return image, coords
@@ -0,0 +1,41 @@
+"""
+Benchmark ONNX Runtime SessionOptions (threads, execution mode, graph optimization, memory arena)
+for one model and input size on this machine and save the fastest as the ORT profile.
+The Slicer module, infer_onnx.py, evaluate.py and the other ONNX runners load it automatically.
+
+Usage:
+  uv run python train/autotune_ort.py --model runs/best.onnx --height 512 --width 512
+"""
+
+import argparse
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "SagittalMeasureAssist" / "lib"))
+from ort_profile import autotune, profile_path, save_profile  # noqa: E402
+
+
+def parse_args():
+    p = argparse.ArgumentParser()
+    p.add_argument("--model", required=True, help="ONNX model path")
+    p.add_argument("--height", type=int, default=512)
+    p.add_argument("--width", type=int, default=512)
+    p.add_argument("--batch-size", type=int, default=1, help="Batch size to tune for (1 = interactive Slicer use)")
+    p.add_argument("--iters", type=int, default=10, help="Timed runs per candidate")
+    p.add_argument("--profile", help=f"Profile file (default: $SAGITTAL_ORT_PROFILE or {profile_path()})")
+    p.add_argument("--dry-run", action="store_true", help="Only print the result, don't save it")
+    return p.parse_args()
+
+
+def main():
+    args = parse_args()
+    print(f"Tuning {args.model} for input {args.batch_size}x1x{args.height}x{args.width}...")
+    result = autotune(args.model, (args.height, args.width), args.batch_size, args.iters)
+    print(f"Best: {result['latency_ms']:.2f} ms (ORT defaults {result['baseline_ms']:.2f} ms)")
+    print(f"  {result['options']}")
+    if not args.dry_run:
+        print(f"Saved profile to {save_profile(result, args.model, args.profile)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""
+Allocation / latency benchmark for repeated single-image ONNX inference, comparing the
+plain path (percentile norm -> pad-resize -> session.run) with the IOBinding
+InferenceContext used by the Slicer module.
+
+Usage:
+  uv run python train/bench_inference.py --onnx runs/landmarks.onnx --image-size 3000 2500 --iters 50
+"""
+
+import argparse
+import statistics
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "SagittalMeasureAssist" / "lib"))
+from inference_core import InferenceContext, decode_heatmaps, heatmap_output_name, preprocess_slice  # noqa: E402
+from ort_profile import create_session  # noqa: E402
+
+
+def parse_args():
+    p = argparse.ArgumentParser()
+    p.add_argument("--onnx", required=True, help="Path to onnx model")
+    p.add_argument("--image-size", type=int, nargs=2, default=(3000, 2500), metavar=("H", "W"), help="Synthetic film size")
+    p.add_argument("--input-size", type=int, nargs=2, default=(512, 512), metavar=("H", "W"), help="Model input size")
+    p.add_argument("--iters", type=int, default=30)
+    p.add_argument("--seed", type=int, default=0)
+    return p.parse_args()
+
+
+def _bench(fn, iters: int):
+    """Warm up once, then return (latencies in ms, peak traced bytes of one steady-state call)."""
+    fn()
+    latencies = []
+    for _ in range(iters):
+        start = time.perf_counter()
+        fn()
+        latencies.append((time.perf_counter() - start) * 1000.0)
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return latencies, peak
+
+
+def main():
+    args = parse_args()
+    sess, _ = create_session(args.onnx)
+    input_name = sess.get_inputs()[0].name
+    output_name = heatmap_output_name(sess)
+    target_hw = tuple(args.input_size)
+    img = np.random.default_rng(args.seed).integers(0, 4096, size=tuple(args.image_size)).astype(np.uint16)
+
+    def plain():
+        padded, _, _, _ = preprocess_slice(img, target_hw)
+        heatmaps = sess.run([output_name], {input_name: padded[np.newaxis, np.newaxis]})[0]
+        return decode_heatmaps(heatmaps)
+
+    ctx = InferenceContext(sess, input_name, output_name)
+
+    def bound():
+        heatmaps, _ = ctx.run([img], target_hw)
+        return decode_heatmaps(heatmaps)
+
+    np.testing.assert_allclose(plain(), bound(), atol=1.0)
+    print(f"image {img.shape[0]}x{img.shape[1]} -> input {target_hw[0]}x{target_hw[1]}, {args.iters} iters")
+    print(f"{'path':<12} {'mean ms':>9} {'p50 ms':>9} {'min ms':>9} {'peak alloc MB':>14}")
+    for name, fn in (("session.run", plain), ("iobinding", bound)):
+        lat, peak = _bench(fn, args.iters)
+        print(f"{name:<12} {statistics.mean(lat):>9.2f} {statistics.median(lat):>9.2f} {min(lat):>9.2f} {peak / 2**20:>14.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""
+Latency vs accuracy comparison of models on the same data, e.g. a distilled student against its
+teacher. Each model (.pt or .onnx) is timed on single-image CPU inference (the Slicer use case)
+and evaluated with evaluate.py's metrics.
+
+Usage:
+  uv run python train/compare_models.py --models runs/teacher/best.pt runs/student/best.pt \\
+      --data-dir /path/to/exported --split-manifest runs/cv/folds/fold_0.json --device cpu
+"""
+
+import argparse
+import json
+import statistics
+import time
+
+import torch
+from torch.utils.data import Subset
+
+from dataset import HeatmapDataset, bucket_sampler_for
+from engine import parse_buckets
+from evaluate import evaluate, load_predictor
+from loader_tune import make_loader
+from model import SmallUNet
+
+
+def parse_args():
+    p = argparse.ArgumentParser()
+    p.add_argument("--models", nargs="+", required=True, help="Checkpoints (.pt) and/or ONNX models to compare")
+    p.add_argument("--data-dir", required=True, help="Folder with *_image.npy and *_landmarks.json")
+    p.add_argument("--split-manifest", help="Evaluate only the 'val' cases of this manifest (default: every case)")
+    p.add_argument("--resize", type=int, nargs=2, default=None, metavar=("H", "W"), help="Model input size (default: from the first checkpoint config, else 512 512)")
+    p.add_argument("--buckets", nargs="+", default=None, help="Aspect buckets as HxW (default: from the first checkpoint config)")
+    p.add_argument("--batch-size", type=int, default=8)
+    p.add_argument("--num-workers", type=int, default=0)
+    p.add_argument("--cache-dir", help="Preprocessed cache shared with train.py")
+    p.add_argument("--latency-iters", type=int, default=20, help="Timed single-image runs per model")
+    p.add_argument("--device", default="cpu")
+    p.add_argument("--output", help="Write the comparison JSON here")
+    return p.parse_args()
+
+
+def _num_params(model_path: str):
+    if model_path.endswith(".onnx"):
+        return None
+    model = SmallUNet.from_checkpoint(torch.load(model_path, map_location="cpu"))
+    return sum(p.numel() for p in model.parameters())
+
+
+def measure_latency(predict, image: torch.Tensor, iters: int) -> float:
+    """Median ms of predict(image) for a (1,1,H,W) batch, after one warm-up call."""
+    predict(image)
+    times = []
+    for _ in range(iters):
+        start = time.perf_counter()
+        predict(image)
+        times.append((time.perf_counter() - start) * 1000.0)
+    return statistics.median(times)
+
+
+def main():
+    args = parse_args()
+    device = torch.device(args.device)
+    predictors = [(path, *load_predictor(path, device)) for path in args.models]
+    config = next((cfg for _, _, cfg in predictors if cfg), {})
+    resize = tuple(args.resize or config.get("resize") or (512, 512))
+
+    # bucket-trained models are compared on the aspect-bucket inputs they were trained on, as in evaluate.py
+    buckets = parse_buckets(args.buckets or config.get("buckets"))
+    dataset = HeatmapDataset(args.data_dir, resize=resize, return_heatmap=False, cache_dir=args.cache_dir, buckets=buckets)
+    if args.split_manifest:
+        with open(args.split_manifest, "r", encoding="utf-8") as fp:
+            val_ids = set(json.load(fp)["val"])
+        dataset = Subset(dataset, [i for i, c in enumerate(dataset.case_ids()) if c in val_ids])
+    loader = make_loader(
+        dataset, args.batch_size, False, args.num_workers, device,
+        batch_sampler=bucket_sampler_for(dataset, args.batch_size, False),
+    )
+    image = dataset[0]["image"].unsqueeze(0)
+
+    rows = []
+    for path, predict, _ in predictors:
+        summary = evaluate(predict, loader).summary()
+        rows.append({
+            "model": path,
+            "params": _num_params(path),
+            "latency_ms": measure_latency(predict, image, args.latency_iters),
+            "mre_mm": summary["mre_mm"],
+            "angles_mae_deg": {k: v["mean"] for k, v in summary["angles_deg"].items()},
+        })
+
+    print(f"{'model':<40} {'params':>10} {'ms/img':>8} {'MRE mm':>8}  angle MAE (deg)")
+    for row in rows:
+        params = f"{row['params']:,}" if row["params"] is not None else "-"
+        angles = " ".join(f"{k} {v:.2f}" for k, v in row["angles_mae_deg"].items())
+        print(f"{row['model']:<40} {params:>10} {row['latency_ms']:>8.2f} {row['mre_mm']:>8.2f}  {angles}")
+    if len(rows) > 1:
+        base = rows[0]
+        for row in rows[1:]:
+            print(f"{row['model']}: {base['latency_ms'] / row['latency_ms']:.2f}x faster, MRE {row['mre_mm'] - base['mre_mm']:+.2f} mm vs {base['model']}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as fp:
+            json.dump(rows, fp, indent=2)
+
+
+if __name__ == "__main__":
+    main()
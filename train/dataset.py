@@ -1,11 +1,15 @@
+import hashlib
 import json
+import math
 import os
-from typing import Dict, List, Tuple
+import random
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Sequence, Tuple
 
 import numpy as np
 import torch
 import torch.nn.functional as F
-from torch.utils.data import Dataset
+from torch.utils.data import Dataset, Sampler
 
 
 LANDMARK_ORDER = ["L1_ant", "L1_post", "S1_ant", "S1_post", "FH"]
@@ -53,6 +57,71 @@ def _make_heatmaps(coords: List[Tuple[float, float]], size: Tuple[int, int], sig
     return torch.stack(heatmaps, dim=0)  # (L,H,W)
 
 
+def labelled_frame(meta: Dict, depth: int) -> int:
+    """
+    Frame (k) of a (D,H,W) volume the landmarks were placed on. Flexion/neutral/extension
+    series and multi-frame exports are labelled one frame per case (one exported json per
+    frame), so training samples every labelled frame instead of always the first.
+    """
+    ks = [float(p.get("k", 0.0)) for p in meta.get("landmarks_ijk", {}).values()]
+    k = int(round(float(np.median(ks)))) if ks else 0
+    return min(max(k, 0), depth - 1)
+
+
+def closest_aspect_bucket(shape_hw: Tuple[int, int], buckets: Sequence[Tuple[int, int]]) -> int:
+    """Index of the bucket (H, W) whose aspect ratio is closest (in log space) to shape_hw."""
+    aspect = math.log(shape_hw[0] / shape_hw[1])
+    return min(range(len(buckets)), key=lambda i: abs(math.log(buckets[i][0] / buckets[i][1]) - aspect))
+
+
+class AspectBucketBatchSampler(Sampler):
+    """
+    Batches that only contain indices of one aspect bucket (so every batch has one input shape).
+    bucket_ids[i] is the bucket of dataset index i; batches are reshuffled every epoch.
+    """
+
+    def __init__(self, bucket_ids: Sequence[int], batch_size: int, shuffle: bool = True, seed: int = 0):
+        self.bucket_ids = list(bucket_ids)
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.seed = seed
+        self.epoch = 0
+
+    def _batches(self):
+        rng = random.Random(self.seed + self.epoch)
+        groups: Dict[int, List[int]] = {}
+        for idx, b in enumerate(self.bucket_ids):
+            groups.setdefault(b, []).append(idx)
+        batches = []
+        for b in sorted(groups):
+            idxs = groups[b]
+            if self.shuffle:
+                rng.shuffle(idxs)
+            batches.extend(idxs[i : i + self.batch_size] for i in range(0, len(idxs), self.batch_size))
+        if self.shuffle:
+            rng.shuffle(batches)
+        return batches
+
+    def __iter__(self):
+        batches = self._batches()
+        self.epoch += 1
+        return iter(batches)
+
+    def __len__(self):
+        return len(self._batches())
+
+
+def bucket_sampler_for(dataset, batch_size: int, shuffle: bool, seed: int = 0) -> Optional[AspectBucketBatchSampler]:
+    """Bucket batch sampler for a HeatmapDataset or a Subset of one; None when it has no buckets."""
+    base, indices = dataset, None
+    if isinstance(dataset, torch.utils.data.Subset):
+        base, indices = dataset.dataset, dataset.indices
+    if base.bucket_ids is None:
+        return None
+    ids = base.bucket_ids if indices is None else [base.bucket_ids[i] for i in indices]
+    return AspectBucketBatchSampler(ids, batch_size, shuffle=shuffle, seed=seed)
+
+
 class HeatmapDataset(Dataset):
     """
     Loads .npy image and .json landmarks (IJK). Generates normalized image and heatmaps.
@@ -64,12 +133,91 @@ class HeatmapDataset(Dataset):
         resize: Tuple[int, int] = (512, 512),
         sigma: float = 3.0,
         percentile_clip: Tuple[float, float] = (1.0, 99.0),
+        return_heatmap: bool = True,
+        cache_dir: Optional[str] = None,
+        buckets: Optional[Sequence[Tuple[int, int]]] = None,
+        teacher_dir: Optional[str] = None,
+        manifest: Optional[str] = None,
     ):
         self.data_dir = data_dir
-        self.resize = resize
-        self.sigma = sigma
+        # resize and sigma live in shared memory so set_resolution() (progressive-resolution training)
+        # also reaches persistent DataLoader workers without re-creating them
+        self._resolution = torch.tensor([resize[0], resize[1], sigma], dtype=torch.float64).share_memory_()
         self.percentile_clip = percentile_clip
-        self.samples = self._discover_samples()
+        # False: skip CPU heatmap rendering (e.g. heatmaps are rendered on-device after augmentation)
+        self.return_heatmap = return_heatmap
+        # Optional on-disk cache of normalized + pad-resized images, shared by every run
+        # with the same preprocessing parameters (sigma is applied afterwards, so not part of the key).
+        self.cache_dir = cache_dir
+        # Validated manifest (manifest.py): sample list and image shapes come from it instead of
+        # listing the directory and probing every .npy
+        self._shapes = None
+        if manifest is not None:
+            self.samples, self._shapes = self._samples_from_manifest(manifest)
+        else:
+            self.samples = self._discover_samples()
+        # Aspect buckets: each sample is pad-resized to the (H, W) bucket closest to its own aspect
+        # ratio instead of one square `resize`, so less of every input is padding.
+        self.buckets = [tuple(b) for b in buckets] if buckets else None
+        self.bucket_ids = None
+        if self.buckets:
+            for h, w in self.buckets:
+                if h % 8 or w % 8:
+                    raise ValueError(f"Bucket {h}x{w} must be divisible by 8")
+            shapes = self._shapes or [self._image_shape(npy) for _, npy, _ in self.samples]
+            self.bucket_ids = [closest_aspect_bucket(hw, self.buckets) for hw in shapes]
+        # Distillation: folder of cached teacher heatmaps (<case_id>.npy, see distill.py) added as sample["teacher"]
+        self.teacher_dir = teacher_dir
+
+    @staticmethod
+    def _image_shape(npy_path: str) -> Tuple[int, int]:
+        """(H, W) from the .npy header only (memory-mapped, no pixel reads)."""
+        return tuple(np.load(npy_path, mmap_mode="r").shape[-2:])
+
+    @property
+    def resize(self) -> Tuple[int, int]:
+        return int(self._resolution[0]), int(self._resolution[1])
+
+    @property
+    def sigma(self) -> float:
+        return float(self._resolution[2])
+
+    def set_resolution(self, resize: Tuple[int, int], sigma: float):
+        """
+        Switch the pad-resize target and heatmap sigma for the samples loaded from now on, in this
+        process and in DataLoader workers already running. Each resolution has its own cache_key,
+        so cached images of every stage are kept side by side.
+        """
+        if self.buckets:
+            raise ValueError("set_resolution does not apply to aspect buckets")
+        self._resolution.copy_(torch.tensor([resize[0], resize[1], sigma], dtype=torch.float64))
+
+    def target_size(self, idx: int) -> Tuple[int, int]:
+        if self.bucket_ids is None:
+            return tuple(self.resize)
+        return self.buckets[self.bucket_ids[idx]]
+
+    @property
+    def cache_key(self) -> str:
+        # version 3: multi-frame volumes cache the labelled frame (earlier entries hold frame 0).
+        # The resolved data_dir keeps export folders with the same case ids apart in a shared --cache-dir.
+        params = {
+            "data_dir": os.path.realpath(self.data_dir),
+            "resize": list(self.resize),
+            "percentile_clip": list(self.percentile_clip),
+            "version": 3,
+        }
+        if self.buckets:
+            params["buckets"] = [list(b) for b in self.buckets]
+        return hashlib.sha1(json.dumps(params, sort_keys=True).encode()).hexdigest()[:12]
+
+    def _cache_path(self, case_id: str) -> Optional[str]:
+        if self.cache_dir is None:
+            return None
+        return os.path.join(self.cache_dir, self.cache_key, f"{case_id}.npz")
+
+    def case_ids(self) -> List[str]:
+        return [s[0] for s in self.samples]
 
     def _discover_samples(self):
         out = []
@@ -86,41 +234,113 @@ class HeatmapDataset(Dataset):
             raise RuntimeError(f"No samples found in {self.data_dir}")
         return out
 
+    def _samples_from_manifest(self, manifest_path: str):
+        from manifest import load_manifest
+
+        cases = load_manifest(manifest_path)["cases"]
+        if not cases:
+            raise RuntimeError(f"No valid samples in {manifest_path}")
+        samples = [
+            (c["case_id"], os.path.join(self.data_dir, c["npy"]), os.path.join(self.data_dir, c["json"])) for c in cases
+        ]
+        return samples, [tuple(c["shape"]) for c in cases]
+
     def __len__(self):
         return len(self.samples)
 
-    def __getitem__(self, idx):
+    def _load_preprocessed(self, idx):
+        """
+        Normalized, pad-resized image (1,Ht,Wt), resized coords (L,2), scale, [pad_x, pad_y] and
+        pixel spacing [sx, sy] (mm/px, 1.0 if the json has none), via the cache if enabled.
+        """
         case_id, npy_path, json_path = self.samples[idx]
-        img_np = np.load(npy_path)
-        # Accept shape (H,W) or (D,H,W); use first slice if 3D.
-        if img_np.ndim == 3:
-            img_np = img_np[0]
-        if img_np.ndim != 2:
-            raise ValueError(f"Unsupported image shape {img_np.shape} for {npy_path}")
+        cache_path = self._cache_path(case_id)
+        if cache_path is not None and self._cache_fresh(cache_path, npy_path, json_path):
+            with np.load(cache_path) as z:
+                return (
+                    torch.from_numpy(z["image"]),
+                    torch.from_numpy(z["coords"]),
+                    float(z["scale"]),
+                    z["pad"].tolist(),
+                    z["spacing"].tolist(),
+                )
 
         with open(json_path, "r", encoding="utf-8") as fp:
             meta = json.load(fp)
 
+        img_np = np.load(npy_path, mmap_mode="r")
+        # Accept shape (H,W) or (D,H,W); for multi-frame volumes read only the frame the landmarks are on
+        if img_np.ndim == 3:
+            img_np = img_np[labelled_frame(meta, img_np.shape[0])]
+        if img_np.ndim != 2:
+            raise ValueError(f"Unsupported image shape {img_np.shape} for {npy_path}")
+        img_np = np.asarray(img_np)
+
         coords = self._extract_coords(meta, img_np.shape)
+        spacing = [float(v) for v in meta.get("metadata", {}).get("spacing", [1.0, 1.0])[:2]]
 
         img_np = _percentile_clip_norm(img_np, *self.percentile_clip)
         img_t = torch.from_numpy(img_np).unsqueeze(0)  # (1,H,W)
-        img_t, scale, pad_x, pad_y = _resize_with_padding(img_t, self.resize)  # (1,Ht,Wt)
+        img_t, scale, pad_x, pad_y = _resize_with_padding(img_t, self.target_size(idx))  # (1,Ht,Wt)
 
         # Rescale coords to resized+pad space
         coords_resized = []
         for (x, y) in coords:
             coords_resized.append((x * scale + pad_x, y * scale + pad_y))
-
-        hr, wr = self.resize
-        heatmap = _make_heatmaps(coords_resized, (hr, wr), sigma=self.sigma)
         coords_t = torch.tensor(coords_resized, dtype=torch.float32)
-        return {
+
+        if cache_path is not None:
+            os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+            # write-then-rename so concurrent runs never read a partial file
+            tmp_path = f"{cache_path}.{os.getpid()}.tmp.npz"
+            np.savez(
+                tmp_path,
+                image=img_t.numpy(),
+                coords=coords_t.numpy(),
+                scale=scale,
+                pad=np.array([pad_x, pad_y]),
+                spacing=np.array(spacing),
+            )
+            os.replace(tmp_path, cache_path)
+        return img_t, coords_t, scale, [pad_x, pad_y], spacing
+
+    @staticmethod
+    def _cache_fresh(cache_path: str, *sources: str) -> bool:
+        """Cached entry exists and is newer than its source files (re-exported cases get rebuilt)."""
+        if not os.path.exists(cache_path):
+            return False
+        cache_mtime = os.path.getmtime(cache_path)
+        return all(os.path.getmtime(src) <= cache_mtime for src in sources)
+
+    def build_cache(self, indices: Optional[Sequence[int]] = None, num_threads: int = 4):
+        """Preprocess the given samples (default: all) into cache_dir (no-op for cached ones)."""
+        if self.cache_dir is None:
+            raise ValueError("cache_dir is not set")
+        if indices is None:
+            indices = range(len(self))
+        with ThreadPoolExecutor(max_workers=num_threads) as pool:
+            list(pool.map(self._load_preprocessed, indices))
+
+    def __getitem__(self, idx):
+        case_id = self.samples[idx][0]
+        img_t, coords_t, scale, pad, spacing = self._load_preprocessed(idx)
+        coords_resized = coords_t.tolist()
+        sample = {
             "image": img_t,
-            "heatmap": heatmap,
             "coords": coords_t,
             "case_id": case_id,
+            # for mapping predictions back to original pixels / mm
+            "scale": torch.tensor(scale, dtype=torch.float32),
+            "pad": torch.tensor(pad, dtype=torch.float32),
+            "spacing": torch.tensor(spacing, dtype=torch.float32),
         }
+        if self.return_heatmap:
+            hr, wr = img_t.shape[-2:]
+            sample["heatmap"] = _make_heatmaps(coords_resized, (hr, wr), sigma=self.sigma)
+        if self.teacher_dir is not None:
+            teacher = np.load(os.path.join(self.teacher_dir, f"{case_id}.npy"))
+            sample["teacher"] = torch.from_numpy(teacher.astype(np.float32))
+        return sample
 
     def _extract_coords(self, meta: Dict, shape_hw: Tuple[int, int]) -> List[Tuple[float, float]]:
         coords = []
@@ -132,3 +352,124 @@ class HeatmapDataset(Dataset):
                 raise ValueError(f"Missing landmark {name}")
             coords.append((lm[name]["i"], lm[name]["j"]))
         return coords
+
+
+class PatchHeatmapDataset(Dataset):
+    """
+    Fixed-size crops at native (scale=1.0) or moderately reduced resolution instead of the whole
+    film downsampled to `resize`, so fine detail survives and memory stays bounded by the patch size.
+
+    Random mode draws `patches_per_case` crops per case per epoch: most are centred on a random
+    landmark with up to `jitter` (fraction of the half patch) offset, the rest (`background_prob`)
+    anywhere on the film. Deterministic mode (random_crops=False, for validation) gives one crop centred
+    on each landmark. Heatmaps are rendered only for the landmarks inside the crop; sample["visible"]
+    marks them (metrics and on-device heatmap rendering ignore the others).
+
+    `base` is a HeatmapDataset (for the sample list / manifest); `indices` restricts it (e.g. a split).
+    Samples carry the same scale/pad/spacing keys as HeatmapDataset (pad is minus the crop origin),
+    so predictions map back to original pixels the same way.
+    """
+
+    bucket_ids = None
+
+    def __init__(
+        self,
+        base: HeatmapDataset,
+        indices: Optional[Sequence[int]] = None,
+        patch_size: Tuple[int, int] = (256, 256),
+        scale: float = 1.0,
+        sigma: float = 3.0,
+        patches_per_case: int = 4,
+        background_prob: float = 0.2,
+        jitter: float = 0.5,
+        random_crops: bool = True,
+        return_heatmap: bool = True,
+    ):
+        if patch_size[0] % 8 or patch_size[1] % 8:
+            raise ValueError(f"Patch size {patch_size[0]}x{patch_size[1]} must be divisible by 8")
+        if not 0.0 < scale <= 1.0:
+            raise ValueError(f"Patch scale must be in (0, 1], got {scale}")
+        self._base = base
+        self.samples = [base.samples[i] for i in (indices if indices is not None else range(len(base)))]
+        self.percentile_clip = base.percentile_clip
+        self.patch_size = tuple(patch_size)
+        self.scale = scale
+        self.sigma = sigma
+        self.random_crops = random_crops
+        self.patches_per_case = patches_per_case if random_crops else len(LANDMARK_ORDER)
+        self.background_prob = background_prob
+        self.jitter = jitter
+        self.return_heatmap = return_heatmap
+        # per-case coords, spacing, frame and intensity window, filled lazily (per worker process)
+        self._info: Dict[int, Tuple] = {}
+
+    def case_ids(self) -> List[str]:
+        return [s[0] for s in self.samples]
+
+    def __len__(self):
+        return len(self.samples) * self.patches_per_case
+
+    def _case_info(self, case: int):
+        if case not in self._info:
+            _, npy_path, json_path = self.samples[case]
+            with open(json_path, "r", encoding="utf-8") as fp:
+                meta = json.load(fp)
+            img = np.load(npy_path, mmap_mode="r")
+            frame = labelled_frame(meta, img.shape[0]) if img.ndim == 3 else None
+            plane = img[frame] if frame is not None else img
+            coords = np.array(self._base._extract_coords(meta, plane.shape), dtype=np.float32)
+            spacing = [float(v) for v in meta.get("metadata", {}).get("spacing", [1.0, 1.0])[:2]]
+            # whole-film percentiles (as in full-image training) from a strided view, ~1M pixels read
+            stride = max(1, int(math.sqrt(plane.shape[0] * plane.shape[1] / 1e6)))
+            lo, hi = np.percentile(np.asarray(plane[::stride, ::stride]), self.percentile_clip)
+            self._info[case] = (coords, spacing, frame, float(lo), float(hi))
+        return self._info[case]
+
+    def _crop_center(self, item: int, coords: np.ndarray, shape_hw: Tuple[int, int], window_hw: Tuple[int, int]):
+        if not self.random_crops:
+            return coords[item % len(LANDMARK_ORDER)]
+        if torch.rand(()).item() < self.background_prob:
+            return np.array([torch.rand(()).item() * shape_hw[1], torch.rand(()).item() * shape_hw[0]], dtype=np.float32)
+        landmark = coords[torch.randint(len(coords), ()).item()]
+        offset = (torch.rand(2).numpy() * 2.0 - 1.0) * self.jitter * np.array([window_hw[1], window_hw[0]]) / 2.0
+        return landmark + offset.astype(np.float32)
+
+    def __getitem__(self, idx):
+        case, item = divmod(idx, self.patches_per_case)
+        case_id, npy_path, _ = self.samples[case]
+        coords, spacing, frame, lo, hi = self._case_info(case)
+        img = np.load(npy_path, mmap_mode="r")
+        if frame is not None:
+            img = img[frame]
+        h, w = img.shape
+        ph, pw = self.patch_size
+        # crop window in original pixels; resampled to the patch size when scale < 1
+        wh, ww = int(round(ph / self.scale)), int(round(pw / self.scale))
+        cx, cy = self._crop_center(item, coords, (h, w), (wh, ww))
+        x0, y0 = int(round(cx - ww / 2.0)), int(round(cy - wh / 2.0))
+
+        # only the overlapping rows/columns are read from the memory-mapped film; outside is 0 (like padding)
+        canvas = np.zeros((wh, ww), dtype=np.float32)
+        sx0, sy0, sx1, sy1 = max(x0, 0), max(y0, 0), min(x0 + ww, w), min(y0 + wh, h)
+        if sx1 > sx0 and sy1 > sy0:
+            region = np.clip(np.asarray(img[sy0:sy1, sx0:sx1], dtype=np.float32), lo, hi)
+            canvas[sy0 - y0 : sy1 - y0, sx0 - x0 : sx1 - x0] = (region - lo) / (hi - lo + 1e-6)
+        img_t = torch.from_numpy(canvas).unsqueeze(0)
+        if (wh, ww) != (ph, pw):
+            img_t = F.interpolate(img_t.unsqueeze(0), size=(ph, pw), mode="bilinear", align_corners=False).squeeze(0)
+
+        fx, fy = pw / ww, ph / wh
+        coords_t = torch.from_numpy((coords - np.array([x0, y0], dtype=np.float32)) * np.array([fx, fy], dtype=np.float32))
+        visible = (coords_t[:, 0] >= 0) & (coords_t[:, 0] <= pw - 1) & (coords_t[:, 1] >= 0) & (coords_t[:, 1] <= ph - 1)
+        sample = {
+            "image": img_t,
+            "coords": coords_t,
+            "case_id": case_id,
+            "scale": torch.tensor(fx, dtype=torch.float32),
+            "pad": torch.tensor([-x0 * fx, -y0 * fy], dtype=torch.float32),
+            "spacing": torch.tensor(spacing, dtype=torch.float32),
+            "visible": visible.to(torch.float32),
+        }
+        if self.return_heatmap:
+            sample["heatmap"] = _make_heatmaps(coords_t.tolist(), (ph, pw), sigma=self.sigma) * sample["visible"].view(-1, 1, 1)
+        return sample
@@ -0,0 +1,72 @@
+"""
+Knowledge distillation helpers: a trained (wide) teacher checkpoint supervises a reduced-width
+student alongside the ground-truth heatmaps. Without augmentation the teacher forward is
+run once per case and cached to disk as float16 heatmaps, so training costs one student
+forward/backward per step.
+"""
+
+import hashlib
+import os
+from pathlib import Path
+from typing import Optional, Sequence
+
+import numpy as np
+import torch
+
+from model import SmallUNet
+
+
+def load_teacher(path: str, device) -> SmallUNet:
+    """Frozen teacher in eval mode."""
+    ckpt = torch.load(path, map_location=device)
+    teacher = SmallUNet.from_checkpoint(ckpt).to(device).eval()
+    for p in teacher.parameters():
+        p.requires_grad_(False)
+    return teacher
+
+
+def teacher_cache_dir(cache_root: str, teacher_path: str, dataset) -> Path:
+    """
+    Cache folder for one teacher checkpoint + preprocessing; a retrained teacher (new mtime/size)
+    or different resize/buckets gets a new folder instead of stale heatmaps.
+    """
+    st = os.stat(teacher_path)
+    key = f"{os.path.abspath(teacher_path)}|{st.st_size}|{st.st_mtime_ns}|{dataset.cache_key}"
+    return Path(cache_root) / f"teacher_{hashlib.sha1(key.encode()).hexdigest()[:12]}"
+
+
+def build_teacher_cache(teacher, dataset, out_dir, device, batch_size: int = 8, indices: Optional[Sequence[int]] = None) -> int:
+    """
+    Run `teacher` once over every case of `dataset` (a HeatmapDataset; only `indices` if given) that
+    has no cached heatmaps yet and write <out_dir>/<case_id>.npy (float16, (L,H,W)). Returns the
+    number of cases computed.
+    """
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    case_ids = dataset.case_ids()
+    if indices is None:
+        indices = range(len(case_ids))
+    todo = [i for i in indices if not (out_dir / f"{case_ids[i]}.npy").exists()]
+    # same-shape cases batch together (aspect buckets)
+    groups = {}
+    for i in todo:
+        groups.setdefault(dataset.target_size(i), []).append(i)
+    with torch.no_grad():
+        for indices in groups.values():
+            for start in range(0, len(indices), batch_size):
+                chunk = indices[start : start + batch_size]
+                images = torch.stack([dataset._load_preprocessed(i)[0] for i in chunk]).to(device)
+                heatmaps = teacher(images).cpu().numpy().astype(np.float16)
+                for i, hm in zip(chunk, heatmaps):
+                    path = out_dir / f"{case_ids[i]}.npy"
+                    tmp = out_dir / f"{case_ids[i]}.{os.getpid()}.tmp.npy"
+                    np.save(tmp, hm)
+                    os.replace(tmp, path)
+    return len(todo)
+
+
+def distill_loss(pred: torch.Tensor, target: torch.Tensor, teacher_heatmaps: torch.Tensor, alpha: float) -> torch.Tensor:
+    """alpha * MSE(student, teacher) + (1 - alpha) * MSE(student, ground truth)."""
+    soft = torch.mean((pred - teacher_heatmaps) ** 2)
+    hard = torch.mean((pred - target) ** 2)
+    return alpha * soft + (1.0 - alpha) * hard
@@ -0,0 +1,130 @@
+"""
+Training/validation steps shared by train.py and finetune_daemon.py.
+"""
+
+import torch
+from tqdm import tqdm
+
+from augment import render_heatmaps
+from distill import distill_loss
+
+
+def _visible_only(target, batch, device):
+    """Zero the heatmaps of landmarks outside a patch crop (batch["visible"], PatchHeatmapDataset)."""
+    if "visible" not in batch:
+        return target
+    return target * batch["visible"].to(device, non_blocking=True)[..., None, None]
+
+
+def _batch_target(batch, img, device, sigma):
+    """Dataset heatmaps if present; otherwise render them on-device from coords."""
+    if "heatmap" in batch:
+        return batch["heatmap"].to(device)
+    coords = batch["coords"].to(device)
+    return _visible_only(render_heatmaps(coords, img.shape[-2:], sigma), batch, device)
+
+
+def batch_loss(model, batch, device, augment=None, sigma=3.0, teacher=None, distill_alpha=0.5):
+    """
+    Training loss of one batch (graph attached) and its size.
+    Distillation uses cached teacher heatmaps (batch["teacher"]) if present, else runs `teacher`
+    on the (augmented) batch.
+    """
+    img = batch["image"].to(device, non_blocking=True)
+    if augment is not None:
+        coords = batch["coords"].to(device, non_blocking=True)
+        img, coords = augment(img, coords)
+        target = _visible_only(render_heatmaps(coords, img.shape[-2:], sigma), batch, device)
+    else:
+        target = _batch_target(batch, img, device, sigma)
+    pred = model(img)
+    if "teacher" in batch:
+        loss = distill_loss(pred, target, batch["teacher"].to(device, non_blocking=True), distill_alpha)
+    elif teacher is not None:
+        with torch.no_grad():
+            soft = teacher(img)
+        loss = distill_loss(pred, target, soft, distill_alpha)
+    else:
+        loss = torch.mean((pred - target) ** 2)
+    return loss, img.size(0)
+
+
+def train_step(model, batch, optimizer, device, augment=None, sigma=3.0, teacher=None, distill_alpha=0.5):
+    """One optimisation step; returns (loss, batch size)."""
+    loss, n = batch_loss(model, batch, device, augment, sigma, teacher, distill_alpha)
+    optimizer.zero_grad()
+    loss.backward()
+    optimizer.step()
+    return loss.item(), n
+
+
+def train_one_epoch(model, loader, optimizer, device, augment=None, sigma=3.0, teacher=None, distill_alpha=0.5, accum_steps=1):
+    """
+    One pass over `loader`. With accum_steps > 1 the loader yields micro-batches and the
+    optimiser steps once every accum_steps of them (gradients averaged over the group, including
+    a shorter last group), so the effective batch is accum_steps micro-batches in bounded memory.
+    """
+    model.train()
+    total_loss = 0.0
+    if accum_steps <= 1:
+        for batch in tqdm(loader, desc="train", leave=False):
+            loss, n = train_step(model, batch, optimizer, device, augment, sigma, teacher, distill_alpha)
+            total_loss += loss * n
+        return total_loss / len(loader.dataset)
+
+    num_batches = len(loader)
+    optimizer.zero_grad()
+    for i, batch in enumerate(tqdm(loader, desc="train", leave=False)):
+        group_start = i - i % accum_steps
+        group_size = min(accum_steps, num_batches - group_start)
+        loss, n = batch_loss(model, batch, device, augment, sigma, teacher, distill_alpha)
+        (loss / group_size).backward()
+        total_loss += loss.item() * n
+        if i + 1 - group_start == group_size:
+            optimizer.step()
+            optimizer.zero_grad()
+    return total_loss / len(loader.dataset)
+
+
+def validate(model, loader, device, sigma=3.0, metrics=None, progress=True):
+    """Mean heatmap MSE; if a MetricAccumulator is given it is fed the same predictions."""
+    model.eval()
+    total_loss = 0.0
+    with torch.no_grad():
+        for batch in tqdm(loader, desc="val", leave=False, disable=not progress):
+            img = batch["image"].to(device, non_blocking=True)
+            target = _batch_target(batch, img, device, sigma)
+            pred = model(img)
+            loss = torch.mean((pred - target) ** 2)
+            total_loss += loss.item() * img.size(0)
+            if metrics is not None:
+                metrics.update(pred, batch)
+    return total_loss / len(loader.dataset)
+
+
+def parse_buckets(buckets):
+    return [tuple(int(v) for v in b.lower().split("x")) for b in buckets] if buckets else None
+
+
+def resolution_schedule(stages, resize, sigma, epochs):
+    """
+    Per-epoch ((H, W), sigma) for progressive-resolution training. Each stage is "SIZE:EPOCHS":
+    SIZE is the longer side of the stage input (the `resize` aspect is kept, rounded to a multiple
+    of 8) and sigma shrinks with the resolution so the targets cover the same anatomy. Epochs after
+    the listed stages run at the full `resize`, e.g. ["256:5", "384:5"] with resize 512x512 and
+    20 epochs -> 5 at 256, 5 at 384, 10 at 512.
+    """
+    h, w = resize
+    schedule = []
+    for stage in stages or []:
+        size, _, count = stage.partition(":")
+        if not count:
+            raise ValueError(f"Resolution stage {stage!r} must be SIZE:EPOCHS (e.g. 256:5)")
+        factor = int(size) / max(h, w)
+        if not 0 < factor <= 1:
+            raise ValueError(f"Resolution stage {stage!r} must not exceed the final size {h}x{w}")
+        hw = (max(8, int(round(h * factor / 8)) * 8), max(8, int(round(w * factor / 8)) * 8))
+        schedule += [(hw, sigma * hw[0] / h)] * int(count)
+    if len(schedule) > epochs:
+        raise ValueError(f"Resolution schedule covers {len(schedule)} epochs but training runs {epochs}")
+    return schedule + [((h, w), sigma)] * (epochs - len(schedule))
@@ -0,0 +1,106 @@
+"""
+Batched evaluation of a checkpoint (.pt) or ONNX model: landmark radial error in mm and
+PI/PT/SS/LL angle error, with per-landmark / per-angle summary statistics.
+Usage:
+  uv run python train/evaluate.py --model runs/best.pt --data-dir /path/to/exported --split-manifest runs/cv/folds/fold_0.json
+"""
+
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+
+import torch
+from torch.utils.data import Subset
+
+from dataset import HeatmapDataset, bucket_sampler_for
+from loader_tune import make_loader
+from metrics import MetricAccumulator, format_summary
+from model import SmallUNet
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "SagittalMeasureAssist" / "lib"))
+from inference_core import heatmap_output_name  # noqa: E402
+from ort_profile import create_session  # noqa: E402
+
+
+def parse_args():
+    p = argparse.ArgumentParser()
+    p.add_argument("--model", required=True, help="Checkpoint (.pt) or ONNX model")
+    p.add_argument("--data-dir", required=True, help="Folder with *_image.npy and *_landmarks.json")
+    p.add_argument("--manifest", help="Validated dataset manifest from manifest.py (default: list --data-dir)")
+    p.add_argument("--split-manifest", help="Evaluate only the 'val' cases of this manifest (default: every case)")
+    p.add_argument("--resize", type=int, nargs=2, default=None, metavar=("H", "W"), help="Model input size (default: from the checkpoint config, else 512 512)")
+    p.add_argument("--buckets", nargs="+", default=None, help="Aspect buckets as HxW (default: from the checkpoint config)")
+    p.add_argument("--batch-size", type=int, default=32)
+    p.add_argument("--num-workers", type=int, default=2)
+    p.add_argument("--cache-dir", help="Preprocessed cache shared with train.py")
+    p.add_argument("--device", default="cuda" if torch.cuda.is_available() else "cpu")
+    p.add_argument("--output", help="Write the summary JSON here")
+    return p.parse_args()
+
+
+def load_predictor(model_path: str, device):
+    """Return (predict(images (N,1,H,W) tensor) -> heatmaps (N,L,H,W) tensor, checkpoint config or {})."""
+    if model_path.endswith(".onnx"):
+        sess, _ = create_session(model_path)
+        input_name = sess.get_inputs()[0].name
+        output_name = heatmap_output_name(sess)
+
+        def predict(images):
+            out = sess.run([output_name], {input_name: images.cpu().numpy()})[0]
+            return torch.from_numpy(out)
+
+        return predict, {}
+
+    ckpt = torch.load(model_path, map_location=device)
+    model = SmallUNet.from_checkpoint(ckpt)
+    model.to(device).eval()
+
+    def predict(images):
+        with torch.no_grad():
+            return model(images.to(device, non_blocking=True))
+
+    return predict, ckpt.get("config", {})
+
+
+def evaluate(predict, loader) -> MetricAccumulator:
+    acc = MetricAccumulator()
+    for batch in loader:
+        acc.update(predict(batch["image"]), batch)
+    return acc
+
+
+def main():
+    args = parse_args()
+    device = torch.device(args.device)
+    predict, config = load_predictor(args.model, device)
+    resize = tuple(args.resize or config.get("resize") or (512, 512))
+
+    buckets = args.buckets or config.get("buckets")
+    buckets = [tuple(int(v) for v in b.lower().split("x")) for b in buckets] if buckets else None
+    dataset = HeatmapDataset(
+        args.data_dir, resize=resize, return_heatmap=False, cache_dir=args.cache_dir, buckets=buckets, manifest=args.manifest
+    )
+    if args.split_manifest:
+        with open(args.split_manifest, "r", encoding="utf-8") as fp:
+            val_ids = set(json.load(fp)["val"])
+        dataset = Subset(dataset, [i for i, c in enumerate(dataset.case_ids()) if c in val_ids])
+    loader = make_loader(
+        dataset, args.batch_size, False, args.num_workers, device,
+        batch_sampler=bucket_sampler_for(dataset, args.batch_size, False),
+    )
+
+    start = time.perf_counter()
+    summary = evaluate(predict, loader).summary()
+    elapsed = time.perf_counter() - start
+    print(format_summary(summary))
+    print(f"{summary['n']} cases in {elapsed:.2f} s ({summary['n'] / elapsed:.1f} cases/s)")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as fp:
+            json.dump(summary, fp, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+"""
+Parallel experiment runner: deterministic k-fold cross-validation and hyperparameter sweeps.
+Each (sweep point, fold) is one train.py run in a local process pool; every process is
+limited to --threads-per-run threads so runs don't oversubscribe the cores. Runs with
+the same preprocessing (--resize) share one preprocessed cache.
+
+Usage:
+  uv run python train/experiments.py --data-dir /path/to/exported --out-dir runs/cv \\
+      --folds 5 --sigma 2 3 --lr 1e-3 3e-4 --resize 512x512 --processes 4 --threads-per-run 2
+"""
+
+import argparse
+import csv
+import itertools
+import json
+import multiprocessing
+import os
+import statistics
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from typing import Dict, List
+
+import numpy as np
+
+from dataset import HeatmapDataset
+
+
+def parse_args():
+    p = argparse.ArgumentParser()
+    p.add_argument("--data-dir", required=True, help="Folder with *_image.npy and *_landmarks.json")
+    p.add_argument("--out-dir", default="runs/experiments", help="Run directories, fold manifests and summary.csv go here")
+    p.add_argument("--folds", type=int, default=5, help="k for k-fold cross-validation (1 = single seeded 90/10 split)")
+    p.add_argument("--seed", type=int, default=0, help="Seed for fold assignment and training")
+    p.add_argument("--sigma", type=float, nargs="+", default=[3.0], help="Sweep values for heatmap sigma")
+    p.add_argument("--lr", type=float, nargs="+", default=[1e-3], help="Sweep values for learning rate")
+    p.add_argument("--resize", nargs="+", default=["512x512"], help="Sweep values for input size, as HxW")
+    p.add_argument("--epochs", type=int, default=20)
+    p.add_argument("--batch-size", type=int, default=4)
+    p.add_argument("--processes", type=int, default=max(1, (os.cpu_count() or 1) // 4), help="Concurrent runs")
+    p.add_argument("--threads-per-run", type=int, default=None, help="torch/OMP threads per run (default: cores / processes)")
+    p.add_argument("--loader-workers", type=int, default=0, help="DataLoader workers per run (0 keeps each run to one process)")
+    p.add_argument("--cache-dir", default=None, help="Shared preprocessed cache (default: <out-dir>/cache)")
+    p.add_argument("--device", default="cpu")
+    return p.parse_args()
+
+
+def _parse_hw(text: str):
+    h, w = text.lower().split("x")
+    return int(h), int(w)
+
+
+def make_kfold_manifests(case_ids: List[str], k: int, seed: int, out_dir: Path) -> List[Path]:
+    """
+    Deterministic k-fold split over sorted case ids (same ids + seed -> same folds).
+    Writes fold_<i>.json ({"train": [...], "val": [...]}) and returns their paths.
+    """
+    ids = sorted(case_ids)
+    if k < 2 or k > len(ids):
+        raise ValueError(f"--folds must be between 2 and the number of cases ({len(ids)})")
+    perm = np.random.default_rng(seed).permutation(len(ids))
+    folds = [sorted(ids[i] for i in perm[f::k]) for f in range(k)]
+    out_dir.mkdir(parents=True, exist_ok=True)
+    paths = []
+    for f in range(k):
+        val = folds[f]
+        train = sorted(c for g, fold in enumerate(folds) if g != f for c in fold)
+        path = out_dir / f"fold_{f}.json"
+        with open(path, "w", encoding="utf-8") as fp:
+            json.dump({"fold": f, "seed": seed, "train": train, "val": val}, fp, indent=2)
+        paths.append(path)
+    return paths
+
+
+def _init_worker(threads: int):
+    os.environ["OMP_NUM_THREADS"] = str(threads)
+    os.environ["MKL_NUM_THREADS"] = str(threads)
+    import torch
+
+    torch.set_num_threads(threads)
+    torch.set_num_interop_threads(1)
+
+
+def _run_one(job: Dict) -> Dict:
+    # load train.py by path: a bare "import train" can pick up the train/ directory itself (as a
+    # namespace package) when the repo root comes first on sys.path
+    import importlib.util
+
+    here = os.path.dirname(os.path.abspath(__file__))
+    if here not in sys.path:
+        sys.path.insert(0, here)  # train.py's own sibling imports
+    spec = importlib.util.spec_from_file_location("train_script", os.path.join(here, "train.py"))
+    train_script = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(train_script)
+
+    args = train_script.parse_args(job["argv"])
+    result = train_script.run(args)
+    return {**job["params"], **result}
+
+
+def _summarize(results: List[Dict], out_dir: Path):
+    results = sorted(results, key=lambda r: (r["run"], r["fold"]))
+    fields = ["run", "fold", "sigma", "lr", "resize", "best_val", "best_epoch", "save_dir"]
+    with open(out_dir / "summary.csv", "w", newline="", encoding="utf-8") as fp:
+        writer = csv.DictWriter(fp, fieldnames=fields, extrasaction="ignore")
+        writer.writeheader()
+        writer.writerows(results)
+
+    print(f"\n{'run':<32} {'folds':>5} {'val mean':>10} {'val std':>10}")
+    for run_name, group in itertools.groupby(results, key=lambda r: r["run"]):
+        vals = [r["best_val"] for r in group]
+        std = statistics.stdev(vals) if len(vals) > 1 else 0.0
+        print(f"{run_name:<32} {len(vals):>5} {statistics.mean(vals):>10.5f} {std:>10.5f}")
+    print(f"\nPer-run results: {out_dir / 'summary.csv'}")
+
+
+def main():
+    args = parse_args()
+    out_dir = Path(args.out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    cache_dir = args.cache_dir or str(out_dir / "cache")
+    threads = args.threads_per_run or max(1, (os.cpu_count() or 1) // args.processes)
+
+    resizes = [_parse_hw(r) for r in args.resize]
+    # Build each preprocessing cache once up front so concurrent runs only read it
+    case_ids = None
+    for hw in resizes:
+        ds = HeatmapDataset(args.data_dir, resize=hw, cache_dir=cache_dir)
+        print(f"Preparing cache {ds.cache_key} for resize {hw[0]}x{hw[1]} ({len(ds)} cases)...")
+        ds.build_cache(num_threads=os.cpu_count() or 1)
+        case_ids = ds.case_ids()
+
+    if args.folds > 1:
+        manifests = make_kfold_manifests(case_ids, args.folds, args.seed, out_dir / "folds")
+    else:
+        manifests = [None]
+
+    jobs = []
+    for sigma, lr, hw in itertools.product(args.sigma, args.lr, resizes):
+        run_name = f"sigma{sigma:g}_lr{lr:g}_{hw[0]}x{hw[1]}"
+        for fold, manifest in enumerate(manifests):
+            save_dir = out_dir / run_name / f"fold_{fold}"
+            argv = [
+                "--data-dir", args.data_dir,
+                "--save-dir", str(save_dir),
+                "--epochs", str(args.epochs),
+                "--batch-size", str(args.batch_size),
+                "--lr", str(lr),
+                "--sigma", str(sigma),
+                "--resize", str(hw[0]), str(hw[1]),
+                "--num-workers", str(args.loader_workers),
+                "--seed", str(args.seed),
+                "--cache-dir", cache_dir,
+                "--device", args.device,
+            ]
+            if manifest is not None:
+                argv += ["--split-manifest", str(manifest)]
+            params = {"run": run_name, "fold": fold, "sigma": sigma, "lr": lr, "resize": f"{hw[0]}x{hw[1]}"}
+            jobs.append({"argv": argv, "params": params})
+
+    print(f"Running {len(jobs)} runs on {args.processes} processes x {threads} threads")
+    # Children inherit the thread limits before torch initializes its pools
+    os.environ["OMP_NUM_THREADS"] = str(threads)
+    os.environ["MKL_NUM_THREADS"] = str(threads)
+    results = []
+    # spawn: fresh interpreters, no inherited torch thread pools
+    ctx = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=args.processes, mp_context=ctx, initializer=_init_worker, initargs=(threads,)) as pool:
+        futures = {pool.submit(_run_one, job): job for job in jobs}
+        for fut in as_completed(futures):
+            params = futures[fut]["params"]
+            try:
+                res = fut.result()
+            except Exception as exc:
+                print(f"  {params['run']} fold {params['fold']} failed: {exc}")
+                continue
+            print(f"  done {params['run']} fold {params['fold']}: best val {res['best_val']:.5f} (epoch {res['best_epoch']})")
+            results.append(res)
+
+    if results:
+        _summarize(results, out_dir)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,22 @@
 """
 Export a trained checkpoint to ONNX for Slicer inference (CPU-friendly).
+
+With --end-to-end the graph also does the intensity scaling and the landmark decoding:
+it takes the raw (resized, padded) image and returns only (N,L,2) coordinates and peak
+scores instead of the full (N,L,H,W) heatmaps.
 """
 
 import argparse
+import json
 from pathlib import Path
 
 import torch
+import torch.nn as nn
 
-from dataset import LANDMARK_ORDER
 from model import SmallUNet
 
+DECODE_MODES = ("argmax", "soft")
+
 
 def parse_args():
     p = argparse.ArgumentParser()
@@ -17,30 +24,183 @@ def parse_args():
     p.add_argument("--output", required=True, help="Path to output onnx file")
     p.add_argument("--height", type=int, default=512)
     p.add_argument("--width", type=int, default=512)
+    p.add_argument("--dynamic-hw", action="store_true", help="Also make H/W dynamic (inputs must stay divisible by 8)")
+    p.add_argument(
+        "--input-shapes",
+        nargs="+",
+        default=None,
+        help="Preferred input shapes as HxW, stored in the model metadata (default: the checkpoint's --buckets, if any)",
+    )
+    p.add_argument(
+        "--end-to-end",
+        choices=DECODE_MODES,
+        default=None,
+        help="Export raw image -> coords/scores with in-graph min/max scaling and this decode head "
+        "(argmax: integer peak; soft: soft-argmax around the peak for sub-pixel positions)",
+    )
+    p.add_argument("--refine-radius", type=int, default=3, help="Half window (px) of the soft-argmax refinement around the peak")
+    p.add_argument("--debug-heatmaps", action="store_true", help="With --end-to-end, also output the heatmaps (for debugging)")
     return p.parse_args()
 
 
-def main():
-    args = parse_args()
-    device = torch.device("cpu")
-    ckpt = torch.load(args.checkpoint, map_location=device)
+def _parse_hw(text: str):
+    h, w = text.lower().split("x")
+    return int(h), int(w)
 
-    model = SmallUNet(num_landmarks=len(LANDMARK_ORDER))
-    model.load_state_dict(ckpt["model_state"])
-    model.eval()
 
-    dummy = torch.zeros(1, 1, args.height, args.width, device=device)
-    out_path = Path(args.output)
+class EndToEndLandmarkModel(nn.Module):
+    """
+    Wraps a heatmap model into raw image (N,1,H,W) -> coords (N,L,2) as (x, y) in input pixels
+    and scores (N,L) (heatmap peak values), optionally followed by the heatmaps themselves.
+
+    Intensities are min/max scaled per image in the graph. This stands in for the percentile
+    clip used in training, so callers should pad with the image minimum (maps to 0 like the
+    zero padding of the heatmap path).
+    """
+
+    def __init__(self, model: nn.Module, decode: str = "argmax", refine_radius: int = 3, debug_heatmaps: bool = False):
+        super().__init__()
+        if decode not in DECODE_MODES:
+            raise ValueError(f"Unknown decode mode {decode!r} (expected one of {DECODE_MODES})")
+        self.model = model
+        self.decode = decode
+        self.refine_radius = refine_radius
+        self.debug_heatmaps = debug_heatmaps
+
+    def forward(self, x):
+        flat = x.flatten(1)
+        lo = flat.min(dim=1).values.view(-1, 1, 1, 1)
+        hi = flat.max(dim=1).values.view(-1, 1, 1, 1)
+        heatmaps = self.model((x - lo) / (hi - lo + 1e-6))
+
+        w = heatmaps.shape[3]
+        scores, idx = heatmaps.flatten(2).max(dim=-1)
+        ys = torch.div(idx, w, rounding_mode="floor")
+        # idx - y * w rather than idx % w (remainder by a dynamic size does not export)
+        xs = (idx - ys * w).float()
+        ys = ys.float()
+        if self.decode == "soft":
+            # centroid of the positive response in a (2r+1)^2 window around the peak
+            gx = torch.arange(w, dtype=heatmaps.dtype, device=heatmaps.device)
+            gy = torch.arange(heatmaps.shape[2], dtype=heatmaps.dtype, device=heatmaps.device)
+            in_x = ((gx.view(1, 1, -1) - xs.unsqueeze(-1)).abs() <= self.refine_radius).to(heatmaps.dtype)
+            in_y = ((gy.view(1, 1, -1) - ys.unsqueeze(-1)).abs() <= self.refine_radius).to(heatmaps.dtype)
+            weights = torch.relu(heatmaps) * in_y.unsqueeze(-1) * in_x.unsqueeze(-2)
+            total = weights.sum(dim=(2, 3))
+            safe = total.clamp_min(1e-12)
+            ref_x = (weights.sum(dim=2) * gx).sum(dim=-1) / safe
+            ref_y = (weights.sum(dim=3) * gy).sum(dim=-1) / safe
+            # no positive response near the peak: keep the integer position
+            xs = torch.where(total > 0, ref_x, xs)
+            ys = torch.where(total > 0, ref_y, ys)
+        coords = torch.stack([xs, ys], dim=-1)
+        if self.debug_heatmaps:
+            return coords, scores, heatmaps
+        return coords, scores
+
+
+def export_model(
+    model,
+    out_path,
+    height,
+    width,
+    dynamic_hw=False,
+    input_shapes=None,
+    metadata=None,
+    end_to_end=None,
+    refine_radius=3,
+    debug_heatmaps=False,
+):
+    """
+    Export `model` (eval mode) to a single self-contained ONNX file (weights embedded, so it can be
+    copied or atomically replaced on its own). input_shapes [(H, W), ...] and `metadata`
+    ({key: str}) go into metadata_props. end_to_end ("argmax"/"soft") exports the
+    EndToEndLandmarkModel wrapper instead (outputs coords, scores[, heatmaps]).
+    """
+    SmallUNet.check_input_size(height, width)
+    for h, w in input_shapes or []:
+        SmallUNet.check_input_size(h, w)
+
+    dummy = torch.zeros(1, 1, height, width)
+    out_path = Path(out_path)
     out_path.parent.mkdir(parents=True, exist_ok=True)
 
+    hw_axes = {2: "height", 3: "width"} if dynamic_hw else {}
+    dynamic_axes = {"image": {0: "batch", **hw_axes}}
+    props = dict(metadata or {})
+    if end_to_end:
+        model = EndToEndLandmarkModel(model, end_to_end, refine_radius, debug_heatmaps).eval()
+        output_names = ["coords", "scores"] + (["heatmaps"] if debug_heatmaps else [])
+        dynamic_axes.update({"coords": {0: "batch"}, "scores": {0: "batch"}})
+        props.update({"decode": end_to_end, "normalization": "minmax"})
+        if end_to_end == "soft":
+            props["refine_radius"] = refine_radius
+    else:
+        output_names = ["heatmaps"]
+    if "heatmaps" in output_names:
+        dynamic_axes["heatmaps"] = {0: "batch", **hw_axes}
+
     torch.onnx.export(
         model,
         dummy,
         out_path,
         input_names=["image"],
-        output_names=["heatmaps"],
+        output_names=output_names,
         opset_version=17,
-        dynamic_axes={"image": {0: "batch"}, "heatmaps": {0: "batch"}},
+        dynamic_axes=dynamic_axes,
+    )
+
+    import onnx
+
+    # load() pulls in weights the exporter may have written to a <name>.data sidecar
+    onnx_model = onnx.load(str(out_path))
+    if input_shapes:
+        props["input_shapes"] = json.dumps([[int(h), int(w)] for h, w in input_shapes])
+    for key, value in props.items():
+        entry = onnx_model.metadata_props.add()
+        entry.key = key
+        entry.value = str(value)
+    onnx.save(onnx_model, str(out_path), save_as_external_data=False)
+    sidecar = Path(f"{out_path}.data")
+    if sidecar.exists():
+        sidecar.unlink()
+    return out_path
+
+
+def main():
+    args = parse_args()
+    device = torch.device("cpu")
+    ckpt = torch.load(args.checkpoint, map_location=device)
+
+    model = SmallUNet.from_checkpoint(ckpt)
+    model.eval()
+
+    if args.input_shapes:
+        input_shapes = [_parse_hw(s) for s in args.input_shapes]
+    else:
+        input_shapes = [_parse_hw(s) for s in ckpt.get("config", {}).get("buckets") or []]
+    if input_shapes and not args.dynamic_hw:
+        raise SystemExit("--input-shapes / bucketed checkpoints need --dynamic-hw")
+
+    if args.debug_heatmaps and not args.end_to_end:
+        raise SystemExit("--debug-heatmaps only applies to --end-to-end exports")
+
+    # patch-trained models (train.py --patch-size) see structures at patch_scale px per original px;
+    # the Slicer local refinement crops at that scale
+    config = ckpt.get("config", {})
+    metadata = {"patch_scale": config["patch_scale"]} if config.get("patch_size") else None
+
+    out_path = export_model(
+        model,
+        args.output,
+        args.height,
+        args.width,
+        args.dynamic_hw,
+        input_shapes,
+        metadata=metadata,
+        end_to_end=args.end_to_end,
+        refine_radius=args.refine_radius,
+        debug_heatmaps=args.debug_heatmaps,
     )
     print(f"Exported ONNX to {out_path}")
 
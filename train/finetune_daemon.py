@@ -0,0 +1,238 @@
+"""
+Continuous fine-tuning daemon. Watches the Slicer export directory and, once enough new cases
+have arrived:
+  1. validates them with the header-only manifest builder and preprocesses only the new cases
+     into its cache (already cached cases are reused),
+  2. fine-tunes the current best checkpoint on the new cases plus a replay sample of older ones,
+  3. compares candidate and current model on a fixed hash-based validation split,
+  4. if the candidate is not worse, saves it as best.pt and atomically replaces the published
+     ONNX model, which the Slicer module reloads automatically.
+
+Usage:
+  uv run python train/finetune_daemon.py --data-dir /path/to/exported --work-dir runs/daemon \\
+      --base-checkpoint runs/best.pt --output-onnx /shared/models/landmarks.onnx --mark-existing
+"""
+
+import argparse
+import copy
+import hashlib
+import json
+import os
+import random
+import time
+import traceback
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import torch
+from torch.utils.data import Subset
+
+from dataset import HeatmapDataset, bucket_sampler_for
+from export_onnx import export_model
+from loader_tune import make_loader
+from manifest import build_manifest
+from model import SmallUNet
+from engine import parse_buckets, train_one_epoch, validate
+
+
+def parse_args(argv=None):
+    p = argparse.ArgumentParser()
+    p.add_argument("--data-dir", required=True, help="Export directory to watch (*_image.npy + *_landmarks.json)")
+    p.add_argument("--work-dir", default="runs/daemon", help="Daemon state, preprocessed cache and checkpoint history")
+    p.add_argument("--base-checkpoint", required=True, help="Starting checkpoint (used until the daemon publishes its own best.pt)")
+    p.add_argument("--output-onnx", required=True, help="Published ONNX path (the model path set in Slicer)")
+    p.add_argument("--poll-interval", type=float, default=60.0, help="Seconds between directory scans")
+    p.add_argument("--settle-seconds", type=float, default=10.0, help="Ignore cases whose files changed more recently (export still in progress)")
+    p.add_argument("--min-new-cases", type=int, default=5, help="New cases needed to start a fine-tuning round")
+    p.add_argument("--replay-ratio", type=float, default=3.0, help="Previously seen training cases replayed per new case")
+    p.add_argument("--val-fraction", type=float, default=0.1, help="Fraction of cases (by case-id hash, stable over time) held out for validation")
+    p.add_argument("--epochs", type=int, default=3, help="Fine-tuning epochs per round")
+    p.add_argument("--lr", type=float, default=1e-4)
+    p.add_argument("--batch-size", type=int, default=4)
+    p.add_argument("--num-workers", type=int, default=0)
+    p.add_argument("--threads", type=int, default=8, help="Threads for manifest scanning and preprocessing")
+    p.add_argument("--mark-existing", action="store_true", help="On first start, treat cases already present as seen by the base checkpoint")
+    p.add_argument("--once", action="store_true", help="Run a single scan/round and exit")
+    p.add_argument("--device", default="cuda" if torch.cuda.is_available() else "cpu")
+    p.add_argument("--seed", type=int, default=0)
+    return p.parse_args(argv)
+
+
+def is_val_case(case_id: str, val_fraction: float) -> bool:
+    """Stable hash split: a case never moves between train and val as the dataset grows."""
+    return int(hashlib.sha1(case_id.encode()).hexdigest()[:8], 16) % 10000 < val_fraction * 10000
+
+
+def _atomic_json(path: Path, data: Dict):
+    tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    with open(tmp, "w", encoding="utf-8") as fp:
+        json.dump(data, fp, indent=2)
+    os.replace(tmp, path)
+
+
+def load_state(work_dir: Path) -> Optional[Dict]:
+    path = work_dir / "state.json"
+    if not path.exists():
+        return None
+    with open(path, "r", encoding="utf-8") as fp:
+        return json.load(fp)
+
+
+def _settled_cases(data_dir: str, manifest: Dict, settle_seconds: float) -> List[Dict]:
+    now = time.time()
+    out = []
+    for case in manifest["cases"]:
+        mtimes = [os.path.getmtime(os.path.join(data_dir, case[k])) for k in ("npy", "json")]
+        if now - max(mtimes) >= settle_seconds:
+            out.append(case)
+    return out
+
+
+def publish_onnx(model, ckpt_config: Dict, output: Path, version: str):
+    """Export next to `output` and rename over it, so readers only ever see a complete file."""
+    h, w = ckpt_config.get("resize", (512, 512))
+    buckets = parse_buckets(ckpt_config.get("buckets"))
+    output.parent.mkdir(parents=True, exist_ok=True)
+    tmp = output.with_name(f".{output.stem}.{os.getpid()}.tmp.onnx")
+    export_model(model, tmp, h, w, dynamic_hw=bool(buckets), input_shapes=buckets, metadata={"model_version": version})
+    os.replace(tmp, output)
+
+
+def run_round(args, state: Dict, log=print) -> Optional[Dict]:
+    """One scan; fine-tunes and publishes if enough new cases arrived. Returns the round summary or None."""
+    work_dir = Path(args.work_dir)
+    manifest = build_manifest(args.data_dir, args.threads)
+    for rejected in manifest["rejected"]:
+        if rejected["case_id"] not in state["rejected"]:
+            log(f"  skipping {rejected['case_id']}: {'; '.join(rejected['errors'])}")
+            state["rejected"].append(rejected["case_id"])
+    manifest["cases"] = _settled_cases(args.data_dir, manifest, args.settle_seconds)
+    seen = set(state["seen"])
+    new_ids = [c["case_id"] for c in manifest["cases"] if c["case_id"] not in seen]
+    if len(new_ids) < args.min_new_cases:
+        return None
+
+    manifest_path = work_dir / "manifest.json"
+    _atomic_json(manifest_path, manifest)
+    best_path = work_dir / "best.pt"
+    ckpt = torch.load(best_path if best_path.exists() else args.base_checkpoint, map_location="cpu")
+    config = ckpt.get("config", {})
+    device = torch.device(args.device)
+
+    dataset = HeatmapDataset(
+        args.data_dir,
+        resize=tuple(config.get("resize", (512, 512))),
+        sigma=config.get("sigma", 3.0),
+        cache_dir=str(work_dir / "cache"),
+        buckets=parse_buckets(config.get("buckets")),
+        manifest=str(manifest_path),
+    )
+    index = {c: i for i, c in enumerate(dataset.case_ids())}
+    # incremental preprocessing: only the new cases are decoded; everything else is already cached
+    dataset.build_cache([index[c] for c in new_ids], num_threads=args.threads)
+
+    val_idx = [i for c, i in index.items() if is_val_case(c, args.val_fraction)]
+    new_train = [index[c] for c in new_ids if not is_val_case(c, args.val_fraction)]
+    old_train = [index[c] for c in sorted(seen) if c in index and not is_val_case(c, args.val_fraction)]
+    rng = random.Random(args.seed + state["round"])
+    replay = rng.sample(old_train, min(len(old_train), int(round(args.replay_ratio * len(new_train)))))
+    state["seen"] = sorted(seen | set(new_ids))
+    if not new_train:
+        log(f"  {len(new_ids)} new cases, all in the validation split; nothing to train on")
+        return None
+
+    train_set = Subset(dataset, new_train + replay)
+    train_loader = make_loader(
+        train_set, args.batch_size, True, args.num_workers, device,
+        batch_sampler=bucket_sampler_for(train_set, args.batch_size, True, args.seed + state["round"]),
+    )
+    incumbent = SmallUNet.from_checkpoint(ckpt).to(device)
+    model = SmallUNet.from_checkpoint(ckpt).to(device)
+    sigma = config.get("sigma", 3.0)
+
+    val_before = val_after = None
+    if val_idx:
+        val_set = Subset(dataset, val_idx)
+        val_loader = make_loader(
+            val_set, args.batch_size, False, args.num_workers, device,
+            batch_sampler=bucket_sampler_for(val_set, args.batch_size, False),
+        )
+        val_before = validate(incumbent, val_loader, device, sigma=sigma)
+
+    optimizer = torch.optim.AdamW(model.parameters(), lr=args.lr)
+    for epoch in range(1, args.epochs + 1):
+        loss = train_one_epoch(model, train_loader, optimizer, device, sigma=sigma)
+        log(f"  round {state['round'] + 1} epoch {epoch}/{args.epochs}: train {loss:.4f}")
+    if val_idx:
+        val_after = validate(model, val_loader, device, sigma=sigma)
+
+    state["round"] += 1
+    summary = {
+        "round": state["round"],
+        "new_cases": len(new_ids),
+        "replay_cases": len(replay),
+        "val_cases": len(val_idx),
+        "val_before": val_before,
+        "val_after": val_after,
+        "published": False,
+    }
+    if val_after is not None and val_after > val_before:
+        log(f"  round {state['round']}: val {val_before:.5f} -> {val_after:.5f}, keeping the current model")
+        return summary
+
+    version = f"round{state['round']:04d}-{time.strftime('%Y%m%dT%H%M%S')}"
+    new_ckpt = {
+        "epoch": ckpt.get("epoch", 0),
+        "model_state": model.state_dict(),
+        "val_loss": val_after,
+        "config": config,
+        "finetune": summary,
+        "model_version": version,
+    }
+    history = work_dir / "checkpoints"
+    history.mkdir(parents=True, exist_ok=True)
+    torch.save(new_ckpt, history / f"{version}.pt")
+    tmp = work_dir / f"best.pt.{os.getpid()}.tmp"
+    torch.save(new_ckpt, tmp)
+    os.replace(tmp, best_path)
+    model.eval()
+    publish_onnx(model.cpu(), config, Path(args.output_onnx), version)
+    summary["published"] = True
+    summary["model_version"] = version
+    val_msg = f"val {val_before:.5f} -> {val_after:.5f}" if val_after is not None else "no validation cases yet"
+    log(f"  round {state['round']}: {val_msg}; published {version} to {args.output_onnx}")
+    return summary
+
+
+def main():
+    args = parse_args()
+    work_dir = Path(args.work_dir)
+    work_dir.mkdir(parents=True, exist_ok=True)
+    state = load_state(work_dir)
+    if state is None:
+        state = {"round": 0, "seen": [], "rejected": [], "history": []}
+        if args.mark_existing:
+            state["seen"] = [c["case_id"] for c in build_manifest(args.data_dir, args.threads)["cases"]]
+            print(f"Marked {len(state['seen'])} existing cases as seen")
+        _atomic_json(work_dir / "state.json", state)
+
+    print(f"Watching {args.data_dir} every {args.poll_interval:.0f} s (min {args.min_new_cases} new cases per round)")
+    while True:
+        try:
+            # work on a copy so a failed round leaves its cases unseen and retried next scan
+            new_state = copy.deepcopy(state)
+            summary = run_round(args, new_state)
+            if summary is not None:
+                new_state["history"].append(summary)
+            _atomic_json(work_dir / "state.json", new_state)
+            state = new_state
+        except Exception:
+            # keep the daemon alive (e.g. a half-written export); the next scan retries
+            traceback.print_exc()
+        if args.once:
+            break
+        time.sleep(args.poll_interval)
+
+
+if __name__ == "__main__":
+    main()
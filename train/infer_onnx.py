@@ -7,15 +7,18 @@ Usage:
 import argparse
 import json
 import os
+import sys
 from pathlib import Path
 
 import numpy as np
-import onnxruntime as ort
 import torch
 import torch.nn.functional as F
 
 from dataset import LANDMARK_ORDER, _percentile_clip_norm
 
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "SagittalMeasureAssist" / "lib"))
+from ort_profile import create_session  # noqa: E402
+
 
 def parse_args():
     p = argparse.ArgumentParser()
@@ -48,11 +51,14 @@ def postprocess_heatmaps(hm: np.ndarray):
 
 def main():
     args = parse_args()
-    ort_sess = ort.InferenceSession(args.model, providers=["CPUExecutionProvider"])
+    # SessionOptions come from the profile saved by autotune_ort.py, if any
+    ort_sess, options = create_session(args.model)
+    if options is not None:
+        print(f"ORT profile: {options}")
 
     img_np = np.load(args.image)
     inp_t = preprocess(img_np, args.resize)
-    ort_out = ort_sess.run(None, {"image": inp_t.numpy()})
+    ort_out = ort_sess.run(None, {"image": inp_t.unsqueeze(0).numpy()})  # (1,1,H,W)
     coords = postprocess_heatmaps(ort_out[0])
 
     print("Predicted coords (x,y):")
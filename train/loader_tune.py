@@ -0,0 +1,221 @@
+"""
+DataLoader construction and throughput autotuning for train.py.
+Benchmarks worker count / prefetch / batch size against the real dataset and
+model step, and keeps only configurations that fit a memory budget.
+"""
+
+import copy
+import itertools
+import math
+import os
+import time
+from typing import Dict, Optional, Sequence
+
+import torch
+from torch.utils.data import DataLoader
+
+
+def make_loader(dataset, batch_size, shuffle, num_workers, device, prefetch_factor=2, batch_sampler=None):
+    """DataLoader with pinned memory on CUDA and persistent workers (not re-spawned every epoch)."""
+    kwargs = {
+        "num_workers": num_workers,
+        "pin_memory": torch.device(device).type == "cuda",
+    }
+    if num_workers > 0:
+        kwargs["persistent_workers"] = True
+        kwargs["prefetch_factor"] = prefetch_factor
+    if batch_sampler is not None:
+        return DataLoader(dataset, batch_sampler=batch_sampler, **kwargs)
+    return DataLoader(dataset, batch_size=batch_size, shuffle=shuffle, **kwargs)
+
+
+def _batch_bytes(batch) -> int:
+    return sum(v.numel() * v.element_size() for v in batch.values() if torch.is_tensor(v))
+
+
+def probe_step_memory(model, image: torch.Tensor) -> int:
+    """
+    Rough peak bytes of one training step for `image` (B,1,H,W): tensors saved for backward
+    during the forward (measured with saved_tensors_hooks, so activation checkpointing is
+    reflected) plus parameters, gradients and two AdamW moments.
+    """
+    saved = [0]
+
+    def _pack(t):
+        saved[0] += t.numel() * t.element_size()
+        return t
+
+    was_training = model.training
+    model.train()
+    try:
+        with torch.autograd.graph.saved_tensors_hooks(_pack, lambda t: t):
+            out = model(image)
+        out_bytes = out.numel() * out.element_size()
+        del out
+    finally:
+        model.train(was_training)
+    param_bytes = sum(p.numel() * p.element_size() for p in model.parameters())
+    return saved[0] + 2 * out_bytes + 4 * param_bytes
+
+
+def _saved_bytes_by_block(model, image: torch.Tensor, names) -> Dict[str, int]:
+    """Bytes saved for backward inside each named child block (one forward without checkpointing)."""
+    saved = {name: 0 for name in names}
+    current = []
+    hooks = []
+
+    def _enter(name):
+        def hook(module, args):
+            current.append(name)
+
+        return hook
+
+    def _leave(module, args, output):
+        current.pop()
+
+    for name in names:
+        block = getattr(model, name)
+        hooks.append(block.register_forward_pre_hook(_enter(name)))
+        hooks.append(block.register_forward_hook(_leave))
+
+    def _pack(t):
+        if current:
+            saved[current[-1]] += t.numel() * t.element_size()
+        return t
+
+    level = model.checkpoint_level
+    was_training = model.training
+    model.set_checkpointing(0)
+    model.train()
+    try:
+        with torch.autograd.graph.saved_tensors_hooks(_pack, lambda t: t):
+            model(image)
+    finally:
+        for h in hooks:
+            h.remove()
+        model.set_checkpointing(level)
+        model.train(was_training)
+    return saved
+
+
+def plan_memory(model, sample, batch_size: int, memory_budget_mb: float, min_micro_batch: int = 2) -> Dict:
+    """
+    Pick the activation-checkpointing level and micro-batch size for `batch_size` samples per
+    optimiser step within `memory_budget_mb`, from peak-memory probes at micro-batch 1 and 2.
+
+    Per level: probe_step_memory (saved tensors outside checkpointed blocks, parameters and
+    optimizer state) plus the largest checkpointed block, which backward recomputes one at a
+    time, plus the batch itself. The lowest level that fits a micro-batch of at least
+    min(batch_size, min_micro_batch) wins (recomputation costs time; BatchNorm wants >1 sample),
+    otherwise the level that fits the largest micro-batch. Returns
+    {"checkpoint_level", "micro_batch", "accum_steps", "est_mem_mb"}; model keeps its own level.
+    """
+    budget = memory_budget_mb * 1024 * 1024
+    image = sample["image"].unsqueeze(0)
+    sample_bytes = _batch_bytes(sample)
+    blocks = model.checkpointed_blocks(max(model.CHECKPOINT_LEVELS))
+    block_bytes = _saved_bytes_by_block(model, image, blocks)
+    original = model.checkpoint_level
+    options = []
+    try:
+        for level in model.CHECKPOINT_LEVELS:
+            model.set_checkpointing(level)
+            one = probe_step_memory(model, image)
+            two = probe_step_memory(model, torch.cat([image, image]))
+            recompute = max((block_bytes[n] for n in model.checkpointed_blocks(level)), default=0)
+            per_sample = (two - one) + recompute + sample_bytes
+            fixed = one - (two - one)
+            micro = min(batch_size, int((budget - fixed) // per_sample)) if budget > fixed else 0
+            options.append((level, micro, fixed + per_sample * max(micro, 1)))
+    finally:
+        model.set_checkpointing(original)
+
+    fitting = [o for o in options if o[1] >= min(batch_size, min_micro_batch)]
+    level, micro, est = fitting[0] if fitting else max(options, key=lambda o: (o[1], -o[0]))
+    if micro < 1:
+        raise RuntimeError(f"One sample does not fit the memory budget ({memory_budget_mb:.0f} MB) even with full checkpointing")
+    return {
+        "checkpoint_level": level,
+        "micro_batch": micro,
+        "accum_steps": math.ceil(batch_size / micro),
+        "est_mem_mb": est / 2**20,
+    }
+
+
+def _time_loader(loader, model, device, steps: int, step_fn) -> float:
+    """Samples/s over `steps` batches, excluding the first (worker start-up, allocator warm-up)."""
+    it = iter(loader)
+    step_fn(model, next(it), device)
+    n = 0
+    start = time.perf_counter()
+    for _ in range(steps):
+        try:
+            batch = next(it)
+        except StopIteration:
+            break
+        step_fn(model, batch, device)
+        n += batch["image"].size(0)
+    if torch.device(device).type == "cuda":
+        torch.cuda.synchronize()
+    elapsed = time.perf_counter() - start
+    return n / elapsed if elapsed > 0 else 0.0
+
+
+def autotune_loader(
+    dataset,
+    model,
+    device,
+    step_fn,
+    batch_sizes: Sequence[int] = (2, 4, 8, 16),
+    worker_options: Optional[Sequence[int]] = None,
+    prefetch_options: Sequence[int] = (2, 4),
+    memory_budget_mb: float = 4096.0,
+    steps: int = 6,
+    batch_sampler_fn=None,
+) -> Dict:
+    """
+    Benchmark loader configurations and return the fastest that fits `memory_budget_mb`:
+    {"batch_size", "num_workers", "prefetch_factor", "samples_per_s", "est_mem_mb"}.
+    `step_fn(model, batch, device)` runs one optimisation step; it is applied to a copy of `model`.
+    `batch_sampler_fn(batch_size)` supplies a batch sampler (e.g. aspect buckets) if batches need one.
+    """
+    if worker_options is None:
+        cpus = os.cpu_count() or 1
+        worker_options = sorted({0, 2, min(4, cpus), min(8, cpus)})
+    bench_model = copy.deepcopy(model).to(device)
+    sample = dataset[0]
+    sample_bytes = _batch_bytes(sample)
+    per_sample_step = probe_step_memory(bench_model, sample["image"].unsqueeze(0).to(device))
+    pin_factor = 2 if torch.device(device).type == "cuda" else 1
+    budget = memory_budget_mb * 1024 * 1024
+
+    # need at least two batches: the first one is excluded from timing
+    batch_sizes = [b for b in batch_sizes if 2 * b <= len(dataset)] or [max(1, len(dataset) // 2)]
+
+    best = None
+    for batch_size, num_workers, prefetch in itertools.product(batch_sizes, worker_options, prefetch_options):
+        if num_workers == 0 and prefetch != prefetch_options[0]:
+            continue  # prefetch_factor is unused without workers
+        in_flight = 1 + (num_workers * prefetch if num_workers > 0 else 0)
+        est = per_sample_step * batch_size + sample_bytes * batch_size * in_flight * pin_factor
+        if est > budget:
+            print(f"  autotune: skip bs={batch_size} workers={num_workers} prefetch={prefetch} (~{est / 2**20:.0f} MB > budget)")
+            continue
+        sampler = batch_sampler_fn(batch_size) if batch_sampler_fn is not None else None
+        loader = make_loader(dataset, batch_size, True, num_workers, device, prefetch_factor=prefetch, batch_sampler=sampler)
+        try:
+            rate = _time_loader(loader, bench_model, device, steps, step_fn)
+        finally:
+            del loader
+        print(f"  autotune: bs={batch_size} workers={num_workers} prefetch={prefetch} -> {rate:.1f} samples/s")
+        if best is None or rate > best["samples_per_s"]:
+            best = {
+                "batch_size": batch_size,
+                "num_workers": num_workers,
+                "prefetch_factor": prefetch,
+                "samples_per_s": rate,
+                "est_mem_mb": est / 2**20,
+            }
+    if best is None:
+        raise RuntimeError(f"No loader configuration fits the memory budget ({memory_budget_mb:.0f} MB)")
+    return best
@@ -0,0 +1,232 @@
+"""
+Header-only dataset manifest builder and validator.
+Reads only the .npy headers (shape/dtype, no pixel data) and parses the landmark JSONs in a
+thread pool, validates every case up front and writes a manifest that HeatmapDataset can load
+instead of listing and probing the directory, so bad cases are reported before training
+instead of failing inside a DataLoader worker mid-epoch.
+
+Usage:
+  uv run python train/manifest.py --data-dir /path/to/exported --output /path/to/exported/manifest.json
+"""
+
+import argparse
+import json
+import math
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Tuple
+
+import numpy as np
+import torch
+
+from dataset import LANDMARK_ORDER, labelled_frame
+from metrics import ANGLE_NAMES, compute_angles
+
+MANIFEST_VERSION = 1
+# Exported angles_deg vs angles recomputed from landmarks_ijk + metadata (deg)
+ANGLE_TOLERANCE_DEG = 0.5
+
+
+def parse_args():
+    p = argparse.ArgumentParser()
+    p.add_argument("--data-dir", required=True, help="Folder with *_image.npy and *_landmarks.json")
+    p.add_argument("--output", help="Manifest path (default: <data-dir>/manifest.json)")
+    p.add_argument("--threads", type=int, default=min(32, (os.cpu_count() or 1) * 4), help="Parallel header/JSON readers")
+    p.add_argument("--strict", action="store_true", help="Exit with status 1 if any case is rejected")
+    return p.parse_args()
+
+
+def read_npy_header(path: str) -> Tuple[Tuple[int, ...], np.dtype]:
+    """(shape, dtype) from the .npy header only; pixel data is never read."""
+    with open(path, "rb") as fp:
+        version = np.lib.format.read_magic(fp)
+        if version == (1, 0):
+            shape, _, dtype = np.lib.format.read_array_header_1_0(fp)
+        else:
+            shape, _, dtype = np.lib.format.read_array_header_2_0(fp)
+    return tuple(int(v) for v in shape), dtype
+
+
+def _ras_xy(meta: Dict, ijk: Tuple[float, float, float]):
+    """RAS (x, y) of an IJK point from the exported ijk_to_ras direction (with spacing) and origin."""
+    m = meta["ijk_to_ras"]
+    origin = meta.get("origin_ras", [0.0, 0.0, 0.0])
+    return [sum(m[r][c] * ijk[c] for c in range(3)) + origin[r] for r in range(2)]
+
+
+def inspect_case(case_id: str, npy_path: str, json_path: str) -> Dict:
+    """
+    Validate one exported case. Returns {"case_id", "npy", "json", "shape", "dtype", "spacing",
+    "errors", "warnings"}; a case with errors would fail (or silently mislabel) in training.
+    """
+    entry = {
+        "case_id": case_id,
+        "npy": os.path.basename(npy_path),
+        "json": os.path.basename(json_path),
+        "errors": [],
+        "warnings": [],
+    }
+    errors, warnings = entry["errors"], entry["warnings"]
+
+    try:
+        full_shape, dtype = read_npy_header(npy_path)
+    except (OSError, ValueError) as exc:
+        errors.append(f"unreadable npy header: {exc}")
+        return entry
+    entry["dtype"] = dtype.str
+    if dtype.kind not in "uif":
+        errors.append(f"unsupported dtype {dtype}")
+    if len(full_shape) == 3:
+        shape = full_shape[1:]
+    elif len(full_shape) == 2:
+        shape = full_shape
+    else:
+        errors.append(f"unsupported image shape {list(full_shape)} (expected (H,W) or (D,H,W))")
+        return entry
+    h, w = shape
+    entry["shape"] = [h, w]
+    if h < 2 or w < 2:
+        errors.append(f"degenerate image shape {list(full_shape)}")
+
+    try:
+        with open(json_path, "r", encoding="utf-8") as fp:
+            meta = json.load(fp)
+    except (OSError, ValueError) as exc:
+        errors.append(f"unreadable json: {exc}")
+        return entry
+
+    if "image_shape" in meta and list(meta["image_shape"]) != list(full_shape):
+        errors.append(f"json image_shape {meta['image_shape']} != npy shape {list(full_shape)}")
+
+    lm = meta.get("landmarks_ijk")
+    if not isinstance(lm, dict):
+        errors.append("missing landmarks_ijk")
+        return entry
+    ijk = {}
+    for name in LANDMARK_ORDER:
+        p = lm.get(name)
+        try:
+            values = (float(p["i"]), float(p["j"]), float(p.get("k", 0.0)))
+        except (TypeError, KeyError, ValueError):
+            errors.append(f"missing or malformed landmark {name}")
+            continue
+        if not all(math.isfinite(v) for v in values):
+            errors.append(f"non-finite coordinate for {name}")
+            continue
+        i, j, k = values
+        # pixel centres are integer indices; allow up to half a pixel outside them
+        if not (-0.5 <= i <= w - 0.5 and -0.5 <= j <= h - 0.5):
+            errors.append(f"{name} ({i:.1f}, {j:.1f}) outside image {w}x{h}")
+        if len(full_shape) == 3 and not (-0.5 <= k <= full_shape[0] - 0.5):
+            warnings.append(f"{name} slice k={k:.1f} outside 0..{full_shape[0] - 1}")
+        ijk[name] = values
+    if len(full_shape) == 3 and full_shape[0] > 1 and ijk:
+        ks = sorted(v[2] for v in ijk.values())
+        if ks[-1] - ks[0] > 0.5:
+            errors.append(f"landmarks are on different frames (k={ks[0]:.1f}..{ks[-1]:.1f})")
+        else:
+            frame = labelled_frame({"landmarks_ijk": {n: {"k": v[2]} for n, v in ijk.items()}}, full_shape[0])
+            warnings.append(f"{full_shape[0]} frames; training uses the labelled frame k={frame}")
+
+    md = meta.get("metadata", {})
+    spacing = md.get("spacing")
+    if spacing is None:
+        warnings.append("no metadata.spacing; mm metrics assume 1.0 mm/px")
+        spacing = [1.0, 1.0]
+    elif len(spacing) < 2 or not all(isinstance(v, (int, float)) and math.isfinite(v) and v > 0 for v in spacing[:2]):
+        errors.append(f"invalid spacing {spacing}")
+        spacing = [1.0, 1.0]
+    entry["spacing"] = [float(v) for v in spacing[:2]]
+
+    flip = meta.get("flip_x_axis")
+    if flip is not None and not isinstance(flip, bool):
+        errors.append(f"flip_x_axis must be true/false, got {flip!r}")
+    # angles_deg were computed at export from RAS points with the flip applied: recomputing them
+    # catches a flip flag or metadata that no longer matches the landmarks
+    if "angles_deg" in meta and "ijk_to_ras" in md and len(ijk) == len(LANDMARK_ORDER) and isinstance(flip, bool):
+        try:
+            pts = [_ras_xy(md, ijk[name]) for name in LANDMARK_ORDER]
+            if flip:
+                pts = [[-x, y] for x, y in pts]
+            recomputed = compute_angles(torch.tensor(pts, dtype=torch.float64)).tolist()
+            for name, value in zip(ANGLE_NAMES, recomputed):
+                stored = meta["angles_deg"].get(name)
+                if stored is None or math.isnan(value):
+                    continue
+                diff = abs((value - float(stored) + 180.0) % 360.0 - 180.0)
+                if diff > ANGLE_TOLERANCE_DEG:
+                    errors.append(
+                        f"angles_deg[{name}]={float(stored):.1f} but landmarks/metadata give {value:.1f} (flip_x_axis={flip})"
+                    )
+        except (TypeError, IndexError, ValueError) as exc:
+            errors.append(f"malformed metadata.ijk_to_ras: {exc}")
+    return entry
+
+
+def discover_cases(data_dir: str) -> Tuple[List[Tuple[str, str, str]], List[Dict]]:
+    """(case_id, npy, json) pairs by filename plus entries for files missing their counterpart."""
+    names = set(os.listdir(data_dir))
+    pairs, orphans = [], []
+    for fname in sorted(names):
+        if fname.endswith("_image.npy"):
+            base = fname[: -len("_image.npy")]
+            if f"{base}_landmarks.json" in names:
+                pairs.append((base, os.path.join(data_dir, fname), os.path.join(data_dir, f"{base}_landmarks.json")))
+            else:
+                orphans.append({"case_id": base, "errors": ["missing _landmarks.json"], "warnings": []})
+        elif fname.endswith("_landmarks.json") and f"{fname[: -len('_landmarks.json')]}_image.npy" not in names:
+            orphans.append({"case_id": fname[: -len("_landmarks.json")], "errors": ["missing _image.npy"], "warnings": []})
+    return pairs, orphans
+
+
+def build_manifest(data_dir: str, num_threads: int = 8) -> Dict:
+    pairs, orphans = discover_cases(data_dir)
+    with ThreadPoolExecutor(max_workers=num_threads) as pool:
+        entries = list(pool.map(lambda p: inspect_case(*p), pairs))
+    return {
+        "version": MANIFEST_VERSION,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "landmarks": list(LANDMARK_ORDER),
+        "cases": [e for e in entries if not e["errors"]],
+        "rejected": [e for e in entries if e["errors"]] + orphans,
+    }
+
+
+def load_manifest(path: str) -> Dict:
+    with open(path, "r", encoding="utf-8") as fp:
+        manifest = json.load(fp)
+    if manifest.get("version") != MANIFEST_VERSION:
+        raise ValueError(f"Unsupported manifest version {manifest.get('version')} in {path}")
+    if manifest.get("landmarks") != list(LANDMARK_ORDER):
+        raise ValueError(f"Manifest {path} was built for landmarks {manifest.get('landmarks')}")
+    return manifest
+
+
+def main():
+    args = parse_args()
+    start = time.perf_counter()
+    manifest = build_manifest(args.data_dir, args.threads)
+    elapsed = time.perf_counter() - start
+    output = args.output or os.path.join(args.data_dir, "manifest.json")
+    tmp = f"{output}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as fp:
+        json.dump(manifest, fp, indent=2)
+    os.replace(tmp, output)
+
+    for e in manifest["cases"]:
+        for w in e["warnings"]:
+            print(f"  warning {e['case_id']}: {w}")
+    for e in manifest["rejected"]:
+        for err in e["errors"]:
+            print(f"  REJECTED {e['case_id']}: {err}")
+    print(
+        f"{len(manifest['cases'])} cases ok, {len(manifest['rejected'])} rejected in {elapsed:.2f} s -> {output}"
+    )
+    if args.strict and manifest["rejected"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+"""
+Vectorized landmark / angle metrics for evaluation.
+Angles follow SagittalMeasureAssist/lib/logic_angles.py, computed on whole batches at once.
+"""
+
+import math
+import sys
+from pathlib import Path
+from typing import Dict, List
+
+import torch
+
+from dataset import LANDMARK_ORDER
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "SagittalMeasureAssist" / "lib"))
+from logic_angles import ANGLE_NAMES  # noqa: E402
+
+_IDX = {name: i for i, name in enumerate(LANDMARK_ORDER)}
+
+
+def decode_heatmaps(heatmaps: torch.Tensor) -> torch.Tensor:
+    """Argmax of every heatmap at once: (N,L,H,W) -> (N,L,2) pixel (x, y)."""
+    n, l, h, w = heatmaps.shape
+    idx = torch.argmax(heatmaps.reshape(n, l, h * w), dim=-1)
+    return torch.stack([idx % w, torch.div(idx, w, rounding_mode="floor")], dim=-1).to(torch.float32)
+
+
+def to_original_pixels(coords: torch.Tensor, scale: torch.Tensor, pad: torch.Tensor) -> torch.Tensor:
+    """Undo pad-resize: coords (N,L,2) in model input space, scale (N,), pad (N,2)."""
+    return (coords - pad.unsqueeze(1)) / scale.view(-1, 1, 1)
+
+
+def _wrap90(ang: torch.Tensor) -> torch.Tensor:
+    ang = torch.where(ang > 90, ang - 180, ang)
+    return torch.where(ang < -90, ang + 180, ang)
+
+
+def _slope_deg(v: torch.Tensor) -> torch.Tensor:
+    return -_wrap90(torch.rad2deg(torch.atan2(v[..., 1], v[..., 0])))
+
+
+def _vertical_deg(v: torch.Tensor) -> torch.Tensor:
+    return _wrap90(torch.rad2deg(torch.atan2(v[..., 0], -v[..., 1])))
+
+
+def _wrap180(ang: torch.Tensor) -> torch.Tensor:
+    return torch.remainder(ang + 180.0, 360.0) - 180.0
+
+
+def compute_angles(coords: torch.Tensor) -> torch.Tensor:
+    """
+    PI/PT/SS/LL (deg) for coords (..., L, 2) in LANDMARK_ORDER; returns (..., 4) in ANGLE_NAMES order.
+    Zero-length vectors give NaN instead of raising.
+    """
+    coords = coords.to(torch.float64)
+    fh = coords[..., _IDX["FH"], :]
+    s1_ant = coords[..., _IDX["S1_ant"], :]
+    s1_post = coords[..., _IDX["S1_post"], :]
+    l1_ant = coords[..., _IDX["L1_ant"], :]
+    l1_post = coords[..., _IDX["L1_post"], :]
+
+    v_s1 = s1_post - s1_ant
+    v_l1 = l1_post - l1_ant
+    v_pelvis = (s1_ant + s1_post) / 2.0 - fh
+
+    ss = _slope_deg(v_s1)
+    pt = _vertical_deg(v_pelvis)
+    ll = _wrap180(ss - _slope_deg(v_l1))
+    norms = torch.linalg.norm(v_pelvis, dim=-1) * torch.linalg.norm(v_s1, dim=-1)
+    cos = ((v_pelvis * v_s1).sum(-1) / norms).clamp(-1.0, 1.0)
+    pi = torch.abs(90.0 - torch.rad2deg(torch.acos(cos)))
+
+    angles = torch.stack([pi, pt, ss, ll], dim=-1)
+    degenerate = (torch.linalg.norm(v_s1, dim=-1) == 0) | (torch.linalg.norm(v_l1, dim=-1) == 0) | (
+        torch.linalg.norm(v_pelvis, dim=-1) == 0
+    )
+    return torch.where(degenerate.unsqueeze(-1), torch.full_like(angles, math.nan), angles)
+
+
+def _stats(values: torch.Tensor) -> Dict[str, float]:
+    values = values[~torch.isnan(values)]
+    if values.numel() == 0:
+        return {"mean": math.nan, "median": math.nan, "p90": math.nan, "max": math.nan}
+    return {
+        "mean": values.mean().item(),
+        "median": values.median().item(),
+        "p90": torch.quantile(values, 0.9).item(),
+        "max": values.max().item(),
+    }
+
+
+class MetricAccumulator:
+    """
+    Collects predicted/ground-truth landmarks (original pixels) and spacing batch by batch;
+    summary() computes radial errors in mm and absolute angle errors over everything at once.
+    Landmarks a batch marks as not visible (batch["visible"], patch crops) count as NaN, and so
+    do the angles that need them. angles=False skips the angle errors altogether (patch-mode
+    validation, where a crop almost never shows all five landmarks).
+    """
+
+    def __init__(self, angles: bool = True):
+        self.angles = angles
+        self.pred: List[torch.Tensor] = []
+        self.gt: List[torch.Tensor] = []
+        self.spacing: List[torch.Tensor] = []
+        self.visible: List[torch.Tensor] = []
+        self.case_ids: List[str] = []
+
+    def update(self, heatmaps: torch.Tensor, batch: Dict):
+        scale = batch["scale"].to(heatmaps.device)
+        pad = batch["pad"].to(heatmaps.device)
+        pred = to_original_pixels(decode_heatmaps(heatmaps), scale, pad)
+        gt = to_original_pixels(batch["coords"].to(heatmaps.device), scale, pad)
+        self.pred.append(pred.cpu())
+        self.gt.append(gt.cpu())
+        self.spacing.append(batch["spacing"].cpu())
+        self.visible.append(batch["visible"].cpu() > 0 if "visible" in batch else torch.ones(pred.shape[:2], dtype=torch.bool))
+        self.case_ids.extend(batch["case_id"])
+
+    def per_case(self) -> Dict[str, torch.Tensor]:
+        pred = torch.cat(self.pred)
+        gt = torch.cat(self.gt)
+        spacing = torch.cat(self.spacing).unsqueeze(1)  # (N,1,2)
+        radial_mm = torch.linalg.norm((pred - gt) * spacing, dim=-1)  # (N,L)
+        visible = torch.cat(self.visible)
+        radial_mm = torch.where(visible, radial_mm, torch.full_like(radial_mm, math.nan))
+        if not self.angles:
+            return {"radial_mm": radial_mm}
+        # angles in physical (mm) space so anisotropic pixels don't skew them
+        diff = _wrap180(compute_angles(pred * spacing) - compute_angles(gt * spacing)).abs()  # (N,4)
+        diff = torch.where(visible.all(dim=1, keepdim=True), diff, torch.full_like(diff, math.nan))
+        return {"radial_mm": radial_mm, "angle_err_deg": diff}
+
+    def summary(self) -> Dict:
+        per_case = self.per_case()
+        radial = per_case["radial_mm"]
+        summary = {
+            "n": radial.shape[0],
+            "mre_mm": radial.nanmean().item(),
+            "landmarks_mm": {name: _stats(radial[:, i]) for i, name in enumerate(LANDMARK_ORDER)},
+        }
+        if self.angles:
+            angles = per_case["angle_err_deg"]
+            summary["angles_deg"] = {name: _stats(angles[:, i].float()) for i, name in enumerate(ANGLE_NAMES)}
+        return summary
+
+
+def format_summary(summary: Dict) -> str:
+    lines = [f"n={summary['n']}  mean radial error {summary['mre_mm']:.2f} mm"]
+    lines.append(f"  {'landmark':<10} {'mean':>7} {'median':>7} {'p90':>7} {'max':>7}  (mm)")
+    for name, st in summary["landmarks_mm"].items():
+        lines.append(f"  {name:<10} {st['mean']:>7.2f} {st['median']:>7.2f} {st['p90']:>7.2f} {st['max']:>7.2f}")
+    if "angles_deg" not in summary:
+        lines.append("  angle metrics skipped (patch-mode validation)")
+        return "\n".join(lines)
+    lines.append(f"  {'angle':<10} {'MAE':>7} {'median':>7} {'p90':>7} {'max':>7}  (deg)")
+    for name, st in summary["angles_deg"].items():
+        lines.append(f"  {name:<10} {st['mean']:>7.2f} {st['median']:>7.2f} {st['p90']:>7.2f} {st['max']:>7.2f}")
+    return "\n".join(lines)
@@ -1,5 +1,24 @@
+import contextlib
+
 import torch
 import torch.nn as nn
+from torch.utils.checkpoint import checkpoint
+
+
+@contextlib.contextmanager
+def _frozen_bn_stats(module: nn.Module):
+    """Recomputing a checkpointed block must not update BatchNorm running stats a second time."""
+    bns = [m for m in module.modules() if isinstance(m, nn.modules.batchnorm._BatchNorm)]
+    saved = [(bn.momentum, None if bn.num_batches_tracked is None else bn.num_batches_tracked.clone()) for bn in bns]
+    for bn in bns:
+        bn.momentum = 0.0
+    try:
+        yield
+    finally:
+        for bn, (momentum, tracked) in zip(bns, saved):
+            bn.momentum = momentum
+            if tracked is not None:
+                bn.num_batches_tracked.copy_(tracked)
 
 
 class ConvBlock(nn.Module):
@@ -37,35 +56,81 @@ class UpBlock(nn.Module):
 class SmallUNet(nn.Module):
     """
     Lightweight UNet for heatmap regression (1ch input -> L heatmaps).
+    Fully convolutional; H and W must be multiples of SIZE_DIVISOR (three 2x poolings).
+    base_width sets the channel count of the first level (doubled at each level); a smaller
+    width gives a cheaper student model for CPU inference.
+
+    checkpoint_level trades compute for memory during training (no effect in eval/export):
+    0 keeps every activation, 1 recomputes the full- and half-resolution blocks (enc1, enc2,
+    up3, up4; most of the activation memory) in backward, 2 recomputes every encoder/decoder block.
     """
 
-    def __init__(self, num_landmarks: int):
+    SIZE_DIVISOR = 8
+    CHECKPOINT_LEVELS = (0, 1, 2)
+    _LEVEL1_BLOCKS = ("enc1", "enc2", "up3", "up4")
+
+    @classmethod
+    def check_input_size(cls, height: int, width: int):
+        if height % cls.SIZE_DIVISOR or width % cls.SIZE_DIVISOR:
+            raise ValueError(f"Input size {height}x{width} must be divisible by {cls.SIZE_DIVISOR}")
+
+    @classmethod
+    def from_checkpoint(cls, ckpt):
+        """Rebuild the model saved by train.py (width from the checkpoint config) and load its weights."""
+        state = ckpt["model_state"]
+        model = cls(num_landmarks=state["head.weight"].shape[0], base_width=ckpt.get("config", {}).get("base_width", 32))
+        model.load_state_dict(state)
+        return model
+
+    def __init__(self, num_landmarks: int, base_width: int = 32, checkpoint_level: int = 0):
         super().__init__()
-        self.enc1 = ConvBlock(1, 32)
+        self.set_checkpointing(checkpoint_level)
+        w = base_width
+        self.enc1 = ConvBlock(1, w)
         self.pool1 = nn.MaxPool2d(2)
-        self.enc2 = ConvBlock(32, 64)
+        self.enc2 = ConvBlock(w, 2 * w)
         self.pool2 = nn.MaxPool2d(2)
-        self.enc3 = ConvBlock(64, 128)
+        self.enc3 = ConvBlock(2 * w, 4 * w)
         self.pool3 = nn.MaxPool2d(2)
 
-        self.bottleneck = ConvBlock(128, 256)
+        self.bottleneck = ConvBlock(4 * w, 8 * w)
+
+        self.up2 = UpBlock(8 * w, 4 * w, 4 * w)
+        self.up3 = UpBlock(4 * w, 2 * w, 2 * w)
+        self.up4 = UpBlock(2 * w, w, w)
+
+        self.head = nn.Conv2d(w, num_landmarks, kernel_size=1)
+
+    def set_checkpointing(self, level: int):
+        if level not in self.CHECKPOINT_LEVELS:
+            raise ValueError(f"checkpoint_level must be one of {self.CHECKPOINT_LEVELS}, got {level}")
+        self.checkpoint_level = level
 
-        self.up2 = UpBlock(256, 128, 128)
-        self.up3 = UpBlock(128, 64, 64)
-        self.up4 = UpBlock(64, 32, 32)
+    def checkpointed_blocks(self, level=None):
+        """Names of the blocks recomputed in backward at `level` (default: the current level)."""
+        level = self.checkpoint_level if level is None else level
+        if level >= 2:
+            return ("enc1", "enc2", "enc3", "bottleneck", "up2", "up3", "up4")
+        return self._LEVEL1_BLOCKS if level == 1 else ()
 
-        self.head = nn.Conv2d(32, num_landmarks, kernel_size=1)
+    def _block(self, name, *args):
+        block = getattr(self, name)
+        if self.training and torch.is_grad_enabled() and name in self.checkpointed_blocks():
+            return checkpoint(
+                block, *args, use_reentrant=False, context_fn=lambda: (contextlib.nullcontext(), _frozen_bn_stats(block))
+            )
+        return block(*args)
 
     def forward(self, x):
-        c1 = self.enc1(x)
+        c1 = self._block("enc1", x)
         p1 = self.pool1(c1)
-        c2 = self.enc2(p1)
+        c2 = self._block("enc2", p1)
         p2 = self.pool2(c2)
-        c3 = self.enc3(p2)
+        c3 = self._block("enc3", p2)
         p3 = self.pool3(c3)
 
-        b = self.bottleneck(p3)
-        u2 = self.up2(b, c3)
-        u3 = self.up3(u2, c2)
-        u4 = self.up4(u3, c1)
+        b = self._block("bottleneck", p3)
+        u2 = self._block("up2", b, c3)
+        u3 = self._block("up3", u2, c2)
+        u4 = self._block("up4", u3, c1)
         return self.head(u4)
@@ -0,0 +1,177 @@
+"""
+Active-learning worklist: run the ONNX model over a folder of unlabeled images in large batches,
+score every case by how uncertain its heatmaps look (low peak, strong second peak, wide spread)
+and write a ranked worklist.json that the Slicer module loads, most uncertain case first.
+
+Images are read lazily chunk by chunk, so the folder can be much larger than memory.
+
+Usage:
+  uv run python train/rank_uncertainty.py --model runs/landmarks.onnx --input-dir /path/to/unlabeled \\
+      --output /path/to/unlabeled/worklist.json --batch-size 32
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from dataset import LANDMARK_ORDER
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "SagittalMeasureAssist" / "lib"))
+from inference_core import (  # noqa: E402
+    choose_input_shape,
+    decode_heatmaps,
+    heatmap_output_name,
+    heatmap_uncertainty,
+    preprocess_slice,
+    to_original_coords,
+    uncertainty_scores,
+)
+from ort_profile import create_session  # noqa: E402
+from worklist import write_worklist  # noqa: E402
+
+
+def parse_args():
+    p = argparse.ArgumentParser()
+    p.add_argument("--model", required=True, help="ONNX model path")
+    p.add_argument("--input-dir", required=True, help="Folder of unlabeled images (*.npy, (H,W) or (D,H,W))")
+    p.add_argument("--output", help="Worklist path (default: <input-dir>/worklist.json)")
+    p.add_argument("--resize", type=int, nargs=2, default=(512, 512), metavar=("H", "W"), help="Input size for dynamic-H/W models")
+    p.add_argument("--batch-size", type=int, default=32, help="Images per session.run")
+    p.add_argument("--chunk-batches", type=int, default=4, help="Batches loaded and preprocessed ahead at a time (bounds memory)")
+    p.add_argument("--threads", type=int, default=os.cpu_count() or 1, help="Threads for loading and preprocessing")
+    p.add_argument("--skip-labeled", action="store_true", help="Skip images that already have a *_landmarks.json next to them")
+    return p.parse_args()
+
+
+def discover_images(input_dir: str, skip_labeled: bool = False) -> List[Dict]:
+    """
+    One entry per *.npy. Slicer exports (<case>_image.npy) map to case id <case> and pick up
+    the sibling <case>_volume.nrrd, which the Slicer module loads instead to keep the geometry.
+    """
+    names = set(os.listdir(input_dir))
+    cases = []
+    for fname in sorted(names):
+        if not fname.endswith(".npy"):
+            continue
+        stem = fname[: -len(".npy")]
+        case_id = stem[: -len("_image")] if stem.endswith("_image") else stem
+        if skip_labeled and f"{case_id}_landmarks.json" in names:
+            continue
+        volume = f"{case_id}_volume.nrrd"
+        cases.append({"case_id": case_id, "image": fname, "volume": volume if volume in names else None})
+    return cases
+
+
+def _load_and_preprocess(path: str, input_hw_for):
+    img = np.load(path, mmap_mode="r")
+    if img.ndim == 3:
+        img = img[0]
+    if img.ndim != 2:
+        raise ValueError(f"unsupported image shape {img.shape} in {path}")
+    img = np.asarray(img)
+    padded, scale, pad_x, pad_y = preprocess_slice(img, input_hw_for(img.shape))
+    return padded, (scale, pad_x, pad_y)
+
+
+def score_chunk(session, input_name: str, output_name: str, inputs: List[np.ndarray], params, batch_size: int) -> List[Dict]:
+    """Run one chunk grouped by input shape; returns per-case scores, stats and predicted IJ points."""
+    results: List[Optional[Dict]] = [None] * len(inputs)
+    groups: Dict = {}
+    for i, inp in enumerate(inputs):
+        groups.setdefault(inp.shape, []).append(i)
+    for shape, indices in groups.items():
+        for start in range(0, len(indices), batch_size):
+            idx = indices[start : start + batch_size]
+            batch = np.stack([inputs[i] for i in idx])[:, np.newaxis]
+            heatmaps = session.run([output_name], {input_name: batch})[0]
+            stats = heatmap_uncertainty(heatmaps)
+            per_landmark = uncertainty_scores(stats, shape)
+            coords = decode_heatmaps(heatmaps)
+            for b, i in enumerate(idx):
+                worst = int(np.argmax(per_landmark[b]))
+                results[i] = {
+                    "score": round(float(per_landmark[b].mean()), 4),
+                    "worst_landmark": LANDMARK_ORDER[worst],
+                    "landmarks": {
+                        name: {
+                            "score": round(float(per_landmark[b, l]), 4),
+                            "peak": round(float(stats["peak"][b, l]), 4),
+                            "second_ratio": round(float(stats["second_ratio"][b, l]), 4),
+                            "spread_px": round(float(stats["spread"][b, l]), 2),
+                        }
+                        for l, name in enumerate(LANDMARK_ORDER)
+                    },
+                    "predicted_ij": [[round(x, 2), round(y, 2)] for x, y in to_original_coords(coords[b], *params[i])],
+                }
+    return results
+
+
+def main():
+    args = parse_args()
+    output = args.output or os.path.join(args.input_dir, "worklist.json")
+    session, options = create_session(args.model)
+    if options is not None:
+        print(f"ORT profile: {options}")
+    input_name = session.get_inputs()[0].name
+    output_name = heatmap_output_name(session)
+    input_shape = session.get_inputs()[0].shape
+    dynamic_hw = not all(isinstance(d, int) for d in input_shape[2:4])
+    target_hw = tuple(args.resize) if dynamic_hw else tuple(input_shape[2:4])
+    meta = session.get_modelmeta().custom_metadata_map
+    candidates = [tuple(s) for s in json.loads(meta["input_shapes"])] if "input_shapes" in meta else None
+
+    def input_hw_for(image_hw):
+        return choose_input_shape(image_hw, target_hw, candidates, dynamic_hw)
+
+    cases = discover_images(args.input_dir, args.skip_labeled)
+    if not cases:
+        sys.exit(f"No *.npy images found in {args.input_dir}")
+    out_dir = os.path.dirname(os.path.abspath(output))
+    chunk = args.batch_size * args.chunk_batches
+    entries, failed = [], []
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.threads) as pool:
+        for begin in range(0, len(cases), chunk):
+            part = cases[begin : begin + chunk]
+            paths = [os.path.join(args.input_dir, c["image"]) for c in part]
+            futures = [pool.submit(_load_and_preprocess, p, input_hw_for) for p in paths]
+            loaded, ok = [], []
+            for case, path, fut in zip(part, paths, futures):
+                try:
+                    loaded.append(fut.result())
+                    ok.append(case)
+                except (OSError, ValueError) as exc:
+                    failed.append(case["case_id"])
+                    print(f"  skipping {case['case_id']}: {exc}")
+            if not ok:
+                continue
+            scored = score_chunk(session, input_name, output_name, [l[0] for l in loaded], [l[1] for l in loaded], args.batch_size)
+            for case, result in zip(ok, scored):
+                # paths relative to the worklist, so the folder can be moved or shared as a whole
+                entry = {"case_id": case["case_id"], "image": os.path.relpath(os.path.join(args.input_dir, case["image"]), out_dir)}
+                if case["volume"]:
+                    entry["volume"] = os.path.relpath(os.path.join(args.input_dir, case["volume"]), out_dir)
+                entries.append({**entry, **result})
+            print(f"  {min(begin + chunk, len(cases))}/{len(cases)} images scored")
+    elapsed = time.perf_counter() - start
+
+    write_worklist(
+        output,
+        entries,
+        model_path=os.path.abspath(args.model),
+        extra={"created": time.strftime("%Y-%m-%dT%H:%M:%S"), "landmarks": list(LANDMARK_ORDER), "failed": failed},
+    )
+    print(f"Ranked {len(entries)} images in {elapsed:.1f} s ({len(entries) / max(elapsed, 1e-9):.1f} img/s) -> {output}")
+    for entry in sorted(entries, key=lambda e: e["rank"])[:10]:
+        print(f"  #{entry['rank']:<4} {entry['case_id']:<24} score {entry['score']:.3f}  worst {entry['worst_landmark']}")
+
+
+if __name__ == "__main__":
+    main()
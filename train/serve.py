@@ -0,0 +1,457 @@
+"""
+Local HTTP inference service with dynamic micro-batching.
+One process holds the InferenceSession; PACS-side tools and scripts POST images and get
+landmark coordinates and angles back, instead of each loading its own session.
+
+Concurrent requests are preprocessed in a thread pool and queued; a single batcher takes up
+to --max-batch-size of them (waiting at most --max-wait-ms after the first) and runs them
+through one session.run per input shape. Standard library only (asyncio streams, HTTP/1.1
+with one request per connection).
+
+Endpoints:
+  POST /predict   body: .npy or .nrrd bytes (application/octet-stream), or JSON
+                  {"path": "/path/to/image.npy|.nrrd", "spacing": [sx, sy], "flip_x_axis": false}
+                  query (binary bodies): ?spacing=0.2,0.2&flip_x_axis=1
+                  -> {"landmarks_ij", "angles_deg", "model_version", "batch_size", "timing_ms"}
+  GET  /metrics   request/batch counters, queue depth and latency percentiles
+  GET  /health
+
+Usage:
+  uv run python train/serve.py --model runs/best.onnx --port 8765
+  curl --data-binary @case001_image.npy "http://127.0.0.1:8765/predict?spacing=0.15,0.15"
+"""
+
+import argparse
+import asyncio
+import collections
+import gzip
+import io
+import json
+import math
+import os
+import re
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+import numpy as np
+
+from dataset import LANDMARK_ORDER
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "SagittalMeasureAssist" / "lib"))
+from inference_core import choose_input_shape, decode_heatmaps, heatmap_output_name, preprocess_slice, to_original_coords  # noqa: E402
+from logic_angles import ANGLE_NAMES, compute_angles_from_points  # noqa: E402
+from ort_profile import create_session  # noqa: E402
+
+MAX_BODY_BYTES = 1 << 30
+_REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed", 413: "Payload Too Large", 500: "Internal Server Error"}
+
+
+def parse_args(argv=None):
+    p = argparse.ArgumentParser()
+    p.add_argument("--model", required=True, help="ONNX model path")
+    p.add_argument("--host", default="127.0.0.1")
+    p.add_argument("--port", type=int, default=8765)
+    p.add_argument("--resize", type=int, nargs=2, default=(512, 512), metavar=("H", "W"), help="Input size for dynamic-H/W models")
+    p.add_argument("--max-batch-size", type=int, default=8, help="Requests per session.run")
+    p.add_argument("--max-wait-ms", type=float, default=10.0, help="How long the first queued request waits for others")
+    p.add_argument("--threads", type=int, default=os.cpu_count() or 1, help="Threads for decoding and preprocessing payloads")
+    return p.parse_args(argv)
+
+
+# --- payloads ---
+
+_NRRD_DTYPES = {
+    "uchar": "u1", "unsigned char": "u1", "uint8": "u1", "uint8_t": "u1",
+    "signed char": "i1", "int8": "i1", "int8_t": "i1",
+    "short": "i2", "short int": "i2", "signed short": "i2", "int16": "i2", "int16_t": "i2",
+    "ushort": "u2", "unsigned short": "u2", "uint16": "u2", "uint16_t": "u2",
+    "int": "i4", "signed int": "i4", "int32": "i4", "int32_t": "i4",
+    "uint": "u4", "unsigned int": "u4", "uint32": "u4", "uint32_t": "u4",
+    "float": "f4", "double": "f8",
+}
+
+
+def _nrrd_vector(text: str) -> Optional[List[float]]:
+    text = text.strip()
+    if text == "none":
+        return None
+    values = [float(v) for v in text.strip("()").split(",")]
+    return (values + [0.0, 0.0, 0.0])[:3]
+
+
+def read_nrrd(data: bytes) -> Tuple[np.ndarray, Dict]:
+    """
+    Minimal NRRD reader (attached data, raw or gzip encoding), enough for volumes saved by Slicer.
+    Returns (array in (k, j, i) order like slicer.util.arrayFromVolume, geometry) where geometry
+    has "ijk_to_ras" (3x3, spacing included) and "origin_ras".
+    """
+    if not data.startswith(b"NRRD"):
+        raise ValueError("not an NRRD file")
+    end = data.find(b"\n\n")
+    if end < 0:
+        raise ValueError("NRRD header is not terminated")
+    fields = {}
+    for line in data[:end].decode("ascii", errors="replace").splitlines()[1:]:
+        if line.startswith("#") or ":" not in line:
+            continue
+        key, _, value = line.partition(":")
+        fields[key.strip().lower()] = value.lstrip("=").strip()
+    if "data file" in fields or "datafile" in fields:
+        raise ValueError("detached NRRD data files are not supported")
+    try:
+        dtype = np.dtype(_NRRD_DTYPES[fields["type"].lower()])
+        sizes = [int(v) for v in fields["sizes"].split()]
+    except KeyError as exc:
+        raise ValueError(f"unsupported or missing NRRD field {exc}") from exc
+    if dtype.itemsize > 1:
+        dtype = dtype.newbyteorder(">" if fields.get("endian", "little") == "big" else "<")
+    payload = data[end + 2 :]
+    encoding = fields.get("encoding", "raw").lower()
+    if encoding in ("gzip", "gz"):
+        payload = gzip.decompress(payload)
+    elif encoding != "raw":
+        raise ValueError(f"unsupported NRRD encoding {encoding}")
+    count = int(np.prod(sizes))
+    array = np.frombuffer(payload, dtype=dtype, count=count).reshape(sizes[::-1])
+
+    dims = len(sizes)
+    directions = None
+    if "space directions" in fields:
+        vectors = [_nrrd_vector(v) for v in re.findall(r"\([^)]*\)|none", fields["space directions"])]
+        directions = [v for v in vectors if v is not None]
+    if not directions:
+        spacings = [float(v) for v in fields.get("spacings", " ".join(["1"] * dims)).split()]
+        directions = [[spacings[a] if r == a else 0.0 for r in range(3)] for a in range(min(dims, 3))]
+    while len(directions) < 3:
+        directions.append([0.0, 0.0, 1.0])
+    origin = _nrrd_vector(fields["space origin"]) if "space origin" in fields else [0.0, 0.0, 0.0]
+    # columns = IJK axes in space coordinates; LPS spaces are flipped to RAS like Slicer does
+    ijk_to_ras = [[directions[c][r] for c in range(3)] for r in range(3)]
+    if fields.get("space", "").lower() in ("left-posterior-superior", "lps"):
+        ijk_to_ras = [[-v for v in ijk_to_ras[0]], [-v for v in ijk_to_ras[1]], ijk_to_ras[2]]
+        origin = [-origin[0], -origin[1], origin[2]]
+    return array, {"ijk_to_ras": ijk_to_ras, "origin_ras": list(origin)}
+
+
+def _default_geometry(spacing) -> Dict:
+    """A film without geometry is placed as Slicer places an LPS image: RAS x = -i*sx, y = -j*sy."""
+    sx, sy = spacing
+    return {"ijk_to_ras": [[-sx, 0.0, 0.0], [0.0, -sy, 0.0], [0.0, 0.0, 1.0]], "origin_ras": [0.0, 0.0, 0.0]}
+
+
+def load_payload(body: bytes, content_type: str, query: Dict) -> Tuple[np.ndarray, Dict, bool]:
+    """Decode a request into (2D image, geometry, flip_x_axis)."""
+    options = {k: v[-1] for k, v in query.items()}
+    if content_type.startswith("application/json"):
+        request = json.loads(body)
+        path = request["path"]
+        with open(path, "rb") as fp:
+            body = fp.read()
+        options.update({k: request[k] for k in ("spacing", "flip_x_axis") if k in request})
+    flip = str(options.get("flip_x_axis", "0")).lower() in ("1", "true", "yes")
+    spacing = options.get("spacing", (1.0, 1.0))
+    if isinstance(spacing, str):
+        spacing = [float(v) for v in spacing.split(",")]
+
+    if body.startswith(b"\x93NUMPY"):
+        array = np.load(io.BytesIO(body), allow_pickle=False)
+        geometry = _default_geometry(spacing[:2])
+    elif body.startswith(b"NRRD"):
+        array, geometry = read_nrrd(body)
+    else:
+        raise ValueError("payload is neither .npy nor .nrrd")
+    if array.ndim == 3:
+        array = array[0]
+    if array.ndim != 2:
+        raise ValueError(f"expected an (H,W) or (D,H,W) image, got shape {array.shape}")
+    return array, geometry, flip
+
+
+def landmark_angles(coords_ij, geometry: Dict, flip: bool) -> Dict[str, Optional[float]]:
+    """PI/PT/SS/LL from IJ coordinates through the image geometry, as the Slicer module measures them."""
+    m, origin = geometry["ijk_to_ras"], geometry["origin_ras"]
+    points = {}
+    for name, (i, j) in zip(LANDMARK_ORDER, coords_ij):
+        x = m[0][0] * i + m[0][1] * j + origin[0]
+        y = m[1][0] * i + m[1][1] * j + origin[1]
+        points[name] = (-x if flip else x, y)
+    try:
+        return compute_angles_from_points(points)
+    except ValueError:
+        return {name: None for name in ANGLE_NAMES}
+
+
+# --- batching ---
+
+
+class ServiceMetrics:
+    """Counters plus rolling windows of the most recent latencies for /metrics."""
+
+    def __init__(self, window: int = 1000):
+        self.started = time.time()
+        self.requests = 0
+        self.errors = 0
+        self.batches = 0
+        self.batched_items = 0
+        self.batch_sizes = collections.Counter()
+        self.max_queue_depth = 0
+        self.latency_ms = collections.deque(maxlen=window)
+        self.queue_ms = collections.deque(maxlen=window)
+        self.inference_ms = collections.deque(maxlen=window)
+
+    @staticmethod
+    def _percentiles(values) -> Dict[str, Optional[float]]:
+        if not values:
+            return {"p50": None, "p90": None, "p99": None}
+        p50, p90, p99 = np.percentile(np.fromiter(values, dtype=np.float64), [50, 90, 99])
+        return {"p50": round(float(p50), 3), "p90": round(float(p90), 3), "p99": round(float(p99), 3)}
+
+    def snapshot(self, queue_depth: int) -> Dict:
+        return {
+            "uptime_s": round(time.time() - self.started, 1),
+            "requests_total": self.requests,
+            "errors_total": self.errors,
+            "batches_total": self.batches,
+            "mean_batch_size": round(self.batched_items / self.batches, 3) if self.batches else None,
+            "batch_size_histogram": {str(k): v for k, v in sorted(self.batch_sizes.items())},
+            "queue_depth": queue_depth,
+            "max_queue_depth": self.max_queue_depth,
+            "latency_ms": self._percentiles(self.latency_ms),
+            "queue_wait_ms": self._percentiles(self.queue_ms),
+            "inference_ms": self._percentiles(self.inference_ms),
+        }
+
+
+class MicroBatcher:
+    """
+    Collects preprocessed inputs from concurrent requests and runs them in batches.
+    The first queued item waits at most max_wait_ms for the batch to fill; items whose input
+    shapes differ (aspect buckets / dynamic models) go to separate session.run calls.
+    """
+
+    def __init__(self, session, max_batch_size: int = 8, max_wait_ms: float = 10.0, metrics: Optional[ServiceMetrics] = None):
+        self.session = session
+        self.input_name = session.get_inputs()[0].name
+        self.output_name = heatmap_output_name(session)
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.metrics = metrics or ServiceMetrics()
+        self.queue: Optional[asyncio.Queue] = None
+        # one session.run at a time; ORT parallelises inside the run
+        self._runner = ThreadPoolExecutor(max_workers=1)
+        self._task = None
+
+    def start(self):
+        self.queue = asyncio.Queue()
+        self._task = asyncio.get_running_loop().create_task(self._loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self._runner.shutdown(wait=False)
+
+    async def submit(self, inp: np.ndarray) -> Tuple[np.ndarray, Dict]:
+        """Queue one (H,W) float32 input; returns its decoded (L,2) input-space coords and timing."""
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((inp, future, time.perf_counter()))
+        self.metrics.max_queue_depth = max(self.metrics.max_queue_depth, self.queue.qsize())
+        return await future
+
+    async def _collect(self) -> List:
+        batch = [await self.queue.get()]
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            try:
+                batch.append(self.queue.get_nowait())
+                continue
+            except asyncio.QueueEmpty:
+                pass
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    def _run(self, inputs: List[np.ndarray]) -> np.ndarray:
+        batch = np.stack(inputs)[:, np.newaxis]
+        heatmaps = self.session.run([self.output_name], {self.input_name: batch})[0]
+        return decode_heatmaps(heatmaps)
+
+    async def _loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._collect()
+            groups = collections.OrderedDict()
+            for item in batch:
+                groups.setdefault(item[0].shape, []).append(item)
+            for items in groups.values():
+                started = time.perf_counter()
+                try:
+                    coords = await loop.run_in_executor(self._runner, self._run, [inp for inp, _, _ in items])
+                except Exception as exc:
+                    for _, future, _ in items:
+                        if not future.done():
+                            future.set_exception(exc)
+                    continue
+                elapsed = (time.perf_counter() - started) * 1000.0
+                self.metrics.batches += 1
+                self.metrics.batched_items += len(items)
+                self.metrics.batch_sizes[len(items)] += 1
+                self.metrics.inference_ms.append(elapsed)
+                for (_, future, queued), c in zip(items, coords):
+                    wait = (started - queued) * 1000.0
+                    self.metrics.queue_ms.append(wait)
+                    if not future.done():
+                        future.set_result((c, {"queue": round(wait, 3), "inference": round(elapsed, 3), "batch_size": len(items)}))
+
+
+# --- HTTP ---
+
+
+class InferenceService:
+    def __init__(self, session, target_hw=(512, 512), max_batch_size: int = 8, max_wait_ms: float = 10.0, threads: Optional[int] = None):
+        self.session = session
+        input_shape = session.get_inputs()[0].shape
+        self.dynamic_hw = not all(isinstance(d, int) for d in input_shape[2:4])
+        self.target_hw = tuple(target_hw) if self.dynamic_hw else tuple(input_shape[2:4])
+        meta = session.get_modelmeta().custom_metadata_map
+        self.input_shapes = [tuple(s) for s in json.loads(meta["input_shapes"])] if "input_shapes" in meta else None
+        self.model_version = meta.get("model_version")
+        self.metrics = ServiceMetrics()
+        self.batcher = MicroBatcher(session, max_batch_size, max_wait_ms, self.metrics)
+        self._pool = ThreadPoolExecutor(max_workers=threads)
+        self._server = None
+
+    async def start(self, host: str = "127.0.0.1", port: int = 8765) -> int:
+        """Start serving; returns the bound port (useful with port 0)."""
+        self.batcher.start()
+        self._server = await asyncio.start_server(self._handle, host, port)
+        return self._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+        await self.batcher.stop()
+        self._pool.shutdown(wait=False)
+
+    def _prepare(self, body: bytes, content_type: str, query: Dict):
+        img, geometry, flip = load_payload(body, content_type, query)
+        input_hw = choose_input_shape(img.shape, self.target_hw, self.input_shapes, self.dynamic_hw)
+        padded, scale, pad_x, pad_y = preprocess_slice(img, input_hw)
+        return padded, (scale, pad_x, pad_y), geometry, flip
+
+    async def predict(self, body: bytes, content_type: str, query: Dict) -> Dict:
+        started = time.perf_counter()
+        loop = asyncio.get_running_loop()
+        padded, params, geometry, flip = await loop.run_in_executor(self._pool, self._prepare, body, content_type, query)
+        preprocess_ms = (time.perf_counter() - started) * 1000.0
+        coords, timing = await self.batcher.submit(padded)
+        coords_ij = to_original_coords(coords, *params)
+        total_ms = (time.perf_counter() - started) * 1000.0
+        self.metrics.latency_ms.append(total_ms)
+        return {
+            "landmarks_ij": {name: [round(x, 2), round(y, 2)] for name, (x, y) in zip(LANDMARK_ORDER, coords_ij)},
+            "angles_deg": landmark_angles(coords_ij, geometry, flip),
+            "model_version": self.model_version,
+            "batch_size": timing["batch_size"],
+            "timing_ms": {
+                "preprocess": round(preprocess_ms, 3),
+                "queue": timing["queue"],
+                "inference": timing["inference"],
+                "total": round(total_ms, 3),
+            },
+        }
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            status, payload = await self._dispatch(reader)
+        except Exception as exc:  # never let one bad request take the service down
+            status, payload = 500, {"error": str(exc)}
+        if status != 200:
+            self.metrics.errors += 1
+        body = json.dumps(payload, allow_nan=False).encode()
+        head = (
+            f"HTTP/1.1 {status} {_REASONS.get(status, '')}\r\n"
+            "Content-Type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            "Connection: close\r\n\r\n"
+        )
+        try:
+            writer.write(head.encode() + body)
+            await writer.drain()
+        finally:
+            writer.close()
+
+    async def _dispatch(self, reader: asyncio.StreamReader) -> Tuple[int, Dict]:
+        request_line = (await reader.readline()).decode("latin-1").strip()
+        try:
+            method, target, _ = request_line.split(" ", 2)
+        except ValueError:
+            return 400, {"error": "malformed request line"}
+        headers = {}
+        while True:
+            line = (await reader.readline()).decode("latin-1")
+            if line in ("\r\n", "\n", ""):
+                break
+            key, _, value = line.partition(":")
+            headers[key.strip().lower()] = value.strip()
+        url = urlsplit(target)
+
+        if url.path == "/health":
+            return 200, {"status": "ok", "model_version": self.model_version}
+        if url.path == "/metrics":
+            return 200, self.metrics.snapshot(self.batcher.queue.qsize())
+        if url.path != "/predict":
+            return 404, {"error": f"unknown path {url.path}"}
+        if method != "POST":
+            return 405, {"error": "use POST"}
+
+        length = int(headers.get("content-length", "0"))
+        if length > MAX_BODY_BYTES:
+            return 413, {"error": f"payload larger than {MAX_BODY_BYTES} bytes"}
+        body = await reader.readexactly(length)
+        self.metrics.requests += 1
+        try:
+            result = await self.predict(body, headers.get("content-type", "application/octet-stream"), parse_qs(url.query))
+        except (ValueError, KeyError, OSError) as exc:
+            return 400, {"error": str(exc)}
+        # JSON has no NaN; undefined angles are null
+        result["angles_deg"] = {k: (None if v is None or math.isnan(v) else round(v, 3)) for k, v in result["angles_deg"].items()}
+        return 200, result
+
+
+async def _serve(args):
+    session, options = create_session(args.model)
+    if options is not None:
+        print(f"ORT profile: {options}")
+    service = InferenceService(session, tuple(args.resize), args.max_batch_size, args.max_wait_ms, args.threads)
+    port = await service.start(args.host, args.port)
+    print(f"Serving {args.model} on http://{args.host}:{port} (batch <= {args.max_batch_size}, wait <= {args.max_wait_ms} ms)")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await service.stop()
+
+
+def main(argv=None):
+    try:
+        asyncio.run(_serve(parse_args(argv)))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,269 @@
+"""
+Deterministic synthetic sagittal radiographs for scale and stress testing.
+Writes export-format pairs (<prefix>NNNNNN_image.npy as (1,H,W) uint16 and _landmarks.json with
+landmarks_ijk, metadata, image_shape, angles_deg and flip_x_axis), so every tool that reads Slicer
+exports (dataset, manifest, train/evaluate, finetune_daemon, rank_uncertainty) runs on them unchanged.
+
+Each case draws a plausible geometry in millimetres (sacral slope, pelvic tilt, lordosis,
+vertebral sizes), bends a five-vertebra lumbar arc up from S1, renders vertebral bodies with
+cortical rims, posterior elements, sacrum, femoral heads and soft tissue, then maps it onto a
+film of random aspect ratio and pixel spacing (optionally mirrored). angles_deg are computed
+from the same RAS points the manifest validator recomputes, so they are consistent by
+construction. Case i depends only on (--seed, i): any worker count or --start-index produces
+identical files.
+
+Usage:
+  uv run python train/synth.py --output-dir /data/synth --num-cases 10000 --workers 16
+"""
+
+import argparse
+import json
+import math
+import os
+import time
+from multiprocessing import Pool
+from typing import Dict, Tuple
+
+import numpy as np
+import torch
+
+from dataset import LANDMARK_ORDER
+from metrics import ANGLE_NAMES, compute_angles
+
+
+def parse_args(argv=None):
+    p = argparse.ArgumentParser()
+    p.add_argument("--output-dir", required=True)
+    p.add_argument("--num-cases", type=int, default=100)
+    p.add_argument("--start-index", type=int, default=0, help="First case index (extend a corpus without regenerating it)")
+    p.add_argument("--seed", type=int, default=0)
+    p.add_argument("--max-side", type=int, default=3000, help="Longest film side in pixels (3000 ~ a full-size CR/DR film)")
+    p.add_argument("--mirror-prob", type=float, default=0.5, help="Probability of a patient facing right (flip_x_axis=true)")
+    p.add_argument("--prefix", default="synth")
+    p.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    return p.parse_args(argv)
+
+
+def _rng_for(seed: int, index: int) -> np.random.Generator:
+    return np.random.default_rng(np.random.SeedSequence([seed, index]))
+
+
+def sample_anatomy(rng: np.random.Generator) -> Dict:
+    """
+    Landmarks and shapes in a patient frame (a = anterior mm, s = superior mm, S1 midpoint at 0).
+    The lumbar spine is a circular arc leaving S1 along its endplate normal and turning
+    posteriorly by the lordosis angle before reaching the L1 endplate.
+    """
+    ss = math.radians(rng.uniform(25.0, 50.0))
+    pt = math.radians(rng.uniform(0.0, 30.0))
+    lordosis = math.radians(rng.uniform(30.0, 70.0))
+    s1_width = rng.uniform(38.0, 50.0)
+    pelvis_len = rng.uniform(90.0, 130.0)
+    spine_len = rng.uniform(150.0, 200.0)
+
+    ant_dir = np.array([math.cos(ss), -math.sin(ss)])
+    s1_ant = ant_dir * s1_width / 2.0
+    s1_post = -s1_ant
+    fh = np.array([math.sin(pt), -math.cos(pt)]) * pelvis_len
+
+    # arc: heading theta (from +a) starts perpendicular to the S1 endplate and turns by `lordosis`
+    theta0 = math.pi / 2.0 - ss
+    kappa = lordosis / spine_len
+    segment = spine_len / 5.0
+    vertebrae = []
+    for level in range(5):  # L5 .. L1, centred on the arc
+        t_mid = (level + 0.5) * segment
+        theta = theta0 + kappa * t_mid
+        centre = np.array([math.sin(theta) - math.sin(theta0), math.cos(theta0) - math.cos(theta)]) / kappa
+        vertebrae.append(
+            {
+                "centre": centre,
+                "axis": np.array([math.cos(theta), math.sin(theta)]),  # superior along the spine
+                "height": segment * rng.uniform(0.70, 0.78),
+                "width": s1_width * rng.uniform(0.92, 1.05),
+            }
+        )
+    # L1 superior endplate: half a body height above the L1 centre
+    top = vertebrae[-1]
+    l1_mid = top["centre"] + top["axis"] * top["height"] / 2.0
+    l1_ant_dir = np.array([top["axis"][1], -top["axis"][0]])
+    l1_ant = l1_mid + l1_ant_dir * top["width"] / 2.0
+    l1_post = l1_mid - l1_ant_dir * top["width"] / 2.0
+
+    return {
+        "landmarks": {"L1_ant": l1_ant, "L1_post": l1_post, "S1_ant": s1_ant, "S1_post": s1_post, "FH": fh},
+        "vertebrae": vertebrae,
+        "s1_axis": np.array([math.sin(ss), math.cos(ss)]),
+        "s1_width": s1_width,
+        "head_radius": rng.uniform(20.0, 26.0),
+        # bilateral femoral heads are not superimposed perfectly on a lateral film
+        "head_offset": rng.normal(0.0, 4.0, size=2),
+    }
+
+
+def _soft_box(img, centre, axis, half_len, half_wid, value, edge, rim=0.0):
+    """Add a rotated soft-edged box (long axis `axis`, pixel units) with an optional bright rim."""
+    reach = math.hypot(half_len, half_wid) + 3.0 * edge
+    y0, y1 = max(0, int(centre[1] - reach)), min(img.shape[0], int(centre[1] + reach) + 1)
+    x0, x1 = max(0, int(centre[0] - reach)), min(img.shape[1], int(centre[0] + reach) + 1)
+    if y0 >= y1 or x0 >= x1:
+        return
+    yy = np.arange(y0, y1, dtype=np.float32)[:, None] - np.float32(centre[1])
+    xx = np.arange(x0, x1, dtype=np.float32)[None, :] - np.float32(centre[0])
+    u = xx * np.float32(axis[0]) + yy * np.float32(axis[1])
+    v = xx * np.float32(-axis[1]) + yy * np.float32(axis[0])
+    dist = np.maximum(np.abs(u) - np.float32(half_len), np.abs(v) - np.float32(half_wid))
+    inside = 1.0 / (1.0 + np.exp(dist / np.float32(edge)))
+    out = img[y0:y1, x0:x1]
+    out += np.float32(value) * inside
+    if rim:
+        out += np.float32(rim) * np.exp(-((dist / np.float32(2.0 * edge)) ** 2))
+
+
+def _soft_disc(img, centre, radius, value, edge, rim=0.0):
+    reach = radius + 3.0 * edge
+    y0, y1 = max(0, int(centre[1] - reach)), min(img.shape[0], int(centre[1] + reach) + 1)
+    x0, x1 = max(0, int(centre[0] - reach)), min(img.shape[1], int(centre[0] + reach) + 1)
+    if y0 >= y1 or x0 >= x1:
+        return
+    yy = np.arange(y0, y1, dtype=np.float32)[:, None] - np.float32(centre[1])
+    xx = np.arange(x0, x1, dtype=np.float32)[None, :] - np.float32(centre[0])
+    dist = np.sqrt(xx * xx + yy * yy) - np.float32(radius)
+    out = img[y0:y1, x0:x1]
+    out += np.float32(value) / (1.0 + np.exp(dist / np.float32(edge)))
+    if rim:
+        out += np.float32(rim) * np.exp(-((dist / np.float32(2.0 * edge)) ** 2))
+
+
+def render_case(index: int, seed: int, max_side: int = 3000, mirror_prob: float = 0.5) -> Tuple[np.ndarray, Dict]:
+    """Return ((1,H,W) uint16 image, landmarks JSON dict without case_id) for case `index`."""
+    rng = _rng_for(seed, index)
+    anatomy = sample_anatomy(rng)
+
+    # landmark extent with margins; the film always covers it
+    pts = np.stack(list(anatomy["landmarks"].values()))
+    a_min, a_max = pts[:, 0].min() - 30.0, pts[:, 0].max() + 30.0
+    s_min, s_max = pts[:, 1].min() - 40.0, pts[:, 1].max() + 30.0
+
+    aspect = rng.uniform(0.55, 1.0)  # width / height; portrait lumbar and long films
+    fov_h = max(rng.uniform(320.0, 480.0), s_max - s_min)
+    h = int(rng.integers(max(64, max_side // 2), max_side + 1))
+    spacing = fov_h / h
+    to_px = 1.0 / spacing
+    w = max(32, int(round(h * aspect)), int(math.ceil((a_max - a_min) * to_px)))
+    fov_w = w * spacing
+
+    # place the anatomy (patient faces left: anterior = decreasing i) so every landmark is inside
+    a0 = a_max + rng.uniform(0.0, max(0.0, fov_w - (a_max - a_min)))
+    s0 = s_max + rng.uniform(0.0, max(0.0, fov_h - (s_max - s_min)))
+
+    def px(p):
+        return np.array([(a0 - p[0]) * to_px, (s0 - p[1]) * to_px])
+
+    def px_dir(d):
+        return np.array([-d[0], -d[1]])
+
+    edge = max(0.6, 0.8 * to_px)
+    img = np.empty((h, w), dtype=np.float32)
+    # soft tissue: bright body band with a smooth vertical gradient, darker air at the film edges
+    cols = np.arange(w, dtype=np.float32)
+    body_centre = (a0 - 40.0) * to_px
+    body_half = rng.uniform(130.0, 180.0) * to_px
+    band = 1.0 / (1.0 + np.exp((np.abs(cols - body_centre) - body_half) / (8.0 * to_px)))
+    rows = np.linspace(0.0, 1.0, h, dtype=np.float32)[:, None]
+    img[:] = 250.0 + band[None, :] * (500.0 + 250.0 * rows)
+
+    # iliac wing behind the sacrum and the two femoral heads
+    ilium = px(anatomy["landmarks"]["FH"] * 0.4 + np.array([-30.0, 20.0]))
+    _soft_box(img, ilium, (0.0, 1.0), 70.0 * to_px, 55.0 * to_px, 220.0, 12.0 * to_px, rim=120.0)
+    for sign in (-0.5, 0.5):
+        head = anatomy["landmarks"]["FH"] + sign * anatomy["head_offset"]
+        _soft_disc(img, px(head), anatomy["head_radius"] * to_px, 550.0, edge, rim=300.0)
+
+    # sacrum: a tapering stack below the S1 endplate, tilted with the sacral slope
+    s1_axis = anatomy["s1_axis"]
+    for step, scale in enumerate((1.0, 0.85, 0.7, 0.55)):
+        centre = -s1_axis * (12.0 + 22.0 * step)
+        _soft_box(
+            img, px(centre), px_dir(s1_axis), 10.0 * to_px, anatomy["s1_width"] * scale / 2.0 * to_px, 650.0, edge, rim=250.0
+        )
+
+    # lumbar vertebrae: body with cortical rim plus posterior elements
+    for vert in anatomy["vertebrae"]:
+        axis = vert["axis"]
+        posterior = np.array([-axis[1], axis[0]])
+        _soft_box(
+            img, px(vert["centre"]), px_dir(axis), vert["height"] / 2.0 * to_px, vert["width"] / 2.0 * to_px,
+            rng.uniform(600.0, 800.0), edge, rim=rng.uniform(300.0, 450.0),
+        )
+        arch = vert["centre"] + posterior * (vert["width"] / 2.0 + 18.0)
+        _soft_box(img, px(arch), px_dir(axis), vert["height"] * 0.35 * to_px, 14.0 * to_px, 300.0, 3.0 * edge)
+
+    img += np.float32(25.0) * rng.standard_normal(size=(h, w), dtype=np.float32)
+    np.clip(img, 0.0, 4095.0, out=img)
+    image = img.astype(np.uint16)
+
+    ijk = {name: px(p) for name, p in anatomy["landmarks"].items()}
+    flip = bool(rng.random() < mirror_prob)
+    direction = [[-spacing, 0.0, 0.0], [0.0, -spacing, 0.0], [0.0, 0.0, 1.0]]
+    origin = [a0, s0, 0.0]
+    if flip:
+        # patient faces right: mirror the film but keep the geometry, as the scanner would;
+        # flip_x_axis tells the angle computation to negate RAS x back
+        image = image[:, ::-1]
+        ijk = {name: np.array([w - 1 - p[0], p[1]]) for name, p in ijk.items()}
+
+    # angles from RAS (x, y) exactly as exported by the Slicer module and checked by manifest.py
+    ras = [
+        [direction[0][0] * ijk[name][0] + origin[0], direction[1][1] * ijk[name][1] + origin[1]] for name in LANDMARK_ORDER
+    ]
+    if flip:
+        ras = [[-x, y] for x, y in ras]
+    angles = compute_angles(torch.tensor(ras, dtype=torch.float64)).tolist()
+
+    meta = {
+        "landmarks_ijk": {name: {"i": float(ijk[name][0]), "j": float(ijk[name][1]), "k": 0.0} for name in LANDMARK_ORDER},
+        "metadata": {"spacing": [spacing, spacing, 1.0], "ijk_to_ras": direction, "origin_ras": origin},
+        "image_shape": [1, h, w],
+        "angles_deg": {name: float(v) for name, v in zip(ANGLE_NAMES, angles)},
+        "flip_x_axis": flip,
+        "synthetic": {"seed": seed, "index": index},
+    }
+    return np.ascontiguousarray(image)[np.newaxis], meta
+
+
+def write_case(job) -> Tuple[str, int]:
+    """Render and save one case (runs in a worker process). Returns (case_id, bytes written)."""
+    output_dir, prefix, index, seed, max_side, mirror_prob = job
+    case_id = f"{prefix}{index:06d}"
+    image, meta = render_case(index, seed, max_side, mirror_prob)
+    npy_path = os.path.join(output_dir, f"{case_id}_image.npy")
+    json_path = os.path.join(output_dir, f"{case_id}_landmarks.json")
+    # image first, JSON last: a pair is only picked up once both files exist
+    np.save(npy_path, image)
+    with open(json_path, "w", encoding="utf-8") as fp:
+        json.dump({"case_id": case_id, **meta}, fp, indent=2)
+    return case_id, image.nbytes
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    os.makedirs(args.output_dir, exist_ok=True)
+    jobs = [
+        (args.output_dir, args.prefix, i, args.seed, args.max_side, args.mirror_prob)
+        for i in range(args.start_index, args.start_index + args.num_cases)
+    ]
+    start = time.perf_counter()
+    total_bytes = 0
+    # one process per case is the parallelism; keep torch (angle computation) single-threaded
+    with Pool(processes=args.workers, initializer=torch.set_num_threads, initargs=(1,)) as pool:
+        for done, (_, nbytes) in enumerate(pool.imap_unordered(write_case, jobs, chunksize=4), start=1):
+            total_bytes += nbytes
+            if done % 100 == 0 or done == len(jobs):
+                elapsed = time.perf_counter() - start
+                print(f"  {done}/{len(jobs)} cases, {total_bytes / 2**30:.2f} GiB, {done / elapsed:.1f} cases/s")
+    print(f"Wrote {len(jobs)} cases to {args.output_dir} in {time.perf_counter() - start:.1f} s")
+
+
+if __name__ == "__main__":
+    main()
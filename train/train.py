@@ -4,18 +4,25 @@ Expect data_dir to contain *_image.npy and *_landmarks.json exported from Slicer
 """
 
 import argparse
+import copy
+import json
 import os
+import time
 from pathlib import Path
 
 import torch
-from torch.utils.data import DataLoader
-from tqdm import tqdm
 
-from dataset import HeatmapDataset, LANDMARK_ORDER
+from async_val import AsyncValidator, snapshot_state
+from augment import BatchAugment
+from dataset import HeatmapDataset, LANDMARK_ORDER, PatchHeatmapDataset, bucket_sampler_for
+from distill import build_teacher_cache, load_teacher, teacher_cache_dir
+from engine import parse_buckets, resolution_schedule, train_one_epoch, train_step, validate
+from loader_tune import autotune_loader, make_loader, plan_memory
+from metrics import MetricAccumulator
 from model import SmallUNet
 
 
-def parse_args():
+def parse_args(argv=None):
     p = argparse.ArgumentParser()
     p.add_argument("--data-dir", required=True, help="Folder with *_image.npy and *_landmarks.json (exported from Slicer)")
     p.add_argument("--save-dir", default="runs", help="Where to save checkpoints (best.pt / last.pt)")
@@ -23,80 +30,308 @@ def parse_args():
     p.add_argument("--batch-size", type=int, default=4, help="How many samples processed together in one step (fits GPU/CPU memory)")
     p.add_argument("--lr", type=float, default=1e-3, help="Learning rate (step size for optimization)")
     p.add_argument("--resize", type=int, nargs=2, default=[512, 512], metavar=("H", "W"), help="Target size after aspect-ratio padding")
+    p.add_argument("--buckets", nargs="+", default=None, help="Aspect buckets as HxW (e.g. 512x320 512x384 512x512); each image uses the closest-aspect shape instead of --resize")
+    p.add_argument("--patch-size", type=int, nargs=2, default=None, metavar=("H", "W"), help="Patch mode: train on landmark-centred crops of this size instead of the whole film at --resize")
+    p.add_argument("--patch-scale", type=float, default=1.0, help="Patch mode: resolution of the crops relative to the original film (1.0 native, 0.5 half)")
+    p.add_argument("--patches-per-case", type=int, default=4, help="Patch mode: random crops drawn per case per epoch")
+    p.add_argument("--background-prob", type=float, default=0.2, help="Patch mode: fraction of crops placed anywhere on the film instead of on a landmark")
+    p.add_argument("--patch-jitter", type=float, default=0.5, help="Patch mode: max landmark offset from the crop centre, as a fraction of half the crop")
+    p.add_argument("--resolution-schedule", nargs="+", default=None, metavar="SIZE:EPOCHS", help="Progressive resolution: train the first epochs at smaller inputs, e.g. 256:5 384:5 (longer side, --resize aspect kept; sigma scaled along), then the rest at --resize")
+    p.add_argument("--target-val-loss", type=float, default=None, help="Report the wall time and epoch at which val loss first reaches this value (e.g. a fixed-resolution run's final val)")
     p.add_argument("--sigma", type=float, default=3.0, help="Gaussian sigma (px) for landmark heatmaps; larger spreads targets wider")
     p.add_argument("--num-workers", type=int, default=2, help="Data loading threads (increase if CPU has cores to spare)")
+    p.add_argument("--prefetch-factor", type=int, default=2, help="Batches prefetched per worker")
+    p.add_argument("--autotune-loader", action="store_true", help="Benchmark workers/prefetch/batch size on this machine and use the fastest that fits --loader-memory-budget")
+    p.add_argument("--loader-memory-budget", type=float, default=4096.0, help="Memory budget (MB) for --autotune-loader (step activations + in-flight batches)")
+    p.add_argument("--checkpoint-level", type=int, default=0, choices=SmallUNet.CHECKPOINT_LEVELS, help="Activation checkpointing: 0 off, 1 full/half-resolution blocks, 2 every encoder/decoder block (less memory, more compute)")
+    p.add_argument("--grad-accum", type=int, default=1, help="Micro-batches accumulated per optimiser step (effective batch = batch size x this)")
+    p.add_argument("--memory-budget", type=float, default=None, help="Training memory budget (MB): probe peak memory and choose --checkpoint-level and the micro-batch size so that --batch-size samples per step fit")
     p.add_argument("--device", default="cuda" if torch.cuda.is_available() else "cpu", help="cpu or cuda")
-    return p.parse_args()
-
-
-def train_one_epoch(model, loader, optimizer, device):
-    model.train()
-    total_loss = 0.0
-    for batch in tqdm(loader, desc="train", leave=False):
-        img = batch["image"].to(device)
-        target = batch["heatmap"].to(device)
-        pred = model(img)
-        loss = torch.mean((pred - target) ** 2)
-        optimizer.zero_grad()
-        loss.backward()
-        optimizer.step()
-        total_loss += loss.item() * img.size(0)
-    return total_loss / len(loader.dataset)
-
-
-def validate(model, loader, device):
-    model.eval()
-    total_loss = 0.0
-    with torch.no_grad():
-        for batch in tqdm(loader, desc="val", leave=False):
-            img = batch["image"].to(device)
-            target = batch["heatmap"].to(device)
-            pred = model(img)
-            loss = torch.mean((pred - target) ** 2)
-            total_loss += loss.item() * img.size(0)
-    return total_loss / len(loader.dataset)
+    p.add_argument("--seed", type=int, default=0, help="Seed for the train/val split and weight init")
+    p.add_argument("--manifest", help="Validated dataset manifest from manifest.py (default: list --data-dir)")
+    p.add_argument("--split-manifest", help="JSON with {\"train\": [case ids], \"val\": [case ids]} (e.g. a k-fold manifest); default is a seeded 90/10 split")
+    p.add_argument("--cache-dir", help="Cache normalized+resized images here (shared by runs with the same --resize)")
+    p.add_argument("--eval-metrics", action="store_true", help="Also report landmark error (mm) and PI/PT/SS/LL error (deg) on the val split every epoch")
+    p.add_argument("--async-val", action="store_true", help="Validate each epoch's weight snapshot in background worker processes while training continues; best.pt is chosen as results arrive, in epoch order")
+    p.add_argument("--val-workers", type=int, default=1, help="--async-val: validation worker processes")
+    p.add_argument("--val-threads", type=int, default=1, help="--async-val: torch threads per validation worker (leave the rest to training)")
+    p.add_argument("--val-device", help="--async-val: device for validation workers (default: --device)")
+    p.add_argument("--max-pending-val", type=int, default=2, help="--async-val: epochs allowed to wait for validation before training blocks (each holds a weight + optimizer snapshot)")
+    p.add_argument("--augment", action="store_true", help="Batched on-device augmentation (affine + intensity) for training batches")
+    p.add_argument("--aug-rotate", type=float, default=10.0, help="Max rotation (deg)")
+    p.add_argument("--aug-scale", type=float, default=0.1, help="Max relative scale change (0.1 -> 0.9..1.1)")
+    p.add_argument("--aug-translate", type=float, default=0.05, help="Max translation as a fraction of H/W")
+    p.add_argument("--aug-flip", type=float, default=0.5, help="Horizontal flip probability")
+    p.add_argument("--aug-gamma", type=float, default=0.3, help="Max |log gamma|")
+    p.add_argument("--aug-contrast", type=float, default=0.2, help="Max relative contrast change")
+    p.add_argument("--aug-noise", type=float, default=0.02, help="Gaussian noise std")
+    p.add_argument("--base-width", type=int, default=32, help="Channels of the first UNet level (doubled per level); e.g. 16 for a faster student")
+    p.add_argument("--teacher", help="Distillation: teacher checkpoint (best.pt) whose heatmaps also supervise this model")
+    p.add_argument("--distill-alpha", type=float, default=0.5, help="Weight of the teacher heatmap loss (1 - alpha goes to ground truth)")
+    p.add_argument("--teacher-cache", help="Run the teacher once and cache its heatmaps here (ignored with --augment)")
+    return p.parse_args(argv)
 
 
-def main():
-    args = parse_args()
+def split_dataset(dataset, args):
+    """Train/val subsets from --split-manifest, or a seeded 90/10 random split."""
+    if args.split_manifest:
+        with open(args.split_manifest, "r", encoding="utf-8") as fp:
+            manifest = json.load(fp)
+        index = {case_id: i for i, case_id in enumerate(dataset.case_ids())}
+        missing = [c for c in manifest["train"] + manifest["val"] if c not in index]
+        if missing:
+            raise ValueError(f"Cases in {args.split_manifest} not found in {args.data_dir}: {missing[:5]}")
+        train_set = torch.utils.data.Subset(dataset, [index[c] for c in manifest["train"]])
+        val_set = torch.utils.data.Subset(dataset, [index[c] for c in manifest["val"]])
+        return train_set, val_set
+    # simple split: 90/10
+    n_total = len(dataset)
+    n_val = max(1, n_total // 10)
+    n_train = n_total - n_val
+    generator = torch.Generator().manual_seed(args.seed)
+    return torch.utils.data.random_split(dataset, [n_train, n_val], generator=generator)
+
+
+def run(args):
+    """Train with parsed args; returns a summary dict (best val loss/epoch, save dir)."""
+    torch.manual_seed(args.seed)
     device = torch.device(args.device)
     save_dir = Path(args.save_dir)
     save_dir.mkdir(parents=True, exist_ok=True)
 
-    dataset = HeatmapDataset(
+    data_kwargs = dict(
         data_dir=args.data_dir,
         resize=tuple(args.resize),
         sigma=args.sigma,
+        return_heatmap=not args.augment,
+        cache_dir=args.cache_dir,
+        buckets=parse_buckets(args.buckets),
+        manifest=args.manifest,
     )
-    # simple split: 90/10
-    n_total = len(dataset)
-    n_val = max(1, n_total // 10)
-    n_train = n_total - n_val
-    train_set, val_set = torch.utils.data.random_split(dataset, [n_train, n_val])
+    dataset = HeatmapDataset(**data_kwargs)
+    train_set, val_set = split_dataset(dataset, args)
+    schedule = None
+    if args.resolution_schedule:
+        if args.buckets or args.patch_size or args.teacher_cache:
+            raise SystemExit("--resolution-schedule cannot be combined with --buckets, --patch-size or --teacher-cache")
+        schedule = resolution_schedule(args.resolution_schedule, tuple(args.resize), args.sigma, args.epochs)
+        # the training dataset switches resolution; val stays at the final --resize so losses compare across stages
+        val_set = torch.utils.data.Subset(HeatmapDataset(**data_kwargs), val_set.indices)
+    if args.patch_size:
+        if args.buckets or args.teacher_cache:
+            raise SystemExit("--patch-size cannot be combined with --buckets or --teacher-cache")
+        patch = dict(patch_size=tuple(args.patch_size), scale=args.patch_scale, sigma=args.sigma, return_heatmap=not args.augment)
+        train_set = PatchHeatmapDataset(
+            dataset, train_set.indices, patches_per_case=args.patches_per_case,
+            background_prob=args.background_prob, jitter=args.patch_jitter, **patch,
+        )
+        # fixed crops (one centred on each landmark) so val losses are comparable across epochs
+        val_set = PatchHeatmapDataset(dataset, val_set.indices, random_crops=False, **patch)
 
-    train_loader = DataLoader(train_set, batch_size=args.batch_size, shuffle=True, num_workers=args.num_workers)
-    val_loader = DataLoader(val_set, batch_size=args.batch_size, shuffle=False, num_workers=args.num_workers)
-
-    model = SmallUNet(num_landmarks=len(LANDMARK_ORDER)).to(device)
+    model = SmallUNet(num_landmarks=len(LANDMARK_ORDER), base_width=args.base_width)
+    if args.memory_budget:
+        if args.autotune_loader:
+            raise SystemExit("--memory-budget already chooses the micro-batch size; drop --autotune-loader")
+        plan = plan_memory(model, train_set[0], args.batch_size * args.grad_accum, args.memory_budget)
+        print(
+            f"Memory plan: checkpoint level {plan['checkpoint_level']}, micro-batch {plan['micro_batch']} x "
+            f"{plan['accum_steps']} accumulation steps (~{plan['est_mem_mb']:.0f} MB of {args.memory_budget:.0f} MB)"
+        )
+        args.checkpoint_level = plan["checkpoint_level"]
+        args.batch_size = plan["micro_batch"]
+        args.grad_accum = plan["accum_steps"]
+    model.set_checkpointing(args.checkpoint_level)
+    model = model.to(device)
     optimizer = torch.optim.AdamW(model.parameters(), lr=args.lr)
 
+    augment = None
+    if args.augment:
+        augment = BatchAugment(
+            rotate_deg=args.aug_rotate,
+            scale=args.aug_scale,
+            translate=args.aug_translate,
+            flip_prob=args.aug_flip,
+            gamma=args.aug_gamma,
+            contrast=args.aug_contrast,
+            noise_std=args.aug_noise,
+        )
+
+    teacher = None
+    if args.teacher:
+        teacher = load_teacher(args.teacher, device)
+        if args.teacher_cache and augment is None:
+            # fixed inputs -> teacher heatmaps computed once and read back by the dataset
+            teacher_dir = teacher_cache_dir(args.teacher_cache, args.teacher, dataset)
+            computed = build_teacher_cache(teacher, dataset, teacher_dir, device, args.batch_size, indices=train_set.indices)
+            print(f"Teacher cache {teacher_dir}: {computed} cases computed, {len(train_set) - computed} reused")
+            # only the training path reads teacher heatmaps; val gets its own dataset that skips them
+            val_set = torch.utils.data.Subset(HeatmapDataset(**data_kwargs), val_set.indices)
+            dataset.teacher_dir = str(teacher_dir)
+            teacher = None
+        elif args.teacher_cache:
+            print("--teacher-cache ignored with --augment: the teacher runs on every augmented batch")
+
+    if args.autotune_loader:
+        bench_opt = {}
+
+        def _bench_step(m, batch, dev):
+            opt = bench_opt.setdefault("opt", torch.optim.AdamW(m.parameters(), lr=args.lr))
+            train_step(m, batch, opt, dev, augment, args.sigma, teacher, args.distill_alpha)
+
+        print("Autotuning DataLoader...")
+        best = autotune_loader(
+            train_set,
+            model,
+            device,
+            _bench_step,
+            memory_budget_mb=args.loader_memory_budget,
+            batch_sampler_fn=(lambda bs: bucket_sampler_for(train_set, bs, True, args.seed)) if args.buckets else None,
+        )
+        args.batch_size = best["batch_size"]
+        args.num_workers = best["num_workers"]
+        args.prefetch_factor = best["prefetch_factor"]
+        print(
+            f"Loader: batch_size={args.batch_size} num_workers={args.num_workers} prefetch_factor={args.prefetch_factor} "
+            f"({best['samples_per_s']:.1f} samples/s, ~{best['est_mem_mb']:.0f} MB)"
+        )
+
+    # Persistent workers: spawned once and reused across epochs
+    train_loader = make_loader(
+        train_set, args.batch_size, True, args.num_workers, device, args.prefetch_factor,
+        batch_sampler=bucket_sampler_for(train_set, args.batch_size, True, args.seed),
+    )
+
     best_val = float("inf")
-    for epoch in range(1, args.epochs + 1):
-        train_loss = train_one_epoch(model, train_loader, optimizer, device)
-        val_loss = validate(model, val_loader, device)
-        print(f"[{epoch}/{args.epochs}] train {train_loss:.4f} | val {val_loss:.4f}")
-        ckpt = {
-            "epoch": epoch,
-            "model_state": model.state_dict(),
-            "optimizer_state": optimizer.state_dict(),
-            "val_loss": val_loss,
-            "config": vars(args),
-        }
-        torch.save(ckpt, save_dir / "last.pt")
+    best_epoch = 0
+    # per-epoch input size and wall time since the start of training (at the end of the epoch's
+    # training pass with --async-val, after its validation otherwise), for time-to-target reports
+    resolutions = [hw for hw, _ in schedule] if schedule else [tuple(args.resize)] * args.epochs
+    elapsed = {}
+    history = []
+    time_to_target = None
+
+    def val_message(ckpt):
+        msg = f"val {ckpt['val_loss']:.4f}"
+        summary = ckpt["val_metrics"]
+        if summary is not None:
+            msg += f" | MRE {summary['mre_mm']:.2f} mm"
+            if "angles_deg" in summary:
+                angle_mae = " ".join(f"{k} {v['mean']:.1f}" for k, v in summary["angles_deg"].items())
+                msg += f" | MAE deg {angle_mae}"
+        return msg
+
+    def commit(ckpt):
+        """Record one epoch's val result and update best.pt; called once per epoch, in epoch order."""
+        nonlocal best_val, best_epoch, time_to_target
+        epoch, val_loss = ckpt["epoch"], ckpt["val_loss"]
+        history.append({"epoch": epoch, "resize": list(resolutions[epoch - 1]), "elapsed_s": elapsed[epoch], "val_loss": val_loss})
+        if args.target_val_loss is not None and time_to_target is None and val_loss <= args.target_val_loss:
+            time_to_target = elapsed[epoch]
+            print(f"  -> reached target val {args.target_val_loss:.4f} at epoch {epoch} after {time_to_target:.1f} s")
         if val_loss < best_val:
-            best_val = val_loss
+            best_val = ckpt["val_loss"]
+            best_epoch = ckpt["epoch"]
             torch.save(ckpt, save_dir / "best.pt")
-            print(f"  -> saved best.pt (val {val_loss:.4f})")
+            print(f"  -> saved best.pt (val {best_val:.4f})")
+
+    # a patch crop almost never shows all five landmarks, so angle errors would be all NaN
+    angle_metrics = not args.patch_size
+    if args.eval_metrics and not angle_metrics:
+        print("Patch mode: angle metrics skipped during validation (run evaluate.py on full images for them)")
+    if args.async_val:
+        validator = AsyncValidator(
+            val_set, dict(num_landmarks=len(LANDMARK_ORDER), base_width=args.base_width), args.batch_size, args.sigma,
+            eval_metrics=args.eval_metrics, angle_metrics=angle_metrics, device=args.val_device or args.device,
+            num_workers=args.val_workers, threads=args.val_threads,
+        )
+    else:
+        validator = None
+        val_loader = make_loader(
+            val_set, args.batch_size, False, args.num_workers, device, args.prefetch_factor,
+            batch_sampler=bucket_sampler_for(val_set, args.batch_size, False),
+        )
+    # async: epoch -> checkpoint (weight snapshot taken at submit time) waiting for its val result
+    held = {}
+    last_saved = {"epoch": 0}
+
+    def commit_async(results):
+        for result in results:
+            ckpt = held.pop(result["epoch"])
+            ckpt.update(val_loss=result["val_loss"], val_metrics=result["val_metrics"])
+            print(f"  epoch {ckpt['epoch']} {val_message(ckpt)} ({result['seconds']:.1f} s in background)")
+            if ckpt["epoch"] == last_saved["epoch"]:
+                # last.pt was written before its result was known; fill it in while it is still the latest
+                torch.save(ckpt, save_dir / "last.pt")
+            commit(ckpt)
+
+    start = time.perf_counter()
+    try:
+        for epoch in range(1, args.epochs + 1):
+            sigma = args.sigma
+            if schedule is not None:
+                hw, sigma = schedule[epoch - 1]
+                if epoch == 1 or hw != schedule[epoch - 2][0]:
+                    print(f"Resolution {hw[0]}x{hw[1]} (sigma {sigma:.2f}) from epoch {epoch}")
+                # picked up by the persistent workers when the epoch's iterator starts
+                dataset.set_resolution(hw, sigma)
+            if augment is not None:
+                augment.reset_stats()
+            train_loss = train_one_epoch(
+                model, train_loader, optimizer, device, augment=augment, sigma=sigma,
+                teacher=teacher, distill_alpha=args.distill_alpha, accum_steps=args.grad_accum,
+            )
+            aug_msg = f" | aug {augment.ms_per_batch:.1f} ms/batch" if augment is not None else ""
+            if validator is not None:
+                elapsed[epoch] = time.perf_counter() - start
+                state = snapshot_state(model)
+                validator.submit(epoch, state)
+                held[epoch] = {
+                    "epoch": epoch,
+                    "model_state": state,
+                    "optimizer_state": copy.deepcopy(optimizer.state_dict()),
+                    "val_loss": None,
+                    "val_metrics": None,
+                    "config": vars(args),
+                }
+                torch.save(held[epoch], save_dir / "last.pt")
+                last_saved["epoch"] = epoch
+                print(f"[{epoch}/{args.epochs}] train {train_loss:.4f} | val queued{aug_msg}")
+                # only block when too many snapshots are waiting; otherwise take whatever has finished
+                commit_async(validator.ready(wait=validator.in_flight > args.max_pending_val))
+                continue
+            metrics = MetricAccumulator(angles=angle_metrics) if args.eval_metrics else None
+            val_loss = validate(model, val_loader, device, sigma=args.sigma, metrics=metrics)
+            elapsed[epoch] = time.perf_counter() - start
+            ckpt = {
+                "epoch": epoch,
+                "model_state": model.state_dict(),
+                "optimizer_state": optimizer.state_dict(),
+                "val_loss": val_loss,
+                "val_metrics": metrics.summary() if metrics is not None else None,
+                "config": vars(args),
+            }
+            print(f"[{epoch}/{args.epochs}] train {train_loss:.4f} | {val_message(ckpt)}{aug_msg}")
+            torch.save(ckpt, save_dir / "last.pt")
+            commit(ckpt)
+        if validator is not None:
+            commit_async(validator.drain())
+    finally:
+        if validator is not None:
+            validator.close()
+    print(f"Trained {args.epochs} epochs in {time.perf_counter() - start:.1f} s (best val {best_val:.4f} at epoch {best_epoch})")
+    if args.target_val_loss is not None and time_to_target is None:
+        print(f"  target val {args.target_val_loss:.4f} not reached")
+    return {
+        "best_val": best_val,
+        "best_epoch": best_epoch,
+        "save_dir": str(save_dir),
+        "history": history,
+        "time_to_target": time_to_target,
+    }
+
+
+def main():
+    run(parse_args())
 
 
 if __name__ == "__main__":